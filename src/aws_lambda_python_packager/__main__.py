@@ -6,6 +6,7 @@ import click
 import click_log
 
 from . import __version__
+from .cli.batch import batch
 from .cli.build import build
 from .cli.unify import unify
 
@@ -28,6 +29,7 @@ def main():
 
 
 main.add_command(build)
+main.add_command(batch)
 main.add_command(unify)
 
 if __name__ == "__main__":  # pragma: no cover
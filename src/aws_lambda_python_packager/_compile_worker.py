@@ -0,0 +1,50 @@
+"""
+Bytecode compile worker
+
+Run as a script under the *target* python interpreter. Reads one JSON request per line from
+stdin (``{"root": ..., "files": [...], "optimize": ..., "invalidation_mode": ...}``) and answers
+each with one JSON line (``{"compiled": [...], "errors": [[file, message], ...]}``).
+
+This file is executed by interpreters other than the one running the packager, so it only uses
+the standard library and syntax supported by every Lambda python version.
+"""
+import json
+import os
+import py_compile
+import sys
+
+
+def compile_request(request):
+    mode = getattr(py_compile.PycInvalidationMode, request["invalidation_mode"])
+    compiled = []
+    errors = []
+    for rel_path in request["files"]:
+        source = os.path.join(request["root"], rel_path)
+        try:
+            py_compile.compile(
+                source,
+                cfile=source + "c",
+                dfile=rel_path,
+                doraise=True,
+                optimize=request["optimize"],
+                invalidation_mode=mode,
+            )
+        except py_compile.PyCompileError as e:
+            errors.append([rel_path, e.msg.strip()])
+        except (OSError, ValueError) as e:
+            errors.append([rel_path, str(e)])
+        else:
+            compiled.append(rel_path)
+    return {"compiled": compiled, "errors": errors}
+
+
+def main():
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        sys.stdout.write(json.dumps(compile_request(json.loads(line))) + "\n")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
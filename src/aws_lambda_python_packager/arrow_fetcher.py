@@ -1,32 +1,63 @@
+from __future__ import annotations
+
+import json
 import logging
+import os
+import posixpath
 import shutil
 import tarfile
 import tempfile
 from contextlib import contextmanager, suppress
+from fnmatch import fnmatch
 from pathlib import Path
-from typing import Generator, Optional, Union
+from typing import Callable, ContextManager, Generator, Iterable, Optional, Union
 
 import fsspec
-import requests
-from appdirs import user_cache_dir
+
+from .metadata_client import get_client
+from .util import get_cache_dir, link_or_copy
 
 PYARROW_BUILDER_RELEASES = "https://api.github.com/repos/mumblepins/pyarrow-builder/releases/tags/{arrow_version}-py{python_version}"
+RELEASES_CACHE_TTL = 24 * 60 * 60  # 1 day
+# parts of pyarrow that can be left out when they are not imported, as globs relative to python/
+PYARROW_COMPONENTS = {
+    "flight": [
+        "pyarrow/_flight*",
+        "pyarrow/flight.py",
+        "pyarrow/libarrow_flight.so*",
+        "pyarrow/libarrow_python_flight.so*",
+    ],
+    "gandiva": ["pyarrow/gandiva*", "pyarrow/libgandiva.so*"],
+    "plasma": [
+        "pyarrow/_plasma*",
+        "pyarrow/plasma.py",
+        "pyarrow/libplasma.so*",
+        "pyarrow/plasma-store-server",
+    ],
+    "dataset": ["pyarrow/_dataset*", "pyarrow/dataset.py", "pyarrow/libarrow_dataset.so*"],
+    "headers": [
+        "pyarrow/include",
+        "pyarrow/include/*",
+        "pyarrow/src",
+        "pyarrow/src/*",
+        "pyarrow/*.h",
+        "pyarrow/*.pxd",
+        "pyarrow/*.pyx",
+    ],
+}
 LOG = logging.getLogger(__name__)
 
 
 def get_arrow_version(arrow_version: str, python_version: str, arch: str) -> Optional[str]:
-    r = requests.get(
+    r = get_client().get(
         PYARROW_BUILDER_RELEASES.format(python_version=python_version, arrow_version=arrow_version),
-        timeout=10,
+        ttl=RELEASES_CACHE_TTL,
     )
     if r.status_code == 404:
         return None
     r.raise_for_status()
     rj = r.json()
-    if arch.lower().startswith("arm"):
-        arch = "aarch64"
-    elif arch.lower().startswith("amd"):
-        arch = "x86_64"
+    arch = normalize_arch(arch)
 
     for a in rj["assets"]:
         if a["name"].endswith(f"{arrow_version}-py{python_version}-{arch}.tar.gz"):
@@ -36,14 +67,13 @@ def get_arrow_version(arrow_version: str, python_version: str, arch: str) -> Opt
 
 @contextmanager
 def open_zip_file(url: object) -> Generator[tarfile.TarFile, None, None]:
+    """Opens a remote tarball as a stream, members have to be read in order"""
     for filesystem_type in (
         {
             "args": ("simplecache",),
             "kwargs": {
                 "target_protocol": "http",
-                "cache_storage": str(
-                    (Path(user_cache_dir("lambda-packager")) / "simplecache").resolve()
-                ),
+                "cache_storage": str(get_cache_dir("simplecache").resolve()),
             },
         },
         {
@@ -55,7 +85,7 @@ def open_zip_file(url: object) -> Generator[tarfile.TarFile, None, None]:
         try:
             fs = fsspec.filesystem(*filesystem_type["args"], **filesystem_type["kwargs"])
             f = fs.open(url, "rb")
-            z = tarfile.open(fileobj=f)
+            z = tarfile.open(fileobj=f, mode="r|*")
             yield z
         except (KeyError, AttributeError):
             continue
@@ -69,18 +99,283 @@ def open_zip_file(url: object) -> Generator[tarfile.TarFile, None, None]:
                     f.close()
 
 
+def _excluded_patterns(exclude_components: Iterable[str]) -> list[str]:
+    patterns = []
+    for component in exclude_components:
+        if component not in PYARROW_COMPONENTS:
+            raise ValueError(
+                f"Unknown pyarrow component {component}, expected one of {list(PYARROW_COMPONENTS)}"
+            )
+        patterns.extend(PYARROW_COMPONENTS[component])
+    return patterns
+
+
+def _relative(name: str, prefix: str) -> str:
+    """Normalized path of ``name`` below ``prefix``, which it must start with"""
+    start = len(prefix)
+    return posixpath.normpath(name[start:])
+
+
+def _escapes(rel: str) -> bool:
+    """Whether a normalized relative path points outside of the directory it is relative to"""
+    return posixpath.isabs(rel) or rel == ".." or rel.startswith("../")
+
+
+def _through_symlink(dest: Path, rel: str) -> bool:
+    """Whether writing ``rel`` below ``dest`` would follow a symlink extracted earlier"""
+    path = dest
+    for part in rel.split("/")[:-1]:
+        path = path / part
+        if path.is_symlink():
+            return True
+    return False
+
+
+def _member_rel(member: tarfile.TarInfo, prefix: str, exclude_patterns: list[str]) -> str | None:
+    """Path of a member relative to ``prefix``, or None if it is not extracted"""
+    if not member.name.startswith(prefix):
+        return None
+    rel = _relative(member.name, prefix)
+    if rel == "." or _escapes(rel) or any(fnmatch(rel, p) for p in exclude_patterns):
+        return None
+    return rel
+
+
+def _link_inside(member: tarfile.TarInfo, rel: str, dest: Path, prefix: str) -> bool:
+    """Whether a symlink or hard link member points to something inside the package"""
+    if member.issym():
+        target = posixpath.normpath(posixpath.join(posixpath.dirname(rel), member.linkname))
+        resolved = os.path.relpath(
+            os.path.realpath(dest.joinpath(*rel.split("/")).parent / member.linkname),
+            os.path.realpath(dest),
+        )
+        return not (posixpath.isabs(member.linkname) or _escapes(target) or _escapes(resolved))
+    if not member.linkname.startswith(prefix):
+        return False
+    target = _relative(member.linkname, prefix)
+    return not (target == "." or _escapes(target) or _through_symlink(dest, target))
+
+
+def extract_python_members(
+    tar: tarfile.TarFile,
+    dest: Union[str, Path],
+    exclude_patterns: Iterable[str] = (),
+    prefix: str = "python/",
+) -> int:
+    """Writes the members below ``python/`` of a (streamed) tarball to ``dest``
+
+    Args:
+        tar: The tarball, may be opened in stream mode
+        dest: Directory the contents of ``python/`` are written to
+        exclude_patterns: Glob patterns (relative to ``python/``) of members to leave out
+        prefix: Directory of the tarball to extract instead of ``python/``, ``""`` for all of it
+
+    Returns:
+        The number of extracted members
+    """
+    dest = Path(dest)
+    exclude_patterns = list(exclude_patterns)
+    extracted = 0
+    for member in tar:
+        rel = _member_rel(member, prefix, exclude_patterns)
+        if rel is None:
+            continue
+        if _through_symlink(dest, rel):
+            LOG.warning("Skipping %s, its parent directory is a symlink", member.name)
+            continue
+        path = dest.joinpath(*rel.split("/"))
+        if path.is_symlink():
+            # never write through a link, replace it like tarfile does
+            path.unlink()
+        if member.isdir():
+            path.mkdir(parents=True, exist_ok=True)
+            continue
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if member.isfile():
+            with tar.extractfile(member) as src, open(path, "wb") as dst:  # type: ignore[union-attr]
+                shutil.copyfileobj(src, dst, 1 << 20)
+            os.chmod(path, member.mode & 0o777)
+            os.utime(path, (member.mtime, member.mtime))
+        elif member.issym() or member.islnk():
+            if not _link_inside(member, rel, dest, prefix):
+                LOG.warning("Skipping %s, it links outside of the package", member.name)
+                continue
+            if member.issym():
+                os.symlink(member.linkname, path)
+            else:
+                target = _relative(member.linkname, prefix)
+                os.link(dest.joinpath(*target.split("/")), path, follow_symlinks=False)
+        else:
+            continue
+        extracted += 1
+    return extracted
+
+
+def normalize_arch(arch: str) -> str:
+    if arch.lower().startswith("arm"):
+        return "aarch64"
+    if arch.lower().startswith("amd"):
+        return "x86_64"
+    return arch
+
+
+def cached_tree(
+    entry: Path,
+    resolve_url: Callable[[], Optional[str]],
+    prefix: str = "python/",
+    opener: Optional[Callable[[str], ContextManager[tarfile.TarFile]]] = None,
+) -> Optional[Path]:
+    """Gets a tree extracted from a tarball, extracting it into the cache entry the first time
+
+    The tarball URL is kept in the entry as well, so it is only resolved once.
+
+    Args:
+        entry: Cache directory of the tarball
+        resolve_url: Returns the tarball URL, or None if there is no tarball
+        prefix: Directory in the tarball to extract, see :func:`extract_python_members`
+        opener: Opens the tarball URL as a stream, :func:`open_zip_file` by default
+
+    Returns:
+        Path of the cached tree, which must not be modified, or None if there is no tarball
+    """
+    tree = entry / "tree"
+    if tree.is_dir():
+        return tree
+    meta_path = entry / "meta.json"
+    try:
+        url = json.loads(meta_path.read_text("utf8"))["url"]
+    except (OSError, ValueError, KeyError):
+        url = resolve_url()
+    if url is None:
+        return None
+    meta_path.write_text(json.dumps({"url": url}), "utf8")
+    tmp_tree = Path(tempfile.mkdtemp(prefix="tree-", suffix=".tmp", dir=entry))
+    try:
+        with (opener or open_zip_file)(url) as zfh:
+            extracted = extract_python_members(zfh, tmp_tree, prefix=prefix)
+        LOG.info("Extracted %s files of %s to the cache", extracted, url)
+        try:
+            os.rename(tmp_tree, tree)
+        except OSError:
+            if not tree.is_dir():  # pragma: no cover
+                raise
+            # extracted by another build in the meantime
+    finally:
+        shutil.rmtree(tmp_tree, ignore_errors=True)
+    return tree
+
+
+def cached_arrow_tree(package_version: str, python_version="3.9", arch="x86_64") -> Path:
+    """Gets the extracted ``python/`` tree of a pyarrow build from the cache
+
+    The tree and the release asset URL are kept per (pyarrow version, python version,
+    architecture) in the lambda-packager cache, the build is only looked up and downloaded the
+    first time.
+
+    Returns:
+        Path of the cached tree, which must not be modified
+
+    Raises:
+        ValueError: if there is no such build
+    """
+    entry = get_cache_dir("pyarrow", f"{package_version}-py{python_version}-{normalize_arch(arch)}")
+    tree = cached_tree(entry, lambda: get_arrow_version(package_version, python_version, arch))
+    if tree is None:
+        raise ValueError(f"Could not find package  arrow with version {package_version}")
+    return tree
+
+
+def place_tree(src: Path, dest: Path, exclude_patterns: Iterable[str] = ()) -> int:
+    """Hard links (or copies) the files of ``src`` into ``dest``, recreating symlinks
+
+    Args:
+        src: Directory to place
+        dest: Directory to place it in
+        exclude_patterns: Glob patterns (relative to ``src``) of files and directories to leave out
+
+    Returns:
+        The number of placed files
+    """
+    exclude_patterns = list(exclude_patterns)
+    placed = 0
+    for dirpath, dirnames, filenames in os.walk(src):
+        rel_dir = Path(dirpath).relative_to(src).as_posix()
+        prefix = "" if rel_dir == "." else rel_dir + "/"
+        dirnames[:] = [
+            d for d in dirnames if not any(fnmatch(prefix + d, p) for p in exclude_patterns)
+        ]
+        (dest / prefix).mkdir(parents=True, exist_ok=True)
+        for name in filenames + [d for d in dirnames if Path(dirpath, d).is_symlink()]:
+            if any(fnmatch(prefix + name, p) for p in exclude_patterns):
+                continue
+            path = Path(dirpath, name)
+            if path.is_symlink():
+                os.symlink(os.readlink(path), dest / prefix / name)
+            else:
+                link_or_copy(path, dest / prefix / name)
+            placed += 1
+    return placed
+
+
 def fetch_arrow_package(
     output_dir: Union[str, Path],
     package_version: str,
     python_version="3.9",
     arch="x86_64",
+    exclude_components: Iterable[str] = (),
+    use_cache: bool = True,
 ):
-    if (pkg_url := get_arrow_version(package_version, python_version, arch)) is None:
-        raise ValueError(f"Could not find package  arrow with version {package_version}")
-    with open_zip_file(pkg_url) as zfh, tempfile.TemporaryDirectory() as tmpdir:
-        zfh.extractall(tmpdir)
+    """Replaces pyarrow in ``output_dir`` with the build for the Lambda environment
+
+    The new pyarrow is put together in a directory inside ``output_dir`` that is moved into place
+    once complete, so a failed download leaves the existing pyarrow untouched. With the cache, its
+    files are hard linked from :func:`cached_arrow_tree`; otherwise the tarball is streamed and
+    only its ``python/`` directory is written.
 
-        Path(output_dir).mkdir(parents=True, exist_ok=True)
-        for p in (Path(tmpdir) / "python").glob("*"):
-            shutil.copytree(p, Path(output_dir) / p.name, dirs_exist_ok=True)
-        return package_version
+    Args:
+        output_dir: Package directory
+        package_version: pyarrow version
+        python_version: Target python version
+        arch: Target architecture
+        exclude_components: pyarrow components to leave out, see ``PYARROW_COMPONENTS``
+        use_cache: Use the extracted build from the lambda-packager cache
+
+    Returns:
+        The pyarrow version
+    """
+    exclude_patterns = _excluded_patterns(exclude_components)
+    tree = pkg_url = None
+    if use_cache:
+        tree = cached_arrow_tree(package_version, python_version, arch)
+    elif (pkg_url := get_arrow_version(package_version, python_version, arch)) is None:
+        raise ValueError(f"Could not find package  arrow with version {package_version}")
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(prefix=".pyarrow-", dir=output_dir))
+    try:
+        if tree is not None:
+            placed = place_tree(tree, staging, exclude_patterns)
+            LOG.info("Placed %s files of pyarrow %s from the cache", placed, package_version)
+        else:
+            with open_zip_file(pkg_url) as zfh:
+                extracted = extract_python_members(zfh, staging, exclude_patterns)
+            LOG.info("Extracted %s files of pyarrow %s", extracted, package_version)
+        for old in output_dir.glob("pyarrow*"):
+            if old.is_dir() and not old.is_symlink():
+                shutil.rmtree(old)
+            else:
+                old.unlink()
+        for p in staging.iterdir():
+            if (output_dir / p.name).is_dir() and p.is_dir():
+                shutil.copytree(
+                    p,
+                    output_dir / p.name,
+                    symlinks=True,
+                    dirs_exist_ok=True,
+                    copy_function=os.replace,
+                )
+            else:
+                os.replace(p, output_dir / p.name)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return package_version
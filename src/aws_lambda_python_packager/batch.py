@@ -0,0 +1,332 @@
+"""
+Batch Builds
+
+Builds many functions (e.g. every function of a monorepo) in one run. The functions are listed
+as project directories or read from the ``CodeUri`` of the functions in a SAM template. They are
+built by a bounded pool of worker processes, which are reused from function to function, and
+share the on-disk caches: the Lambda runtime table and the packages in the Lambda environment are
+fetched once up front, and with ``--wheelhouse`` the wheelhouses are shared by all functions of a
+target. A function that fails to build does not stop the others. Packages the functions have in
+common can then be moved to shared layers, see :mod:`.layer_optimizer`.
+
+"""
+from __future__ import annotations
+
+import json
+import logging
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Iterable
+
+from .dep_analyzer import PACKAGE_URL, PACKAGES_CACHE_TTL
+from .lambda_packager import LambdaPackager, sizeof_fmt
+from .layer_optimizer import LayerPlan, apply_plan, plan_layers, scan_function
+from .metadata_client import get_client
+from .util import PathType, get_platforms, zip_directory
+
+LOG = logging.getLogger(__name__)
+
+TEMPLATE_NAMES = ("template.yaml", "template.yml", "template.json")
+SAM_FUNCTION_TYPE = "AWS::Serverless::Function"
+
+BatchItem = namedtuple("BatchItem", ["name", "project_path", "python_version", "architecture"])
+BatchResult = namedtuple("BatchResult", ["item", "outputs", "seconds", "size", "error"])
+
+
+class TemplateError(Exception):
+    pass
+
+
+def _yaml_loader():
+    try:
+        import yaml  # pylint: disable=import-outside-toplevel
+    except ImportError as e:  # pragma: no cover
+        raise TemplateError(
+            "Reading YAML templates requires PyYAML, install aws-lambda-python-packager[sam]"
+        ) from e
+
+    class _TemplateLoader(yaml.SafeLoader):  # pylint: disable=too-many-ancestors
+        pass
+
+    def _intrinsic(loader, tag_suffix, node):
+        # short form intrinsic functions (!Ref, !Sub, ...), as their long form
+        name = "Ref" if tag_suffix == "Ref" else f"Fn::{tag_suffix}"
+        if isinstance(node, yaml.ScalarNode):
+            value: Any = loader.construct_scalar(node)
+        elif isinstance(node, yaml.SequenceNode):
+            value = loader.construct_sequence(node, deep=True)
+        else:
+            value = loader.construct_mapping(node, deep=True)
+        return {name: value}
+
+    _TemplateLoader.add_multi_constructor("!", _intrinsic)
+    return yaml, _TemplateLoader
+
+
+def load_template(path: PathType) -> dict:
+    """Loads a SAM (or CloudFormation) template in YAML or JSON format"""
+    text = Path(path).read_text("utf8")
+    if Path(path).suffix == ".json" or text.lstrip().startswith("{"):
+        return json.loads(text)
+    yaml, loader = _yaml_loader()
+    return yaml.load(text, Loader=loader)  # nosec
+
+
+def _python_version(runtime: Any) -> str | None:
+    if isinstance(runtime, str) and runtime.startswith("python"):
+        return runtime.partition("python")[2]
+    return None
+
+
+def items_from_template(path: PathType) -> list[BatchItem]:
+    """Lists the python functions of a SAM template
+
+    Functions with a local ``CodeUri`` and a python ``Runtime`` (of their own or from the
+    ``Globals``) are built for that runtime and the first of their ``Architectures``. Functions
+    packaged as images or with code in S3 are skipped.
+
+    Raises:
+        TemplateError: if the template can't be read
+    """
+    path = Path(path)
+    try:
+        template = load_template(path)
+    except (OSError, ValueError) as e:
+        raise TemplateError(f"Unable to read {path}: {e}") from e
+    defaults = (template.get("Globals") or {}).get("Function") or {}
+    items = []
+    for name, resource in (template.get("Resources") or {}).items():
+        if resource.get("Type") != SAM_FUNCTION_TYPE:
+            continue
+        props = {**defaults, **(resource.get("Properties") or {})}
+        code_uri = props.get("CodeUri")
+        python_version = _python_version(props.get("Runtime"))
+        if props.get("PackageType") == "Image" or python_version is None:
+            LOG.debug("Skipping %s, it is not a python function", name)
+            continue
+        if not isinstance(code_uri, str) or code_uri.startswith("s3://"):
+            LOG.warning("Skipping %s, its code is not in a local directory", name)
+            continue
+        architectures = props.get("Architectures") or ["x86_64"]
+        items.append(
+            BatchItem(name, (path.parent / code_uri).resolve(), python_version, architectures[0])
+        )
+    return items
+
+
+def collect_items(sources: Iterable[PathType]) -> list[BatchItem]:
+    """Lists the functions to build
+
+    Args:
+        sources: Project directories, SAM templates, or directories with a SAM template (and no
+            dependency file of their own)
+
+    Returns:
+        The functions, named after their template resource or project directory
+    """
+    items: list[BatchItem] = []
+    for source in sources:
+        source = Path(source)
+        if source.is_dir() and not any(
+            (source / f).exists() for f in ("pyproject.toml", "requirements.txt")
+        ):
+            template = next((source / t for t in TEMPLATE_NAMES if (source / t).is_file()), None)
+            if template is not None:
+                source = template
+        if source.is_file():
+            items.extend(items_from_template(source))
+        else:
+            items.append(BatchItem(source.resolve().name, source.resolve(), None, None))
+    # outputs are named after the functions, so the names have to be unique
+    seen: dict[str, int] = {}
+    unique = []
+    for item in items:
+        seen[item.name] = seen.get(item.name, 0) + 1
+        name = item.name if seen[item.name] == 1 else f"{item.name}-{seen[item.name]}"
+        unique.append(item._replace(name=name))
+    return unique
+
+
+def prefetch_metadata(targets: Iterable[tuple[str, str]], region: str, ignore_packages: bool):
+    """Fills the on-disk caches the builds read, so the workers don't all fetch them"""
+    get_platforms()
+    if not ignore_packages:
+        return
+    for python_version, architecture in set(targets):
+        try:
+            get_client().get(
+                PACKAGE_URL.format(
+                    region=region, architecture=architecture, python_version=python_version
+                ),
+                ttl=PACKAGES_CACHE_TTL,
+                timeout=30,
+            )
+        except Exception as e:  # pylint: disable=broad-except
+            LOG.debug(
+                "Unable to prefetch the packages of %s %s: %s", python_version, architecture, e
+            )
+
+
+def build_item(
+    item: BatchItem,
+    output_dir: PathType,
+    packager_kwargs: dict[str, Any],
+    package_kwargs: dict[str, Any],
+) -> BatchResult:
+    """Builds a single function, errors are returned in the result instead of raised"""
+    start = time.monotonic()
+    try:
+        packager = LambdaPackager(
+            item.project_path,
+            output_dir,
+            python_version=item.python_version,
+            architecture=item.architecture,
+            **packager_kwargs,
+        )
+        outputs = packager.package(**package_kwargs)
+        size = packager.get_total_size()
+    except Exception as e:  # pylint: disable=broad-except
+        LOG.debug("Building %s failed\n%s", item.name, traceback.format_exc())
+        return BatchResult(item, None, time.monotonic() - start, None, f"{type(e).__name__}: {e}")
+    return BatchResult(item, outputs, time.monotonic() - start, size, None)
+
+
+def build_batch(
+    items: list[BatchItem],
+    output_dir: PathType,
+    packager_kwargs: dict[str, Any] | None = None,
+    package_kwargs: dict[str, Any] | None = None,
+    workers: int = 4,
+    python_version: str = "3.9",
+    architecture: str = "x86_64",
+) -> list[BatchResult]:
+    """Builds many functions
+
+    Args:
+        items: The functions to build, see :func:`collect_items`
+        output_dir: Directory to write the outputs to, one directory per function named after it
+        packager_kwargs: Additional arguments of :class:`LambdaPackager`, the same for all
+            functions
+        package_kwargs: Arguments of :meth:`LambdaPackager.package`, the same for all functions
+        workers: Maximum number of functions built at the same time
+        python_version: Python version of the functions that don't specify one
+        architecture: Architecture of the functions that don't specify one
+
+    Returns:
+        A BatchResult for every function, in the order of ``items``
+
+    Raises:
+        ValueError: when updating the dependency files, which the functions may share
+    """
+    packager_kwargs = dict(packager_kwargs or {})
+    package_kwargs = dict(package_kwargs or {})
+    if packager_kwargs.get("update_dependencies"):
+        raise ValueError("Batch builds can't update the dependency files")
+    if not isinstance(package_kwargs.get("zip_output", False), bool):
+        # every function is zipped next to its own output directory
+        package_kwargs["zip_output"] = True
+    items = [
+        item._replace(
+            python_version=item.python_version or python_version,
+            architecture=item.architecture or architecture,
+        )
+        for item in items
+    ]
+    prefetch_metadata(
+        [(i.python_version, i.architecture) for i in items],
+        packager_kwargs.get("region", "us-east-1"),
+        packager_kwargs.get("ignore_packages", False),
+    )
+    output_dir = Path(output_dir)
+    with ProcessPoolExecutor(max(1, workers)) as pool:
+        futures = [
+            pool.submit(build_item, item, output_dir / item.name, packager_kwargs, package_kwargs)
+            for item in items
+        ]
+        results = []
+        for item, future in zip(items, futures):
+            try:
+                result = future.result()
+            except Exception as e:  # pylint: disable=broad-except
+                # the worker itself died
+                result = BatchResult(item, None, 0.0, None, f"{type(e).__name__}: {e}")
+            if result.error:
+                LOG.error("Building %s failed: %s", item.name, result.error)
+            else:
+                LOG.warning("Built %s in %0.1fs", item.name, result.seconds)
+            results.append(result)
+    return results
+
+
+def share_layers(
+    results: list[BatchResult],
+    layers_dir: PathType,
+    zip_output: bool = False,
+    **plan_kwargs,
+) -> LayerPlan:
+    """Moves the packages the built functions have in common into shared layers
+
+    Args:
+        results: Results of :func:`build_batch`, failed functions are left alone
+        layers_dir: Directory to write the layers and the plan to
+        zip_output: Zip the layers, and zip the functions that changed again
+        **plan_kwargs: Additional arguments of :func:`.layer_optimizer.plan_layers`
+
+    Returns:
+        The LayerPlan applied
+    """
+    built = [r for r in results if not r.error]
+    functions = [
+        # packages are in the layer directory of a split build, which takes up a layer already
+        scan_function(
+            r.item.name,
+            r.outputs[1] or r.outputs[0],
+            (r.item.python_version, r.item.architecture),
+            layers=1 if r.outputs[1] else 0,
+        )
+        for r in built
+    ]
+    plan = plan_layers(functions, **plan_kwargs)
+    apply_plan(plan, functions, layers_dir)
+    if zip_output:
+        changed = {n for layer in plan.layers.values() for n in layer.functions}
+        for r in built:
+            if r.item.name in changed:
+                output = r.outputs[0].parent if r.outputs[1] else r.outputs[0]
+                zip_directory(output, str(output) + ".zip")
+        for name in plan.layers:
+            zip_directory(Path(layers_dir) / name, Path(layers_dir) / f"{name}.zip")
+    return plan
+
+
+def format_layers(plan: LayerPlan) -> str:
+    """Formats the layers of every function of a LayerPlan"""
+    lines = [f"{len(plan.layers)} shared layers, {sizeof_fmt(plan.saved)} deployed once instead"]
+    for name, layers in sorted(plan.assignments.items()):
+        lines.append(f"  {name}: {', '.join(layers) or '-'}")
+    return "\n".join(lines)
+
+
+def format_summary(results: list[BatchResult]) -> str:
+    """Formats the results of a batch build as a table"""
+    rows = [("Function", "Target", "Time", "Size", "Status")]
+    for r in results:
+        rows.append(
+            (
+                r.item.name,
+                f"python{r.item.python_version} {r.item.architecture}",
+                f"{r.seconds:0.1f}s",
+                sizeof_fmt(r.size) if r.size is not None else "-",
+                "failed: " + r.error if r.error else "ok",
+            )
+        )
+    total = sum(r.seconds for r in results)
+    failed = sum(1 for r in results if r.error)
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]) - 1)]
+    lines = ["  ".join(c.ljust(w) for c, w in zip(row, widths)) + "  " + row[-1] for row in rows]
+    lines.insert(1, "  ".join("-" * w for w in widths) + "  ------")
+    lines.append(f"{len(results) - failed} built, {failed} failed, {total:0.1f}s of build time")
+    return "\n".join(lines)
@@ -0,0 +1,147 @@
+"""
+Build Cache
+
+Caches complete build outputs keyed on a fingerprint of everything that goes into a build: the
+dependency files, the project sources, the target platform, the packaging options, the list of
+ignored packages and the packager version. Builds are deterministic (file times are reset and
+compressed files carry no timestamp), so a cached output is identical to a fresh one.
+
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from . import __version__
+from .util import PathType, get_cache_dir
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .lambda_packager import LambdaPackager
+
+LOG = logging.getLogger(__name__)
+
+DEPENDENCY_FILES = ("pyproject.toml", "poetry.lock", "requirements.txt")
+DEFAULT_MAX_ENTRIES = 10
+
+
+def _is_bytecode(path: Path) -> bool:
+    # left behind by running or importing the project locally
+    return path.suffix == ".pyc" or "__pycache__" in path.parts
+
+
+def _hash_tree(digest, root: Path, paths) -> None:
+    for path in sorted(paths):
+        if path.is_file() and not _is_bytecode(path.relative_to(root)):
+            digest.update(path.relative_to(root).as_posix().encode() + b"\0")
+            digest.update(path.read_bytes())
+            digest.update(b"\0")
+
+
+class BuildCache:
+    """Stores build outputs (directory and zip) in the user cache directory
+
+    Args:
+        cache_dir: Cache directory, defaults to ``builds`` in the lambda-packager cache
+        max_entries: Number of builds to keep, the least recently used ones are removed first
+    """
+
+    def __init__(self, cache_dir: PathType | None = None, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else get_cache_dir("builds")
+        self.max_entries = max_entries
+
+    @staticmethod
+    def fingerprint(packager: LambdaPackager, options: dict) -> str:
+        """Computes the cache key of a build
+
+        Args:
+            packager: The packager that is going to run the build
+            options: The options that affect the build output
+
+        Returns:
+            A hex digest identifying the build inputs
+        """
+        project = packager.project_path
+        digest = hashlib.sha256()
+        meta = {
+            "packager_version": __version__,
+            "python_version": packager.python_version,
+            "architecture": packager.architecture,
+            "region": packager.region,
+            "ignore_packages": packager.ignore_packages,
+            "update_dependencies": packager.update_dependencies,
+            "split_layer": packager.split_layer,
+            "ignored": packager.analyzer.pkgs_to_ignore_dict,
+            "options": options,
+        }
+        digest.update(json.dumps(meta, sort_keys=True, default=str).encode())
+        _hash_tree(digest, project, [project / f for f in DEPENDENCY_FILES])
+        # the same files DepAnalyzer.install_root copies into the package
+        src = project / "src"
+        if src.exists():
+            _hash_tree(digest, project, src.glob("**/*"))
+        else:
+            _hash_tree(digest, project, project.glob("*.py"))
+        return digest.hexdigest()
+
+    def _entry(self, key: str) -> Path:
+        return self.cache_dir / key
+
+    def restore(self, key: str, output_dir: PathType, zip_path: PathType | None = None) -> bool:
+        """Restores a cached build, returns False if there is none"""
+        entry = self._entry(key)
+        if not (entry / "output").is_dir() or (zip_path and not (entry / "output.zip").is_file()):
+            return False
+        output_dir = Path(output_dir)
+        if output_dir.exists():
+            shutil.rmtree(output_dir)
+        shutil.copytree(entry / "output", output_dir, symlinks=True)
+        if zip_path:
+            shutil.copy2(entry / "output.zip", zip_path)
+        self._touch(entry)
+        return True
+
+    @staticmethod
+    def _touch(entry: Path) -> None:
+        # the entry's mtime records when it was last used
+        now = time.time_ns()
+        os.utime(entry, ns=(now, now))
+
+    def store(self, key: str, output_dir: PathType, zip_path: PathType | None = None) -> None:
+        """Adds a finished build to the cache"""
+        entry = self._entry(key)
+        tmp_entry = entry.with_name(f"{key}.{os.getpid()}.tmp")
+        try:
+            shutil.copytree(output_dir, tmp_entry / "output", symlinks=True)
+            if zip_path:
+                shutil.copy2(zip_path, tmp_entry / "output.zip")
+            if entry.exists():
+                shutil.rmtree(entry)
+            os.replace(tmp_entry, entry)
+            self._touch(entry)
+        except OSError as e:
+            LOG.warning("Unable to store build in cache: %s", e)
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            return
+        self.prune()
+
+    def prune(self) -> None:
+        """Removes the least recently used builds beyond ``max_entries``"""
+        entries = sorted(
+            (p for p in self.cache_dir.iterdir() if p.is_dir() and not p.name.endswith(".tmp")),
+            key=lambda p: p.stat().st_mtime_ns,
+            reverse=True,
+        )
+        keep = self.max_entries
+        for entry in entries[keep:]:
+            LOG.debug("Removing cached build %s", entry.name)
+            shutil.rmtree(entry, ignore_errors=True)
+        # leftovers of interrupted stores
+        for tmp in self.cache_dir.glob("*.tmp"):
+            if time.time() - tmp.stat().st_mtime > 86400:
+                shutil.rmtree(tmp, ignore_errors=True)
@@ -0,0 +1,418 @@
+"""
+Bytecode
+
+Compiles python sources to legacy (sourceless) ``.pyc`` files next to the source, spread over a
+pool of worker processes. When the target python version differs from the one running the
+packager, the workers are run under a matching interpreter found on the PATH or with pyenv.
+Compiled files can be kept in a content addressed :class:`BytecodeCache`, so unchanged sources
+are not compiled again on the next build.
+
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import platform
+import py_compile
+import queue
+import shutil
+import subprocess  # nosec B404
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from py_compile import PycInvalidationMode
+
+from .util import PathType, link_or_copy
+
+LOG = logging.getLogger(__name__)
+
+CompileResult = namedtuple("CompileResult", ["compiled", "errors", "cached"], defaults=[0])
+_WORKER_SCRIPT = Path(__file__).parent / "_compile_worker.py"
+DEFAULT_MAX_AGE = 30 * 86400  # 30 days
+
+
+def _compile_batch(
+    root: str, rel_paths: list[str], optimize: int, invalidation_mode: PycInvalidationMode
+) -> CompileResult:
+    compiled = []
+    errors = []
+    for rel_path in rel_paths:
+        source = os.path.join(root, rel_path)
+        try:
+            py_compile.compile(
+                source,
+                cfile=source + "c",
+                dfile=rel_path,
+                doraise=True,
+                optimize=optimize,
+                invalidation_mode=invalidation_mode,
+            )
+        except py_compile.PyCompileError as e:
+            errors.append((rel_path, e.msg.strip()))
+        except (OSError, ValueError) as e:
+            errors.append((rel_path, str(e)))
+        else:
+            compiled.append(rel_path)
+    return CompileResult(compiled, errors)
+
+
+def _split(items: list[str], batches: int) -> list[list[str]]:
+    return [items[i::batches] for i in range(batches) if items[i::batches]]
+
+
+def short_version(python_version: str) -> str:
+    """Normalizes ``python3.9``, ``3.9`` or ``3.9.16`` to ``3.9``"""
+    return ".".join(python_version.lower().strip().lstrip("python").split(".")[:2])
+
+
+def interpreter_version(interpreter: PathType) -> str | None:
+    """Gets the ``major.minor`` version of a python interpreter, or None if it can't be run"""
+    try:
+        proc = subprocess.run(  # nosec B603
+            [os.fspath(interpreter), "-c", "import sys; print('%d.%d' % sys.version_info[:2])"],
+            capture_output=True,
+            timeout=30,
+            check=True,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return proc.stdout.decode().strip()
+
+
+def _pyenv_candidates(version: str) -> list[Path]:
+    roots = []
+    if os.environ.get("PYENV_ROOT"):
+        roots.append(Path(os.environ["PYENV_ROOT"]))
+    pyenv = shutil.which("pyenv")
+    if pyenv:
+        try:
+            proc = subprocess.run(  # nosec B603
+                [pyenv, "root"], capture_output=True, timeout=30, check=True
+            )
+            roots.append(Path(proc.stdout.decode().strip()))
+        except (OSError, subprocess.SubprocessError):
+            pass
+    roots.append(Path.home() / ".pyenv")
+    candidates: list[Path] = []
+    for root in dict.fromkeys(roots):
+        # newest patch release first
+        versions = sorted(
+            (root / "versions").glob(f"{version}.*"),
+            key=lambda p: [int(v) if v.isdigit() else 0 for v in p.name.split(".")],
+            reverse=True,
+        )
+        candidates.extend(v / "bin" / f"python{version}" for v in versions)
+    return candidates
+
+
+def find_python_interpreter(python_version: str, interpreter: PathType | None = None) -> str | None:
+    """Finds an interpreter for the given python version
+
+    Tries, in order, an explicitly configured interpreter, the running interpreter,
+    ``pythonX.Y`` on the PATH and pyenv installed versions.
+
+    Args:
+        python_version: Python version to look for
+        interpreter: Explicitly configured interpreter, used only if it has the right version
+
+    Returns:
+        Path of the interpreter, or None if none was found
+    """
+    version = short_version(python_version)
+    if interpreter is not None:
+        found = interpreter_version(interpreter)
+        if found == version:
+            return os.fspath(interpreter)
+        LOG.warning("Configured interpreter %s is python %s, not %s", interpreter, found, version)
+    if ".".join(platform.python_version_tuple()[:2]) == version:
+        return sys.executable
+    candidates: list[PathType] = []
+    on_path = shutil.which(f"python{version}")
+    if on_path:
+        candidates.append(on_path)
+    candidates.extend(_pyenv_candidates(version))
+    for candidate in candidates:
+        if os.path.exists(candidate) and interpreter_version(candidate) == version:
+            LOG.debug("Using python %s interpreter %s", version, candidate)
+            return os.fspath(candidate)
+    return None
+
+
+class BytecodeCache:
+    """Content addressed store of compiled ``.pyc`` files
+
+    Entries are keyed on the source contents, the path recorded in the bytecode, the target
+    python version, the optimization level and the invalidation mode. Cached files are hard
+    linked into place where possible, falling back to a copy. The times of a linked file are set
+    by the build (see :class:`transforms.SetUtime`), so the last use of an entry is kept on an
+    empty ``.used`` marker next to it.
+
+    Args:
+        cache_dir: Directory of the cache
+        max_age: Files unused for this many seconds are removed by :meth:`prune`
+    """
+
+    def __init__(self, cache_dir: PathType, max_age: float = DEFAULT_MAX_AGE):
+        self.cache_dir = Path(cache_dir)
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(
+        source: bytes,
+        rel_path: str,
+        python_version: str,
+        optimize: int,
+        invalidation_mode: PycInvalidationMode,
+    ) -> str:
+        digest = hashlib.sha256(
+            f"{python_version}\0{optimize}\0{invalidation_mode.name}\0{rel_path}\0".encode()
+        )
+        digest.update(source)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.pyc"
+
+    @staticmethod
+    def _used(path: Path) -> Path:
+        return path.with_suffix(".used")
+
+    def _touch(self, path: Path) -> None:
+        try:
+            self._used(path).touch()
+        except OSError as e:
+            LOG.debug("Unable to mark %s as used: %s", path, e)
+
+    def fetch(self, key: str, dest: str) -> bool:
+        """Places the cached ``.pyc`` for ``key`` at ``dest``, returns False on a cache miss"""
+        cached = self._path(key)
+        if not cached.is_file():
+            self.misses += 1
+            return False
+        self._touch(cached)
+        link_or_copy(cached, dest)
+        self.hits += 1
+        return True
+
+    def store(self, key: str, pyc: str) -> None:
+        """Adds a freshly compiled ``.pyc`` to the cache"""
+        path = self._path(key)
+        if path.exists():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            shutil.copyfile(pyc, tmp_path)
+            os.replace(tmp_path, path)
+            self._touch(path)
+        except OSError as e:
+            LOG.debug("Unable to cache %s: %s", pyc, e)
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def prune(self) -> int:
+        """Removes files that were not used for ``max_age`` seconds
+
+        Returns:
+            The number of removed files
+        """
+        cutoff = time.time() - self.max_age
+        removed = 0
+        for p in self.cache_dir.glob("*/*.pyc"):
+            used = self._used(p)
+            try:
+                if (used if used.exists() else p).stat().st_mtime < cutoff:
+                    p.unlink()
+                    removed += 1
+                    used.unlink()
+            except FileNotFoundError:
+                pass  # pruned by another process in the meantime
+        if removed:
+            LOG.debug("Removed %s unused files from the bytecode cache", removed)
+        return removed
+
+
+def _compile_with_interpreter(
+    interpreter: str,
+    root: str,
+    batches: list[list[str]],
+    optimize: int,
+    workers: int,
+    invalidation_mode: PycInvalidationMode,
+) -> CompileResult:
+    work: queue.SimpleQueue[list[str]] = queue.SimpleQueue()
+    for batch in batches:
+        work.put(batch)
+
+    def _worker() -> CompileResult:
+        compiled: list[str] = []
+        errors: list[tuple[str, str]] = []
+        with subprocess.Popen(  # nosec B603
+            [interpreter, "-I", str(_WORKER_SCRIPT)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        ) as proc:
+            try:
+                while True:
+                    try:
+                        batch = work.get_nowait()
+                    except queue.Empty:
+                        break
+                    request = {
+                        "root": root,
+                        "files": batch,
+                        "optimize": optimize,
+                        "invalidation_mode": invalidation_mode.name,
+                    }
+                    proc.stdin.write(json.dumps(request).encode() + b"\n")  # type: ignore[union-attr]
+                    proc.stdin.flush()  # type: ignore[union-attr]
+                    line = proc.stdout.readline()  # type: ignore[union-attr]
+                    if not line:
+                        errors.extend((f, "compile worker exited unexpectedly") for f in batch)
+                        break
+                    response = json.loads(line)
+                    compiled.extend(response["compiled"])
+                    errors.extend(tuple(e) for e in response["errors"])
+            finally:
+                proc.stdin.close()  # type: ignore[union-attr]
+        return CompileResult(compiled, errors)
+
+    compiled: list[str] = []
+    errors: list[tuple[str, str]] = []
+    with ThreadPoolExecutor(min(workers, len(batches))) as pool:
+        futures = [pool.submit(_worker) for _ in range(min(workers, len(batches)))]
+        for fut in futures:
+            result = fut.result()
+            compiled.extend(result.compiled)
+            errors.extend(result.errors)
+    # anything a crashed worker left behind
+    while not work.empty():
+        errors.extend((f, "not compiled, no worker left") for f in work.get_nowait())
+    return CompileResult(compiled, errors)
+
+
+def _fetch_cached(
+    cache: BytecodeCache,
+    root: str,
+    rel_paths: list[str],
+    python_version: str,
+    optimize: int,
+    invalidation_mode: PycInvalidationMode,
+) -> tuple[list[str], list[str], dict[str, str]]:
+    """Places the cached ``.pyc`` files
+
+    Returns:
+        The paths found in the cache, the paths still to compile and the cache keys of those
+    """
+    cached: list[str] = []
+    to_compile: list[str] = []
+    keys: dict[str, str] = {}
+    for rel_path in rel_paths:
+        source = os.path.join(root, rel_path)
+        try:
+            with open(source, "rb") as fh:
+                key = cache.key(fh.read(), rel_path, python_version, optimize, invalidation_mode)
+        except OSError:
+            to_compile.append(rel_path)
+            continue
+        if cache.fetch(key, source + "c"):
+            cached.append(rel_path)
+        else:
+            keys[rel_path] = key
+            to_compile.append(rel_path)
+    return cached, to_compile, keys
+
+
+def _compile(
+    root: str,
+    rel_paths: list[str],
+    optimize: int,
+    workers: int,
+    invalidation_mode: PycInvalidationMode,
+    interpreter: str | None,
+) -> CompileResult:
+    # a few batches per worker keeps the workers busy without much IPC overhead
+    batches = _split(rel_paths, workers * 4)
+    if batches and interpreter is not None:
+        return _compile_with_interpreter(
+            interpreter, root, batches, optimize, workers, invalidation_mode
+        )
+    if workers == 1 or len(rel_paths) < 2:
+        return _compile_batch(root, rel_paths, optimize, invalidation_mode)
+    compiled: list[str] = []
+    errors: list[tuple[str, str]] = []
+    with ProcessPoolExecutor(min(workers, len(batches))) as pool:
+        futures = [
+            pool.submit(_compile_batch, root, batch, optimize, invalidation_mode)
+            for batch in batches
+        ]
+        for fut in futures:
+            result = fut.result()
+            compiled.extend(result.compiled)
+            errors.extend(result.errors)
+    return CompileResult(compiled, errors)
+
+
+def compile_files(
+    root: PathType,
+    rel_paths: list[str],
+    optimize: int = 2,
+    workers: int = 0,
+    invalidation_mode: PycInvalidationMode = PycInvalidationMode.UNCHECKED_HASH,
+    interpreter: PathType | None = None,
+    cache: BytecodeCache | None = None,
+) -> CompileResult:
+    """Compiles python files to ``<file>.pyc`` next to the source
+
+    Args:
+        root: Directory the paths are relative to, paths are recorded in the bytecode relative to it
+        rel_paths: Paths of the ``.py`` files to compile
+        optimize: Optimization level passed to the compiler
+        workers: Number of worker processes, 0 to use all cores
+        invalidation_mode: How the interpreter should check the ``.pyc`` files for staleness
+        interpreter: Python interpreter to run the workers under, defaults to the running one
+        cache: Cache to take previously compiled files from and to add new ones to. It is not
+            used with timestamp invalidation, as those files embed the source modification time.
+
+    Returns:
+        A CompileResult with the compiled paths, a list of (path, error) tuples and the number of
+        files taken from the cache
+    """
+    root = os.fspath(root)
+    workers = workers or os.cpu_count() or 1
+    rel_paths = list(rel_paths)
+    other_interpreter = None
+    if interpreter is not None and os.fspath(interpreter) != sys.executable:
+        other_interpreter = os.fspath(interpreter)
+    python_version: str | None = ".".join(platform.python_version_tuple()[:2])
+    if other_interpreter is not None:
+        python_version = interpreter_version(other_interpreter)
+    cached: list[str] = []
+    keys: dict[str, str] = {}
+    if cache is not None and python_version and invalidation_mode != PycInvalidationMode.TIMESTAMP:
+        cached, rel_paths, keys = _fetch_cached(
+            cache, root, rel_paths, python_version, optimize, invalidation_mode
+        )
+
+    result = _compile(root, rel_paths, optimize, workers, invalidation_mode, other_interpreter)
+
+    if cache is not None:
+        for rel_path in result.compiled:
+            if rel_path in keys:
+                cache.store(keys[rel_path], os.path.join(root, rel_path) + "c")
+        cache.prune()
+    for rel_path, error in result.errors:
+        LOG.warning("Failed to compile %s: %s", rel_path, error)
+    LOG.info(
+        "Compiled %s python files (%s from cache, %s failed)",
+        len(result.compiled) + len(cached),
+        len(cached),
+        len(result.errors),
+    )
+    return CompileResult(cached + result.compiled, result.errors, len(cached))
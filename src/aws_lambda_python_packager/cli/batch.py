@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import logging
+from pathlib import Path
+from pprint import pformat
+
+import click
+
+from ..batch import (
+    TemplateError,
+    build_batch,
+    collect_items,
+    format_layers,
+    format_summary,
+    share_layers,
+)
+from .build import build, packaging_kwargs
+
+LOG = logging.getLogger(__name__)
+
+# the options of build that apply to every function of a batch as well
+_BUILD_ONLY_PARAMS = (
+    "project_path",
+    "output_path",
+    "matrix",
+    "matrix_concurrency",
+    "export_requirements",
+    "update_dependencies",
+)
+
+
+@click.command()
+@click.argument(
+    "sources",
+    nargs=-1,
+    required=True,
+    type=click.Path(exists=True, resolve_path=True, path_type=Path),
+)
+@click.option(
+    "--output-dir",
+    "-o",
+    help="Directory to write the functions to, each into a directory named after it",
+    type=click.Path(file_okay=False, resolve_path=True, path_type=Path),
+    required=True,
+)
+@click.option(
+    "--workers",
+    "-j",
+    help="Number of functions built at the same time",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+)
+@click.option(
+    "--layers-dir",
+    help="Move the packages the functions have in common into shared layers in this directory "
+    "(at most 5 per function), with the layers of every function in layers.json",
+    type=click.Path(file_okay=False, resolve_path=True, path_type=Path),
+)
+def batch(
+    sources,
+    output_dir,
+    workers=4,
+    layers_dir=None,
+    python_version="3.9",
+    architecture="x86_64",
+    **options,
+):  # pylint: disable=too-many-arguments
+    """Bundles many functions, given as project directories or SAM templates
+
+    Functions in a SAM template are built for their own runtime and architecture.
+    """
+    LOG.info(pformat(click.get_current_context().params, width=150))
+    try:
+        items = collect_items(sources)
+    except TemplateError as e:
+        raise click.ClickException(str(e)) from e
+    if not items:
+        raise click.ClickException("No python functions found")
+    packager_kwargs, package_kwargs = packaging_kwargs(**options)
+    results = build_batch(
+        items,
+        output_dir,
+        packager_kwargs,
+        package_kwargs,
+        workers=workers,
+        python_version=python_version,
+        architecture=architecture,
+    )
+    click.echo(format_summary(results))
+    if layers_dir is not None:
+        plan = share_layers(results, layers_dir, bool(package_kwargs.get("zip_output")))
+        click.echo(format_layers(plan))
+    failed = [r for r in results if r.error]
+    if failed:
+        raise click.ClickException(f"{len(failed)} of {len(results)} functions failed")
+
+
+batch.params.extend(p for p in build.params if p.name not in _BUILD_ONLY_PARAMS)
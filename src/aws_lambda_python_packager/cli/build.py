@@ -7,8 +7,17 @@ from pprint import pformat
 import click
 from click_option_group import optgroup
 
-from ..dep_analyzer import DepAnalyzer, PackageInfo
-from ..lambda_packager import OTHER_FILE_EXTENSIONS, LambdaPackager
+from ..arrow_fetcher import PYARROW_COMPONENTS
+from ..dep_analyzer import (
+    DOWNLOADERS,
+    INSTALLERS,
+    DepAnalyzer,
+    InstallOptions,
+    PackageInfo,
+)
+from ..lambda_packager import OTHER_FILE_EXTENSIONS, STRIP_METHODS, LambdaPackager
+from ..matrix import build_matrix, parse_matrix, target_output_dir
+from ..providers import provider_from_spec
 from ..util import get_glue_libraries
 
 LOG = logging.getLogger(__name__)
@@ -43,11 +52,27 @@ def strip_python_callback(ctx, opt, val):  # pylint: disable=unused-argument
     return val
 
 
+def slim_provider_callback(ctx, opt, val):  # pylint: disable=unused-argument
+    try:
+        return [provider_from_spec(v) for v in val]
+    except ValueError as e:
+        raise click.BadParameter(str(e)) from e
+
+
+def matrix_callback(ctx, opt, val):  # pylint: disable=unused-argument
+    try:
+        return [t for spec in val for t in parse_matrix(spec)]
+    except ValueError as e:
+        raise click.BadParameter(str(e)) from e
+
+
 def optimize_callback(ctx, opt, val):  # pylint: disable=unused-argument
     cmd = ctx.command
     params = {a.name: a for a in cmd.params if not getattr(a, "hidden", False)}
     for oln, opts in enumerate(OPTIMIZATION_LEVELS, 1):
         for o in opts:
+            if o not in params:
+                continue
             if val < oln:
                 params[o].default = False
             else:
@@ -55,6 +80,68 @@ def optimize_callback(ctx, opt, val):  # pylint: disable=unused-argument
     return val
 
 
+# build option: (LambdaPackager argument, default)
+_PACKAGER_OPTIONS = {
+    "ignore_packages": ("ignore_packages", False),
+    "update_dependencies": ("update_dependencies", False),
+    "region": ("region", "us-east-1"),
+    "ignore_unsupported_python": ("ignore_unsupported_python", False),
+    "python_interpreter": ("python_interpreter", None),
+    "stage_next_to_output": ("stage_next_to_output", True),
+    "slim_providers": ("slim_providers", ()),
+}
+# build option: (InstallOptions field, default)
+_INSTALL_OPTIONS = {
+    "wheelhouse": ("use_wheelhouse", False),
+    "installer": ("installer", "pip"),
+    "package_store": ("use_package_store", False),
+    "requirements_cache": ("use_requirements_cache", False),
+    "downloader": ("downloader", "pip"),
+    "pip_shards": ("pip_shards", 1),
+}
+# build option: (LambdaPackager.package argument, default)
+_PACKAGE_OPTIONS = {
+    "zip_output": ("zip_output", False),
+    "compile_python": ("compile_python", False),
+    "compile_workers": ("compile_workers", 0),
+    "bytecode_cache": ("compile_cache", True),
+    "build_cache": ("build_cache", False),
+    "use_aws_pyarrow": ("use_wrangler_pyarrow", False),
+    "exclude_pyarrow_components": ("exclude_pyarrow_components", ()),
+    "strip_tests": ("strip_tests", False),
+    "strip_libraries": ("strip_libraries", False),
+    "strip_method": ("strip_method", "auto"),
+    "strip_python": ("strip_python", False),
+    "strip_other": ("strip_other_files", False),
+    "compress_boto": ("compress_boto", False),
+}
+
+
+def packaging_kwargs(**options) -> tuple[dict, dict]:
+    """Maps the build options to the arguments of LambdaPackager and LambdaPackager.package"""
+    additional_packages_to_ignore = {}
+    for ia in options.get("ignore_additional") or ():
+        for req in DepAnalyzer.process_requirements(list(ia)):
+            if isinstance(req, PackageInfo) and req.name:
+                additional_packages_to_ignore[req.name] = req.version
+    if options.get("ignore_from_glue"):
+        glue_libs = get_glue_libraries()[options["ignore_from_glue"]]
+        additional_packages_to_ignore.update(glue_libs)
+    if additional_packages_to_ignore and LOG.getEffectiveLevel() <= logging.DEBUG:
+        LOG.debug(pformat(additional_packages_to_ignore))
+
+    packager_kwargs = {arg: options.get(o, d) for o, (arg, d) in _PACKAGER_OPTIONS.items()}
+    packager_kwargs["additional_packages_to_ignore"] = additional_packages_to_ignore
+    packager_kwargs["install_options"] = InstallOptions(
+        **{field: options.get(o, d) for o, (field, d) in _INSTALL_OPTIONS.items()}
+    )
+    package_kwargs = {arg: options.get(o, d) for o, (arg, d) in _PACKAGE_OPTIONS.items()}
+    package_kwargs["exclude_pyarrow_components"] = tuple(
+        package_kwargs["exclude_pyarrow_components"]
+    )
+    return packager_kwargs, package_kwargs
+
+
 @click.command()
 @click.argument("project_path", type=click.Path(exists=True, resolve_path=True, path_type=Path))
 @click.argument("output_path", type=click.Path(file_okay=False, resolve_path=True, path_type=Path))
@@ -68,6 +155,22 @@ def optimize_callback(ctx, opt, val):  # pylint: disable=unused-argument
     default="x86_64",
 )
 @optgroup.option("--region", help="AWS region to target", default="us-east-1")
+@optgroup.option(
+    "--matrix",
+    help="Build for several targets at once instead, PYTHON_VERSIONS[:ARCHITECTURES] with comma "
+    "separated lists (e.g. 3.9,3.10:x86_64,arm64), every target is written to "
+    "OUTPUT_PATH/pythonVERSION-ARCH, can be given multiple times",
+    metavar="SPEC",
+    multiple=True,
+    callback=matrix_callback,
+)
+@optgroup.option(
+    "--matrix-concurrency",
+    help="Number of matrix targets built at the same time",
+    type=click.IntRange(min=1),
+    default=2,
+    show_default=True,
+)
 @optgroup.option(
     "--ignore-unsupported-python",
     help="Allow Python versions that are unsupported",
@@ -109,6 +212,77 @@ def optimize_callback(ctx, opt, val):  # pylint: disable=unused-argument
     default=False,
     callback=compile_python_callback,
 )
+@optgroup.option(
+    "--compile-workers",
+    help="Number of processes used to compile the python bytecode (0 to use all cores)",
+    type=click.IntRange(min=0),
+    default=0,
+)
+@optgroup.option(
+    "--installer",
+    help="How to install the dependencies: pip, or native to unpack the pinned wheels in parallel",
+    type=click.Choice(INSTALLERS),
+    default="pip",
+    show_default=True,
+)
+@optgroup.option(
+    "--downloader",
+    help="How to download pinned packages: pip, or async to fetch the wheels concurrently from "
+    "the package index",
+    type=click.Choice(DOWNLOADERS),
+    default="pip",
+    show_default=True,
+)
+@optgroup.option(
+    "--pip-shards",
+    help="Number of concurrent pip processes installing the dependencies, each into its own "
+    "directory (files installed by more than one with different contents are reported)",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+)
+@optgroup.option(
+    "--stage-next-to-output/--stage-in-temp-dir",
+    help="Install into a directory next to the output so the package can be moved into place "
+    "instead of copied from the system temp directory",
+    default=True,
+)
+@optgroup.option(
+    "--package-store/--no-package-store",
+    help="Unpack wheels once into a shared store and hard link them into the package "
+    "(requires --installer native)",
+    default=False,
+)
+@optgroup.option(
+    "--wheelhouse/--no-wheelhouse",
+    help="Keep downloaded packages in a per target wheelhouse and install from it when all "
+    "requirements are pinned",
+    default=False,
+)
+@optgroup.option(
+    "--requirements-cache/--no-requirements-cache",
+    help="Reuse the requirements resolved within the last day when the dependency files, target "
+    "and ignored packages are unchanged",
+    default=False,
+)
+@optgroup.option(
+    "--build-cache/--no-build-cache",
+    help="Restore the output from the build cache when the dependency files, project sources, "
+    "target and options are unchanged (unpinned requirements are not re-resolved on a hit)",
+    default=False,
+)
+@optgroup.option(
+    "--bytecode-cache/--no-bytecode-cache",
+    help="Reuse python bytecode compiled by earlier builds",
+    default=True,
+)
+@optgroup.option(
+    "--python-interpreter",
+    help="Python interpreter matching --python-version used to compile the bytecode "
+    "(default: search the PATH and pyenv)",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    default=None,
+)
 @optgroup.option(
     "--use-aws-pyarrow/--no-use-aws-pyarrow",
     help="Use AWS wrangler pyarrow (may result in smaller file size). "
@@ -116,6 +290,25 @@ def optimize_callback(ctx, opt, val):  # pylint: disable=unused-argument
     "Lambda layer that includes the proper PyArrow version.",
     default=False,
 )
+@optgroup.option(
+    "--exclude-pyarrow-component",
+    "exclude_pyarrow_components",
+    help="Leave this part of the AWS wrangler pyarrow out of the package (requires "
+    "--use-aws-pyarrow), can be given multiple times",
+    type=click.Choice(list(PYARROW_COMPONENTS)),
+    multiple=True,
+)
+@optgroup.option(
+    "--slim-provider",
+    "slim_providers",
+    help="Replace installed packages with the smaller builds found here: dir:PATH (builds in "
+    "PATH/NAME-VERSION-pyPYTHON-ARCH), url:URL (a tarball, URL may contain {name}, {version}, "
+    "{python_version} and {arch}) or github:OWNER/REPO (release assets), can be given multiple "
+    "times",
+    metavar="SPEC",
+    multiple=True,
+    callback=slim_provider_callback,
+)
 @optgroup.option(
     "--strip-tests/--no-strip-tests",
     help="Strip tests from the package",
@@ -126,6 +319,13 @@ def optimize_callback(ctx, opt, val):  # pylint: disable=unused-argument
     help="Strip debugging symbols from libraries",
     default=False,
 )
+@optgroup.option(
+    "--strip-method",
+    help="How to strip libraries: with binutils 'strip', with the built-in ELF stripper ('python'), "
+    "or 'auto' (binutils if a 'strip' binary for the architecture is available)",
+    type=click.Choice(STRIP_METHODS),
+    default="auto",
+)
 @optgroup.option(
     "--strip-python/--no-strip-python",
     help="Strip python scripts from the package (requires --compile-python) (note, may need to set an "
@@ -167,63 +367,66 @@ def optimize_callback(ctx, opt, val):  # pylint: disable=unused-argument
 def build(
     project_path,
     output_path,
-    ignore_packages=False,
-    update_dependencies=False,
     python_version="3.9",
     architecture="x86_64",
-    region="us-east-1",
-    zip_output=False,
-    compile_python=False,
-    use_aws_pyarrow=False,
-    strip_tests=False,
-    strip_libraries=False,
-    strip_python=False,
-    strip_other=False,
-    compress_boto=False,
-    ignore_additional=None,
+    matrix=(),
+    matrix_concurrency=2,
     export_requirements=False,
-    ignore_unsupported_python: bool = False,
-    ignore_from_glue: int | None = None,
-    **_,
-):  # pylint: disable=too-many-arguments,too-many-locals
+    **options,
+):  # pylint: disable=too-many-arguments
     """Bundles a group of python dependencies"""
     LOG.info(pformat(click.get_current_context().params, width=150))
-    additional_packages_to_ignore = {}
-    for ia in ignore_additional:
-        for req in DepAnalyzer.process_requirements(list(ia)):
-            if isinstance(req, PackageInfo) and req.name:
-                additional_packages_to_ignore[req.name] = req.version
     if project_path.is_file() and project_path.name in ("pyproject.toml", "requirements.txt"):
         project_path = project_path.parent
-    if ignore_from_glue:
-        glue_libs = get_glue_libraries()[ignore_from_glue]
-        additional_packages_to_ignore.update(glue_libs)
-    if additional_packages_to_ignore and LOG.getEffectiveLevel() <= logging.DEBUG:
-        LOG.debug(pformat(additional_packages_to_ignore))
-
+    packager_kwargs, package_kwargs = packaging_kwargs(**options)
+    if matrix:
+        _build_matrix(
+            matrix,
+            matrix_concurrency,
+            project_path,
+            output_path,
+            packager_kwargs,
+            package_kwargs,
+            export_requirements,
+        )
+        return
     lp = LambdaPackager(
         project_path=project_path,
         output_dir=output_path,
-        ignore_packages=ignore_packages,
-        update_dependencies=update_dependencies,
         python_version=python_version,
         architecture=architecture,
-        region=region,
-        additional_packages_to_ignore=additional_packages_to_ignore,
-        ignore_unsupported_python=ignore_unsupported_python,
-    )
-    lp.package(
-        zip_output=zip_output,
-        compile_python=compile_python,
-        use_wrangler_pyarrow=use_aws_pyarrow,
-        strip_tests=strip_tests,
-        strip_libraries=strip_libraries,
-        strip_python=strip_python,
-        strip_other_files=strip_other,
-        compress_boto=compress_boto,
+        **packager_kwargs,
     )
+    lp.package(**package_kwargs)
     if export_requirements:
         print(export_requirements)
         with open(export_requirements, "w", encoding="utf8") as f:
             for pkg in lp.analyzer.export_requirements():
                 f.write(pkg + "\n")
+
+
+def _build_matrix(
+    targets,
+    concurrency,
+    project_path,
+    output_path,
+    packager_kwargs,
+    package_kwargs,
+    export_requirements,
+):  # pylint: disable=too-many-arguments
+    if export_requirements:
+        raise click.UsageError("--export-requirements can't be used with --matrix")
+    if packager_kwargs["update_dependencies"]:
+        raise click.UsageError("--update-dependencies can't be used with --matrix")
+    if not isinstance(package_kwargs["zip_output"], bool):
+        # every target is zipped next to its own output directory
+        package_kwargs["zip_output"] = True
+    results = build_matrix(
+        targets, project_path, output_path, packager_kwargs, package_kwargs, concurrency
+    )
+    failed = [r for r in results if r.error is not None]
+    for r in results:
+        status = "failed: " + r.error if r.error else target_output_dir(output_path, r.target)
+        click.echo(f"python{r.target.python_version} {r.target.architecture}: {status}")
+    if failed:
+        raise click.ClickException(f"{len(failed)} of {len(results)} targets failed")
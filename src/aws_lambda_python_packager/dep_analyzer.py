@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import logging
+import os
 import re
 import shlex
 import shutil
@@ -9,17 +10,40 @@ import tempfile
 from abc import ABC, abstractmethod
 from collections import namedtuple
 from concurrent.futures import ThreadPoolExecutor
-from contextlib import contextmanager
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
 from functools import partial
 from pathlib import Path
 from typing import Any, Iterable
 
-import requests
-
-from .util import PathType, chdir_cm
+from .metadata_client import get_client
+from .package_store import PackageStore
+from .pip_shards import merge_shards, split_shards
+from .requirements_cache import RequirementsCache
+from .util import PathType, chdir_cm, move_tree
+from .wheel_downloader import DEFAULT_INDEX_URL, DownloadError, download_wheels
+from .wheel_installer import install_wheels
+from .wheelhouse import Wheelhouse
 
 PackageInfo = namedtuple("PackageInfo", ["name", "version", "version_spec"])
+# how the analyzer downloads and installs the dependencies, see LambdaPackager for the fields
+InstallOptions = namedtuple(
+    "InstallOptions",
+    [
+        "use_wheelhouse",
+        "installer",
+        "use_package_store",
+        "staging_dir",
+        "use_requirements_cache",
+        "downloader",
+        "pip_shards",
+    ],
+    defaults=(False, "pip", False, None, False, "pip", 1),
+)
+INSTALLERS = ("pip", "native")
+DOWNLOADERS = ("pip", "async")
+PLATFORM_TAGS = {"x86_64": "manylinux2014_x86_64", "arm64": "manylinux2014_aarch64"}
+PACKAGES_CACHE_TTL = 24 * 60 * 60  # 1 day
 PACKAGE_URL = "https://raw.githubusercontent.com/mumblepins/aws-get-lambda-python-pkg-versions/main/{region}-python{python_version}-{architecture}.json"
 
 
@@ -31,7 +55,7 @@ class ExtraLine(list):
     pass
 
 
-class DepAnalyzer(ABC):  # pylint: disable=too-many-instance-attributes
+class DepAnalyzer(ABC):  # pylint: disable=too-many-instance-attributes,too-many-public-methods
     project_root: Path
 
     analyzer_name: str
@@ -46,7 +70,8 @@ class DepAnalyzer(ABC):  # pylint: disable=too-many-instance-attributes
         ignore_packages=False,
         update_dependencies=False,
         additional_packages_to_ignore: dict | None = None,
-    ):
+        install_options: InstallOptions | None = None,
+    ):  # pylint: disable=too-many-arguments
         if additional_packages_to_ignore is None:
             self._additional_packages_to_ignore = {}
         else:
@@ -73,11 +98,34 @@ class DepAnalyzer(ABC):  # pylint: disable=too-many-instance-attributes
 
         self.ignore_packages = ignore_packages
         self.update_dependencies = update_dependencies
+        options = install_options or InstallOptions()
+        if options.installer not in INSTALLERS:
+            raise ValueError(f"Unknown installer {options.installer}, expected one of {INSTALLERS}")
+        self.installer = options.installer
+        if options.downloader not in DOWNLOADERS:
+            raise ValueError(
+                f"Unknown downloader {options.downloader}, expected one of {DOWNLOADERS}"
+            )
+        self.downloader = options.downloader
+        self.pip_shards = options.pip_shards
+        self.platform_tag = PLATFORM_TAGS.get(architecture, architecture)
+        self.wheelhouse = (
+            Wheelhouse(python_version, self.platform_tag) if options.use_wheelhouse else None
+        )
         self._temp_proj_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
         self._chdir = partial(chdir_cm, self._temp_proj_dir.name)
-        self._target = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        # a target on the same filesystem as the output can be moved there instead of copied
+        self._target = tempfile.TemporaryDirectory(  # pylint: disable=consider-using-with
+            prefix=".lambda-packager-", dir=options.staging_dir
+        )
 
         self.log = logging.getLogger(self.__class__.__name__)
+        self.package_store: PackageStore | None = None
+        if options.use_package_store and options.installer != "native":
+            self.log.warning("The package store is only used with the native installer")
+        elif options.use_package_store:
+            self.package_store = PackageStore()
+        self.requirements_cache = RequirementsCache() if options.use_requirements_cache else None
 
     def __del__(self):
         try:
@@ -133,6 +181,22 @@ class DepAnalyzer(ABC):  # pylint: disable=too-many-instance-attributes
     @property
     def requirements(self) -> dict[str, PackageInfo]:
         if self._reqs is None:
+            cache_key = None
+            # updating the dependency file changes it, so it always needs a resolution
+            if self.requirements_cache is not None and not self.update_dependencies:
+                cache_key = self.requirements_cache.key(
+                    self.analyzer_name,
+                    self.project_root,
+                    self.python_version,
+                    self.architecture,
+                    self.pkgs_to_ignore_dict,
+                )
+                cached = self.requirements_cache.load(cache_key)
+                if cached is not None:
+                    self.log.info("Using cached requirements")
+                    self._reqs = {r[0]: PackageInfo(*r) for r in cached[0]}
+                    self._extra_lines = [ExtraLine(e) for e in cached[1]]
+                    return self._reqs
             self.log.warning("Exporting requirements")
             reqs = self.update_dependency_file()
             if reqs is None:
@@ -140,8 +204,19 @@ class DepAnalyzer(ABC):  # pylint: disable=too-many-instance-attributes
             if self._extra_lines is None:
                 self._extra_lines = [r for r in reqs if isinstance(r, ExtraLine)]
             self._reqs = {r.name: r for r in reqs if not isinstance(r, ExtraLine)}
+            if cache_key is not None and self.requirements_cache is not None:
+                self.requirements_cache.store(
+                    cache_key, list(self._reqs.values()), self._extra_lines
+                )
         return self._reqs
 
+    def use_requirements(self, requirements: Iterable[PackageInfo], extra_lines: Iterable[list]):
+        """Uses requirements resolved elsewhere, e.g. for another architecture, instead of
+        resolving them"""
+        self._reqs = {r[0]: PackageInfo(*r) for r in requirements}
+        self._extra_lines = [ExtraLine(e) for e in extra_lines]
+        self._exported_reqs = None
+
     @property
     def extra_lines(self):
         if self._extra_lines is None:
@@ -164,12 +239,8 @@ class DepAnalyzer(ABC):  # pylint: disable=too-many-instance-attributes
             data += o
         return data
 
-    def _install_pip(self, *args, return_state=False, quiet=False, requirements_file=False):
-        pip_command = [
-            "install",
-            "--disable-pip-version-check",
-            "--ignore-installed",
-            "--no-compile",
+    def _pip_target_options(self, requirements_file=False) -> list[str]:
+        options = [
             "--python-version",
             self.python_version,
             "--implementation",
@@ -177,32 +248,178 @@ class DepAnalyzer(ABC):  # pylint: disable=too-many-instance-attributes
         ]
         if not requirements_file:
             for el in self.extra_lines:
-                pip_command.extend(el)
-        if self.architecture == "arm64":
-            pip_command.extend(
-                [
-                    "--platform",
-                    "manylinux2014_aarch64",
-                ]
-            )
-        elif self.architecture == "x86_64":
-            pip_command.extend(
-                [
-                    "--platform",
-                    "manylinux2014_x86_64",
-                ]
+                options.extend(el)
+        if self.architecture in PLATFORM_TAGS:
+            options.extend(["--platform", PLATFORM_TAGS[self.architecture]])
+        return options
+
+    def _install_pip(
+        self, *args, return_state=False, quiet=False, requirements_file=False, context=None
+    ):
+        pip_command = [
+            "install",
+            "--disable-pip-version-check",
+            "--ignore-installed",
+            "--no-compile",
+            *self._pip_target_options(requirements_file),
+        ]
+        pip_command.extend(args)
+        return self.run_pip(*pip_command, return_state=return_state, quiet=quiet, context=context)
+
+    def _install_requirements_pip(
+        self, reqs: list[str], *options: str, wheelhouse: Wheelhouse | None = None, quiet=True
+    ):
+        """Installs pinned requirements without their dependencies into the target
+
+        With ``pip_shards`` above 1 the requirements are split into shards of about the same
+        download size, installed by concurrent pip processes and merged into the target.
+        """
+        shards = min(self.pip_shards, len(reqs))
+        if shards < 2:
+            self._install_pip(
+                "--target", self._target.name, "--no-deps", *options, *reqs, quiet=quiet
             )
+            return
+        weights = wheelhouse.sizes(reqs) if wheelhouse is not None else None
+        reqs_shards = split_shards(reqs, shards, weights)
+        self.log.info("Installing with %s concurrent pip processes", len(reqs_shards))
+        # next to the target, so the shards can be moved into it
+        with tempfile.TemporaryDirectory(
+            prefix=".lambda-packager-shards-", dir=Path(self._target.name).parent
+        ) as shards_dir:
+            shard_dirs = [Path(shards_dir) / f"shard-{i}" for i in range(len(reqs_shards))]
+
+            def _install(shard):
+                shard_dir, shard_reqs = shard
+                self.log.debug("%s: %s", shard_dir.name, ", ".join(shard_reqs))
+                # the working directory is shared by the threads, so it is not changed
+                self._install_pip(
+                    "--target",
+                    shard_dir,
+                    "--no-deps",
+                    *options,
+                    *shard_reqs,
+                    quiet=quiet,
+                    context=nullcontext,
+                )
+
+            with ThreadPoolExecutor(len(reqs_shards)) as pool:
+                list(pool.map(_install, zip(shard_dirs, reqs_shards)))
+            conflicts = merge_shards(shard_dirs, self._target.name)
+        if conflicts:
+            self.log.warning("%s files conflict between the pip shards", len(conflicts))
+
+    def _download_pip(self, *args, return_state=False, quiet=False):
+        pip_command = [
+            "download",
+            "--disable-pip-version-check",
+            *self._pip_target_options(),
+        ]
         pip_command.extend(args)
         return self.run_pip(*pip_command, return_state=return_state, quiet=quiet)
 
+    def _fill_wheelhouse(self, wheelhouse: Wheelhouse, reqs: list[str], quiet=True):
+        """Downloads the requirements missing from the wheelhouse
+
+        Returns:
+            The downloaded requirements, or None if the wheelhouse can't be used
+        """
+        missing = wheelhouse.missing(reqs)
+        if missing is None:
+            self.log.info("Not all requirements are pinned, not using the wheelhouse")
+            return None
+        if missing:
+            self.log.info("Downloading %s packages to the wheelhouse", len(missing))
+            to_pip = missing
+            if self.downloader == "async":
+                to_pip = self._download_async(wheelhouse, missing)
+            downloaded = not to_pip or self._download_pip(
+                "--no-deps", "--dest", wheelhouse.path, *to_pip, return_state=True, quiet=quiet
+            )
+            if not downloaded or wheelhouse.missing(missing):
+                self.log.warning("Unable to fill the wheelhouse, installing from the network")
+                return None
+        return missing
+
+    def _index_url(self) -> str | None:
+        """The index pip would download from, None if pip may look in other places as well"""
+        if os.environ.get("PIP_EXTRA_INDEX_URL") or os.environ.get("PIP_FIND_LINKS"):
+            return None
+        index_url = os.environ.get("PIP_INDEX_URL", DEFAULT_INDEX_URL)
+        for line in self.extra_lines:
+            for i, arg in enumerate(line):
+                if arg in ("-i", "--index-url") and i + 1 < len(line):
+                    index_url = line[i + 1]
+                elif arg.startswith("--index-url="):
+                    index_url = arg.split("=", 1)[1]
+                elif arg.startswith(("--extra-index-url", "--find-links", "-f", "--no-index")):
+                    return None
+        return index_url
+
+    def _download_async(self, wheelhouse: Wheelhouse, reqs: list[str]) -> list[str]:
+        """Downloads the wheels of ``reqs`` concurrently
+
+        Returns:
+            The requirements left for pip to download
+        """
+        index_url = self._index_url()
+        if index_url is None:
+            self.log.info("Additional package sources are configured, downloading with pip")
+            return reqs
+        try:
+            return download_wheels(
+                reqs, wheelhouse.path, self.python_version, self.platform_tag, index_url
+            ).unresolved
+        except DownloadError as e:
+            self.log.warning("Concurrent download failed (%s), downloading with pip", e)
+            return reqs
+
+    def _install_from_wheelhouse(self, wheelhouse: Wheelhouse, reqs: list[str], quiet=True) -> bool:
+        downloaded = self._fill_wheelhouse(wheelhouse, reqs, quiet)
+        if downloaded is None:
+            return False
+        if self.installer == "native":
+            wheels, pip_reqs = wheelhouse.locate(reqs)
+            self.log.warning("Installing %s wheels", len(wheels))
+            install_wheels(wheels, self._target.name, store=self.package_store)
+            if self.package_store is not None:
+                self.log.info(
+                    "Linked %s files from the package store (%s copied)",
+                    self.package_store.linked,
+                    self.package_store.copied,
+                )
+                self.package_store.prune()
+        else:
+            pip_reqs = reqs
+        if pip_reqs:
+            self.log.warning("Installing dependencies from the wheelhouse using pip")
+            self._install_requirements_pip(
+                pip_reqs,
+                "--no-index",
+                "--find-links",
+                str(wheelhouse.path),
+                wheelhouse=wheelhouse,
+                quiet=quiet,
+            )
+        found = wheelhouse.touch(reqs)
+        self.log.info(
+            "Installed %s packages, %s from the wheelhouse and %s from the network",
+            found,
+            found - len(downloaded),
+            len(downloaded),
+        )
+        wheelhouse.prune()
+        return True
+
     def _get_packages_to_ignore(self):
         try:
-            r = requests.get(
+            r = get_client().get(
                 PACKAGE_URL.format(
                     region=self.region,
                     architecture=self.architecture,
                     python_version=self.python_version,
                 ),
+                ttl=PACKAGES_CACHE_TTL,
                 timeout=30,
             )
             r.raise_for_status()
@@ -332,21 +549,25 @@ class DepAnalyzer(ABC):  # pylint: disable=too-many-instance-attributes
         return ret
 
     def run_pip(self, *args, return_state=False, quiet=False, context=None):
-        self.run_command("pip", *args, return_state=return_state, quiet=quiet, context=context)
+        return self.run_command(
+            "pip", *args, return_state=return_state, quiet=quiet, context=context
+        )
 
     def install_dependencies(self, quiet=True):
-        pip_command = [
-            "--target",
-            self._target.name,
-            "--no-deps",
-        ]
         reqs = self.export_requirements()
         if not reqs:
             self.log.warning("No dependencies to install with pip, skipping")
             return
-        pip_command.extend(reqs)
+        if self.wheelhouse is not None or self.installer == "native":
+            with tempfile.TemporaryDirectory() as temp_wheelhouse:
+                wheelhouse = self.wheelhouse or Wheelhouse(
+                    self.python_version, self.platform_tag, path=temp_wheelhouse
+                )
+                if self._install_from_wheelhouse(wheelhouse, reqs, quiet):
+                    self.log.warning("Installing dependencies done")
+                    return
         self.log.warning("Installing dependencies using pip")
-        self._install_pip(*pip_command, quiet=quiet)
+        self._install_requirements_pip(reqs, quiet=quiet)
         self.log.warning("Installing dependencies done")
 
     def install_root(self):
@@ -375,7 +596,13 @@ class DepAnalyzer(ABC):  # pylint: disable=too-many-instance-attributes
 
     def copy_from_target(self, dst: PathType):
         self.log.warning("Copying %s from target to %s", self._target.name, dst)
-        shutil.copytree(self._target.name, dst)
+        # renamed or hard linked where possible, files are only ever replaced or unshared before
+        # being modified, so sharing them with the throwaway target is fine
+        how = move_tree(self._target.name, dst)
+        if how == "rename":
+            os.mkdir(self._target.name)
+        log_level = logging.WARNING if how == "copy" else logging.INFO
+        self.log.log(log_level, "Target staged into %s using %s", dst, how)
 
     def copy_from_temp_dir(self, files: Iterable[str]):
         for f in files:
@@ -0,0 +1,337 @@
+"""
+ELF
+
+Minimal ELF header and section table parsing, used to decide whether a shared library has
+anything worth stripping, and an in-process stripper for little-endian ELF64 files that removes
+the symbol table, debugging and comment sections without needing binutils.
+
+"""
+from __future__ import annotations
+
+import logging
+import mmap
+import os
+import shutil
+import struct
+from collections import namedtuple
+
+from .util import PathType
+
+LOG = logging.getLogger(__name__)
+
+ELF_MAGIC = b"\x7fELF"
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+SHN_LORESERVE = 0xFF00
+SHN_XINDEX = 0xFFFF
+SHT_NULL = 0
+SHT_RELA = 4
+SHT_NOBITS = 8
+SHT_REL = 9
+SHT_DYNSYM = 11
+SHT_GROUP = 17
+SHT_SYMTAB_SHNDX = 18
+SHF_ALLOC = 0x2
+SHF_INFO_LINK = 0x40
+
+ElfHeader = namedtuple(
+    "ElfHeader",
+    [
+        "elf_class",
+        "data",
+        "type",
+        "machine",
+        "phoff",
+        "shoff",
+        "flags",
+        "ehsize",
+        "phentsize",
+        "phnum",
+        "shentsize",
+        "shnum",
+        "shstrndx",
+    ],
+)
+ElfSection = namedtuple(
+    "ElfSection",
+    [
+        "name",
+        "type",
+        "flags",
+        "addr",
+        "offset",
+        "size",
+        "link",
+        "info",
+        "addralign",
+        "entsize",
+        "name_offset",
+    ],
+)
+
+# e_type .. e_shstrndx, after the 16 byte e_ident
+_HEADER_FORMATS = {ELFCLASS32: "HHIIIIIHHHHHH", ELFCLASS64: "HHIQQQIHHHHHH"}
+# sh_name, sh_type, sh_flags, sh_addr, sh_offset, sh_size, sh_link, sh_info, sh_addralign, sh_entsize
+_SECTION_FORMATS = {ELFCLASS32: "IIIIIIIIII", ELFCLASS64: "IIQQQQIIQQ"}
+
+
+class NotAnElfFile(ValueError):
+    """Raised when a file is not a (supported) ELF file"""
+
+
+def _byte_order(data: int) -> str:
+    return "<" if data == ELFDATA2LSB else ">"
+
+
+def read_elf_header(fh) -> ElfHeader:
+    """Reads the ELF header from an open binary file"""
+    fh.seek(0)
+    ident = fh.read(16)
+    if len(ident) < 16 or ident[:4] != ELF_MAGIC:
+        raise NotAnElfFile("missing ELF magic")
+    elf_class, data = ident[4], ident[5]
+    if elf_class not in _HEADER_FORMATS or data not in (ELFDATA2LSB, ELFDATA2MSB):
+        raise NotAnElfFile(f"unsupported ELF class/encoding {elf_class}/{data}")
+    fmt = _byte_order(data) + _HEADER_FORMATS[elf_class]
+    raw = fh.read(struct.calcsize(fmt))
+    if len(raw) < struct.calcsize(fmt):
+        raise NotAnElfFile("truncated ELF header")
+    values = struct.unpack(fmt, raw)
+    # everything but e_version and e_entry
+    return ElfHeader._make((elf_class, data, *values[:2], *values[4:]))
+
+
+def _section_name(names: bytes, offset: int) -> str:
+    end = names.find(b"\0", offset)
+    if end < 0:
+        end = len(names)
+    return names[offset:end].decode("utf8", "replace")
+
+
+def read_elf_sections(fh, header: ElfHeader | None = None) -> list[ElfSection]:
+    """Reads the section header table (with resolved section names) from an open binary file"""
+    if header is None:
+        header = read_elf_header(fh)
+    if header.shoff == 0:
+        return []
+    fmt = _byte_order(header.data) + _SECTION_FORMATS[header.elf_class]
+    entsize = struct.calcsize(fmt)
+    if header.shentsize != entsize:
+        raise NotAnElfFile(f"unexpected section header size {header.shentsize}")
+
+    def _read(idx):
+        fh.seek(header.shoff + idx * entsize)
+        raw = fh.read(entsize)
+        if len(raw) < entsize:
+            raise NotAnElfFile("truncated section header table")
+        return struct.unpack(fmt, raw)
+
+    first = _read(0)
+    shnum = header.shnum or first[5]  # large section counts live in section 0's sh_size
+    shstrndx = first[6] if header.shstrndx == SHN_XINDEX else header.shstrndx
+    fh.seek(header.shoff)
+    raw_table = fh.read(shnum * entsize)
+    if len(raw_table) < shnum * entsize:
+        raise NotAnElfFile("truncated section header table")
+    raw_sections = list(struct.iter_unpack(fmt, raw_table))
+
+    names = b""
+    if 0 < shstrndx < shnum:
+        str_sec = raw_sections[shstrndx]
+        fh.seek(str_sec[4])
+        names = fh.read(str_sec[5])
+
+    # the name first and its offset last, the other fields in table order
+    return [
+        ElfSection._make((_section_name(names, raw[0]), *raw[1:], raw[0])) for raw in raw_sections
+    ]
+
+
+def is_strippable_section(section: ElfSection) -> bool:
+    """Whether ``strip`` would remove this section (symbol table or debugging info)"""
+    if section.flags & SHF_ALLOC:
+        return False
+    return section.name == ".symtab" or section.name.startswith((".debug", ".zdebug"))
+
+
+def has_strippable_sections(path: PathType) -> bool:
+    """Checks if an ELF file has a symbol table or debugging sections
+
+    Raises:
+        NotAnElfFile: if the file is not an ELF file
+    """
+    with open(path, "rb") as fh:
+        return any(is_strippable_section(s) for s in read_elf_sections(fh))
+
+
+def _removable_sections(sections: list[ElfSection], shstrndx: int) -> set[int]:
+    remove = {
+        i
+        for i, s in enumerate(sections)
+        if i
+        and i != shstrndx
+        and s.type != SHT_NULL
+        and not s.flags & SHF_ALLOC
+        and (is_strippable_section(s) or s.name in (".comment", ".strtab"))
+    }
+    changed = True
+    while changed:
+        changed = False
+        for i, s in enumerate(sections):
+            if i in remove:
+                continue
+            # relocations for (and extended indices of) removed sections go along with them
+            if not s.flags & SHF_ALLOC and (
+                (s.type in (SHT_REL, SHT_RELA) and s.info in remove)
+                or (s.type == SHT_SYMTAB_SHNDX and s.link in remove)
+            ):
+                remove.add(i)
+                changed = True
+            # anything still needed by a kept section has to stay
+            elif s.link in remove:
+                remove.discard(s.link)
+                changed = True
+    return remove
+
+
+def _program_header_ranges(mm, header: ElfHeader) -> list[tuple[int, int]]:
+    ranges = []
+    for i in range(header.phnum):
+        # p_type, p_flags, p_offset, p_vaddr, p_paddr, p_filesz, p_memsz, p_align
+        ph = struct.unpack_from("<IIQQQQQQ", mm, header.phoff + i * header.phentsize)
+        ranges.append((ph[2], ph[2] + ph[5]))
+    return ranges
+
+
+def strip_elf(path: PathType) -> bool:  # noqa: C901
+    """Removes the symbol table, debugging and comment sections from a little-endian ELF64 file
+
+    Everything covered by a program header (i.e. anything the loader maps) stays at the same
+    offset, the remaining non-allocated sections are packed after it and a new section header
+    table is written at the end. The file is replaced atomically, so hard links to the original
+    file are left untouched. Files whose removable sections sit inside the mapped part (e.g. after
+    patchelf moved their tables) would not get any smaller and are left as they are.
+
+    Returns:
+        True if the file was rewritten, False if there was nothing to strip
+
+    Raises:
+        NotAnElfFile: if the file is not a little-endian ELF64 file
+    """
+    # pylint: disable=too-many-locals,too-many-branches,too-many-statements
+    path = os.fspath(path)
+    with open(path, "rb") as fh:
+        header = read_elf_header(fh)
+        if header.elf_class != ELFCLASS64 or header.data != ELFDATA2LSB:
+            raise NotAnElfFile("only little-endian ELF64 files are supported")
+        sections = read_elf_sections(fh, header)
+        if not sections:
+            return False
+        shstrndx = sections[0].link if header.shstrndx == SHN_XINDEX else header.shstrndx
+        remove = _removable_sections(sections, shstrndx)
+        if not remove:
+            return False
+        if any(s.type == SHT_GROUP for i, s in enumerate(sections) if i not in remove):
+            LOG.debug("Not stripping %s, section groups are not supported", path)
+            return False
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            ph_ranges = _program_header_ranges(mm, header)
+            for i in remove:
+                s = sections[i]
+                if s.type != SHT_NOBITS and any(
+                    s.offset < end and start < s.offset + s.size for start, end in ph_ranges
+                ):
+                    LOG.debug("Not stripping %s, section %s is mapped", path, s.name)
+                    return False
+
+            keep = [i for i in range(len(sections)) if i not in remove]
+            new_index = {old: new for new, old in enumerate(keep)}
+            loaded_end = max(
+                [header.ehsize, header.phoff + header.phnum * header.phentsize]
+                + [end for _, end in ph_ranges]
+                + [
+                    s.offset + s.size
+                    for s in sections
+                    if s.flags & SHF_ALLOC and s.type != SHT_NOBITS
+                ]
+            )
+
+            tmp_path = path + ".strip-tmp"
+            try:
+                with open(tmp_path, "wb") as out:
+                    out.write(mm[:loaded_end])
+                    offsets = {}
+                    for i in sorted(keep, key=lambda k: sections[k].offset):
+                        s = sections[i]
+                        start, end = s.offset, s.offset + s.size
+                        if s.type == SHT_NULL:
+                            offsets[i] = 0
+                        elif s.type == SHT_NOBITS or end <= loaded_end:
+                            offsets[i] = start
+                        else:
+                            align = max(s.addralign, 1)
+                            out.write(b"\0" * (-out.tell() % align))
+                            offsets[i] = out.tell()
+                            out.write(mm[start:end])
+                    out.write(b"\0" * (-out.tell() % 8))
+                    shoff = out.tell()
+                    for i in keep:
+                        s = sections[i]
+                        link = new_index.get(s.link, 0)
+                        info = s.info
+                        if s.flags & SHF_INFO_LINK or (s.type in (SHT_REL, SHT_RELA) and info):
+                            info = new_index.get(info, 0)
+                        size = s.size
+                        if i == 0:
+                            size = len(keep) if len(keep) >= SHN_LORESERVE else 0
+                            link = new_index[shstrndx] if header.shstrndx == SHN_XINDEX else link
+                        out.write(
+                            struct.pack(
+                                "<IIQQQQIIQQ",
+                                s.name_offset,
+                                s.type,
+                                s.flags,
+                                s.addr,
+                                offsets[i],
+                                size,
+                                link,
+                                info,
+                                s.addralign,
+                                s.entsize,
+                            )
+                        )
+                    # e_shoff, then e_shnum and e_shstrndx
+                    out.seek(0x28)
+                    out.write(struct.pack("<Q", shoff))
+                    out.seek(0x3C)
+                    out.write(
+                        struct.pack(
+                            "<HH",
+                            len(keep) if len(keep) < SHN_LORESERVE else 0,
+                            SHN_XINDEX
+                            if header.shstrndx == SHN_XINDEX
+                            else new_index[header.shstrndx],
+                        )
+                    )
+                    # dynamic symbols refer to sections by index
+                    for s in sections:
+                        if s.type != SHT_DYNSYM or not s.entsize:
+                            continue
+                        for off in range(s.offset, s.offset + s.size, s.entsize):
+                            (shndx,) = struct.unpack_from("<H", mm, off + 6)
+                            if 0 < shndx < SHN_LORESERVE and new_index.get(shndx) != shndx:
+                                out.seek(off + 6)
+                                out.write(struct.pack("<H", new_index.get(shndx, 0)))
+                if os.path.getsize(tmp_path) >= len(mm):
+                    LOG.debug("Not stripping %s, it would not get any smaller", path)
+                    os.unlink(tmp_path)
+                    return False
+                shutil.copystat(path, tmp_path)
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+    return True
@@ -0,0 +1,228 @@
+"""
+File Index
+
+An in-memory index of every file in a package directory, built with a single ``os.scandir``
+pass, and a small engine that applies transforms to the indexed files in one dispatch loop.
+
+"""
+from __future__ import annotations
+
+import logging
+import os
+import shutil
+import stat
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+from .util import PathType
+
+LOG = logging.getLogger(__name__)
+
+
+class FileEntry:
+    """A single file in a :class:`FileIndex`"""
+
+    __slots__ = ("path", "rel_path", "parts", "size", "is_symlink", "mtime_ns")
+
+    def __init__(
+        self,
+        path: str,
+        rel_path: str,
+        size: int,
+        is_symlink: bool = False,
+        mtime_ns: int | None = None,
+    ):
+        self.path = path
+        self.rel_path = rel_path
+        self.parts = tuple(rel_path.split(os.sep))
+        self.size = size
+        self.is_symlink = is_symlink
+        self.mtime_ns = mtime_ns
+
+    @property
+    def name(self) -> str:
+        return self.parts[-1]
+
+    @property
+    def suffix(self) -> str:
+        return os.path.splitext(self.parts[-1])[1]
+
+    def __repr__(self):
+        return f"FileEntry({self.rel_path!r}, size={self.size})"
+
+
+class FileIndex:
+    """Index of the files below ``root``, keyed on their path relative to ``root``
+
+    The total size of the indexed files is kept up to date as files are added, refreshed and
+    removed, so reading it never touches the filesystem.
+    """
+
+    def __init__(self, root: PathType):
+        self.root = Path(root)
+        self._root_str = str(self.root)
+        self._entries: dict[str, FileEntry] = {}
+        self._total_size = 0
+
+    @classmethod
+    def scan(cls, root: PathType) -> FileIndex:
+        """Builds an index of ``root`` with a single scan of the directory tree"""
+        index = cls(root)
+        index.add_tree()
+        return index
+
+    def __iter__(self) -> Iterator[FileEntry]:
+        # iterate over a snapshot, so transforms can add and remove entries while we loop
+        return iter(list(self._entries.values()))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, rel_path: str):
+        return rel_path in self._entries
+
+    def get(self, rel_path: str) -> FileEntry | None:
+        return self._entries.get(rel_path)
+
+    @property
+    def total_size(self) -> int:
+        return self._total_size
+
+    def _set(self, entry: FileEntry) -> FileEntry:
+        old = self._entries.get(entry.rel_path)
+        if old is not None:
+            self._total_size -= old.size
+        self._entries[entry.rel_path] = entry
+        self._total_size += entry.size
+        return entry
+
+    def add_tree(self, rel_dir: str = "") -> None:
+        """Adds all files below ``rel_dir`` to the index
+
+        Symlinked directories are not followed.
+        """
+        prefix_len = len(self._root_str) + len(os.sep)
+        stack = [os.path.join(self._root_str, rel_dir) if rel_dir else self._root_str]
+        while stack:
+            with os.scandir(stack.pop()) as it:
+                for de in it:
+                    if de.is_dir(follow_symlinks=False):
+                        stack.append(de.path)
+                    elif de.is_file():
+                        st = de.stat()
+                        self._set(
+                            FileEntry(
+                                de.path,
+                                de.path[prefix_len:],
+                                st.st_size,
+                                de.is_symlink(),
+                                st.st_mtime_ns,
+                            )
+                        )
+
+    def add(self, rel_path: str) -> FileEntry:
+        """Adds (or refreshes) a single file in the index"""
+        path = os.path.join(self._root_str, rel_path)
+        st = os.stat(path)
+        return self._set(
+            FileEntry(path, rel_path, st.st_size, os.path.islink(path), st.st_mtime_ns)
+        )
+
+    def refresh(self, entry: FileEntry) -> FileEntry:
+        """Re-reads the size and modification time of a file that was modified in place"""
+        st = os.stat(entry.path)
+        if self._entries.get(entry.rel_path) is entry:
+            self._total_size += st.st_size - entry.size
+        entry.size = st.st_size
+        entry.mtime_ns = st.st_mtime_ns
+        return entry
+
+    def remove(self, entry: FileEntry, unlink: bool = True) -> None:
+        """Removes a file from the index, and from disk if ``unlink`` is set"""
+        if unlink:
+            try:
+                os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+        if self._entries.get(entry.rel_path) is entry:
+            del self._entries[entry.rel_path]
+            self._total_size -= entry.size
+
+    def remove_where(self, predicate: Callable[[FileEntry], bool], unlink: bool = False) -> int:
+        """Removes all entries matching ``predicate``
+
+        Returns:
+            The number of bytes removed from the index
+        """
+        before = self._total_size
+        for entry in self:
+            if predicate(entry):
+                self.remove(entry, unlink=unlink)
+        return before - self._total_size
+
+
+def unshare(path: str) -> bool:
+    """Replaces a hard linked file with a private copy, so it can be modified in place
+
+    Files in the output may be hard links into shared stores (see :mod:`.package_store`),
+    anything that rewrites a file in place has to call this first.
+
+    Returns:
+        True if the file was copied
+    """
+    st = os.lstat(path)
+    if st.st_nlink < 2 or not stat.S_ISREG(st.st_mode):
+        return False
+    tmp_path = path + ".unshare-tmp"
+    shutil.copy2(path, tmp_path)
+    os.replace(tmp_path, path)
+    return True
+
+
+class Transform:
+    """A predicate/action pair applied to every file of a :class:`FileIndex`
+
+    Subclasses override :meth:`matches` and :meth:`apply`. :meth:`apply` returns the entry that
+    later transforms should see (which may be a new file) or ``None`` if the file was removed.
+    Work that is better done in bulk can be queued in :meth:`apply` and run in :meth:`finish`.
+    """
+
+    name = "transform"
+    #: change in the total size of the index caused by this transform
+    size_delta = 0
+
+    def matches(self, entry: FileEntry) -> bool:  # pylint: disable=unused-argument
+        return True
+
+    def apply(
+        self, entry: FileEntry, index: FileIndex  # pylint: disable=unused-argument
+    ) -> FileEntry | None:
+        return entry
+
+    def finish(self, index: FileIndex) -> None:
+        pass
+
+
+def apply_transforms(index: FileIndex, transforms: Iterable[Transform]) -> None:
+    """Applies all ``transforms``, in order, to every file in the index in a single loop
+
+    The size change caused by each transform is accumulated in its ``size_delta``.
+    """
+    transforms = list(transforms)
+    if not transforms:
+        return
+    for transform in transforms:
+        transform.size_delta = 0
+    for entry in index:
+        current: FileEntry | None = entry
+        for transform in transforms:
+            if transform.matches(current):  # type: ignore[arg-type]
+                before = index.total_size
+                current = transform.apply(current, index)  # type: ignore[arg-type]
+                transform.size_delta += index.total_size - before
+                if current is None:
+                    break
+    for transform in transforms:
+        before = index.total_size
+        transform.finish(index)
+        transform.size_delta += index.total_size - before
@@ -7,30 +7,45 @@ It is an alternative to `sam build` and uses poetry to manage dependencies.
 """
 from __future__ import annotations
 
-import gzip
-import json
 import logging
 import os
-import platform
 import re
 import shutil
-import subprocess  # nosec B404
-from compileall import compile_dir
-from datetime import datetime
+import tempfile
+from fnmatch import fnmatch
+from functools import partial
 from pathlib import Path
 from py_compile import PycInvalidationMode
-from tempfile import TemporaryDirectory
-from zipfile import ZIP_DEFLATED, ZipFile
+from typing import Callable, Iterable
 
 from .arrow_fetcher import fetch_arrow_package
-from .dep_analyzer import DepAnalyzer
+from .build_cache import BuildCache
+from .bytecode import BytecodeCache, compile_files, find_python_interpreter
+from .dep_analyzer import DepAnalyzer, InstallOptions
+from .file_index import FileIndex, Transform, apply_transforms
 from .pip_analyzer import PipAnalyzer
 from .poetry_analyzer import PoetryAnalyzer
-from .util import PLATFORMS, PathType
+from .providers import (
+    Replacement,
+    SlimPackageProvider,
+    apply_providers,
+    registered_providers,
+)
+from .transforms import (  # noqa: F401 pylint: disable=unused-import
+    OTHER_FILE_EXTENSIONS,
+    STRIP_METHODS,
+    CompressBoto,
+    SetUtime,
+    StripLibraries,
+    StripOtherFiles,
+    StripPython,
+    StripTests,
+    get_strip_binary,
+)
+from .util import PathType, get_cache_dir, get_platforms, zip_directory
 
 LOG = logging.getLogger(__name__)
 MAX_LAMBDA_SIZE = 250 * 1024 * 1024  # 250MB
-OTHER_FILE_EXTENSIONS = (".pyx", ".pyi", ".pxi", ".pxd", ".c", ".h", ".cc")
 
 
 class UnsupportedVersionException(Exception):
@@ -57,6 +72,10 @@ class LambdaPackager:
         split_layer: bool = False,
         additional_packages_to_ignore: dict | None = None,
         ignore_unsupported_python: bool = True,
+        python_interpreter: PathType | None = None,
+        install_options: InstallOptions | None = None,
+        stage_next_to_output: bool = True,
+        slim_providers: Iterable[SlimPackageProvider] = (),
     ):  # pylint: disable=too-many-arguments
         """Initialize the Lambda Packager
 
@@ -68,15 +87,38 @@ class LambdaPackager:
             update_dependencies: whether to update pyproject.toml with the appropriate versions of packages
                 from the AWS lambda environment (ignored if ignore_packages is False)
             ignore_packages: Ignore packages that already exist in the AWS lambda environment
+            python_interpreter: Interpreter matching python_version to compile bytecode with, by
+                default one is searched for on the PATH and in pyenv
+            install_options: How to download and install the dependencies, see
+                :data:`dep_analyzer.InstallOptions`:
+
+                - use_wheelhouse: Keep downloaded packages in a per target wheelhouse in the user
+                  cache directory and install from it when all requirements are pinned
+                - installer: How to install pinned wheels, ``pip`` or ``native`` to unpack them in
+                  parallel without running pip for every wheel
+                - use_package_store: Unpack wheels once into a shared store in the user cache
+                  directory and hard link them into the package (native installer only)
+                - staging_dir: Directory to install into before moving to the output
+                - use_requirements_cache: Reuse the requirements resolved by an earlier run when
+                  the dependency files, target and ignored packages are unchanged
+                - downloader: How to download pinned packages into the wheelhouse, ``pip`` or
+                  ``async`` to fetch the wheels concurrently from the package index
+                - pip_shards: Number of concurrent pip processes to install the dependencies with,
+                  each into its own directory, merged into the package afterwards
+            stage_next_to_output: Install into a directory next to output_dir instead of the system
+                temp directory, so the package can be moved into place instead of copied (sets
+                the staging_dir of install_options)
+            slim_providers: Providers of smaller builds to replace installed packages with, asked
+                before the providers registered with :func:`providers.register_provider`
         """
         self._reqs = None
         self._pip = None
+        self.index: FileIndex | None = None
         self.output_dir = Path(output_dir)
-        short_python_version = re.sub(r"^(\d(\.\d+)?)(\.\d+)?$", r"\1", python_version)
         if (
-            "python" + short_python_version,
+            "python" + re.sub(r"^(\d(\.\d+)?)(\.\d+)?$", r"\1", python_version),
             architecture,
-        ) not in PLATFORMS and not ignore_unsupported_python:
+        ) not in get_platforms() and not ignore_unsupported_python:
             raise UnsupportedVersionException(
                 f"{architecture} {python_version} not supported"
             )  # pragma: no cover
@@ -87,21 +129,13 @@ class LambdaPackager:
         self.update_dependencies = update_dependencies
         self.ignore_packages = ignore_packages
         self.split_layer = split_layer
-        analyzer_type: type[DepAnalyzer]
-        if (self.project_path / "pyproject.toml").exists() and not (
-            self.project_path / "requirements.txt"
-        ).exists():
-            LOG.info("pyproject.toml found and not requirements.txt, assuming poetry")
-            analyzer_type = PoetryAnalyzer
-        elif (self.project_path / "requirements.txt").exists() and not (
-            self.project_path / "pyproject.toml"
-        ).exists():
-            LOG.info("requirements.txt found, assuming pip")
-            analyzer_type = PipAnalyzer
-        else:
-            raise ProjectTypeException("Ambiguous project type, quitting")
+        self.python_interpreter = python_interpreter
+        self.slim_providers = list(slim_providers)
+        install_options = install_options or InstallOptions()
+        if stage_next_to_output:
+            install_options = install_options._replace(staging_dir=self._staging_dir())
 
-        self.analyzer = analyzer_type(
+        self.analyzer = self._analyzer_type()(
             self.project_path,
             python_version=self.python_version,
             architecture=self.architecture,
@@ -109,8 +143,27 @@ class LambdaPackager:
             ignore_packages=self.ignore_packages,
             update_dependencies=self.update_dependencies,
             additional_packages_to_ignore=additional_packages_to_ignore,
+            install_options=install_options,
         )
 
+    def _analyzer_type(self) -> type[DepAnalyzer]:
+        if (self.project_path / "pyproject.toml").exists() and not (
+            self.project_path / "requirements.txt"
+        ).exists():
+            LOG.info("pyproject.toml found and not requirements.txt, assuming poetry")
+            return PoetryAnalyzer
+        if (self.project_path / "requirements.txt").exists() and not (
+            self.project_path / "pyproject.toml"
+        ).exists():
+            LOG.info("requirements.txt found, assuming pip")
+            return PipAnalyzer
+        raise ProjectTypeException("Ambiguous project type, quitting")
+
+    def _staging_dir(self) -> Path:
+        staging_dir = self.output_dir.absolute().parent
+        staging_dir.mkdir(parents=True, exist_ok=True)
+        return staging_dir
+
     @classmethod
     def _get_dir_size(cls, d):
         total_size = 0
@@ -121,126 +174,147 @@ class LambdaPackager:
         return total_size
 
     def get_total_size(self):
+        if self.index is not None:
+            return self.index.total_size
         total = self._get_dir_size(self.output_dir)
         # if self.layer_dir:
         #     total += self._get_dir_size(self.layer_dir)
         return total
 
-    def get_aws_wrangler_pyarrow(self):
+    def _reindex_top_level(self, pattern: str):
+        """Re-indexes the top level files and directories matching ``pattern``"""
+        if self.index is None:
+            return
+        self.index.remove_where(lambda e: fnmatch(e.parts[0], pattern))
+        for p in self.output_dir.glob(pattern):
+            if p.is_dir():
+                self.index.add_tree(p.name)
+            elif p.is_file():
+                self.index.add(p.name)
+
+    def get_aws_wrangler_pyarrow(self, exclude_components: Iterable[str] = ()):
         if "pyarrow" not in self.analyzer.exported_requirements():
             LOG.warning(
                 "No pyarrow requirement found in requirements.txt, not bothering to get the aws_wrangler version"
             )
             return
         vers_str = self.analyzer.requirements["pyarrow"].version
-        files_moved = []
-        temp_dir = self.output_dir / "old_pyarrow.bak"
-        for p in self.output_dir.glob("pyarrow*"):
-            old_p = p.resolve()
-            new_p = (temp_dir / p.relative_to(self.output_dir)).resolve()
-            shutil.move(old_p, new_p)
-            files_moved.append((old_p, new_p))
         try:
             fetch_arrow_package(
                 self.output_dir,
                 vers_str,
                 python_version=self.python_version.lstrip("python"),
                 arch=self.architecture,
+                exclude_components=exclude_components,
             )
         except ValueError:
             LOG.warning("pyarrow version %s not found", vers_str)
-            for old_p, new_p in files_moved:
-                shutil.move(new_p, old_p)
-        finally:
-            shutil.rmtree(temp_dir, ignore_errors=True)
+        else:
+            self._reindex_top_level("pyarrow*")
+
+    def _all_slim_providers(self) -> list[SlimPackageProvider]:
+        return [*self.slim_providers, *registered_providers()]
+
+    def use_slim_packages(self) -> list[Replacement]:
+        """Replaces installed packages with the builds supplied by the slim package providers
+
+        Returns:
+            A Replacement for every replaced package
+        """
+        providers = self._all_slim_providers()
+        if not providers:
+            return []
+        replacements = apply_providers(
+            self.output_dir,
+            {name: info.version for name, info in self.analyzer.requirements.items()},
+            providers,
+            self.python_version,
+            self.architecture,
+        )
+        for r in replacements:
+            if self.index is not None:
+                for rel_path in r.removed:
+                    entry = self.index.get(rel_path)
+                    if entry is not None:
+                        self.index.remove(entry, unlink=False)
+                for name in r.added:
+                    self._reindex_top_level(name)
+            LOG.warning(
+                "Replaced %s %s with the build from %s: %s -> %s (%+0.1f%%)",
+                r.name,
+                r.version,
+                r.provider.spec,
+                sizeof_fmt(r.size_before),
+                sizeof_fmt(r.size_after),
+                (r.size_after - r.size_before) / (r.size_before or 1) * 100,
+            )
+        return replacements
+
+    def _apply_transforms(self, *transforms: Transform) -> FileIndex:
+        index = self.index if self.index is not None else FileIndex.scan(self.output_dir)
+        apply_transforms(index, transforms)
+        return index
 
     def strip_tests(self):
         LOG.warning("Stripping tests")
-        for p in self.output_dir.glob("**/*"):
-            if p.is_file() and "tests" in p.relative_to(self.output_dir).parts:
-                LOG.debug("Stripping test file %s", p)
-                p.unlink(missing_ok=True)
-
-    def compile_python(self):
-        if self.python_version.lstrip("python") == ".".join(platform.python_version_tuple()[:2]):
-            LOG.warning("Compiling package")
-            LOG.debug('Target Python version: "%s"', self.python_version)
-            LOG.debug('Build Python Version: "%s"', ".".join(platform.python_version_tuple()))
-            compile_dir(
-                str(self.output_dir.absolute()),
-                ddir="",
-                quiet=2,
-                optimize=2,
-                workers=1,
-                legacy=True,
-                force=True,
-                invalidation_mode=PycInvalidationMode.UNCHECKED_HASH,
+        self._apply_transforms(StripTests())
+
+    def compile_python(self, workers: int = 0, use_cache: bool = True):
+        """Compiles the package to bytecode
+
+        The bytecode is compiled by an interpreter of the target python version, which does not
+        have to be the one running the packager.
+
+        Args:
+            workers: Number of worker processes to compile with, 0 to use all cores
+            use_cache: Reuse bytecode compiled by earlier builds from the user cache directory
+        """
+        interpreter = find_python_interpreter(self.python_version, self.python_interpreter)
+        if interpreter is None:
+            LOG.warning(
+                "Not compiling package, no python %s interpreter found", self.python_version
             )
-            return True
-        LOG.warning("Not compiling package, python version mismatch")
-        return False
+            return False
+        LOG.warning("Compiling package")
+        LOG.debug('Target Python version: "%s"', self.python_version)
+        LOG.debug('Build Python: "%s"', interpreter)
+        index = self.index if self.index is not None else FileIndex.scan(self.output_dir)
+        result = compile_files(
+            self.output_dir.absolute(),
+            [e.rel_path for e in index if e.name.endswith(".py")],
+            optimize=2,
+            workers=workers,
+            invalidation_mode=PycInvalidationMode.UNCHECKED_HASH,
+            interpreter=interpreter,
+            cache=BytecodeCache(get_cache_dir("bytecode")) if use_cache else None,
+        )
+        for rel_path in result.compiled:
+            index.add(rel_path + "c")
+        return True
 
     def strip_python(self):
         LOG.warning("Stripping python scripts")
-        for p in self.output_dir.glob("**/*"):
-            if p.is_file() and p.name.endswith(".py"):
-                LOG.debug("Stripping python file %s", p)
-                p.unlink()
+        self._apply_transforms(StripPython())
 
     def strip_other_files(self):
         LOG.warning("Stripping other files")
-        for p in self.output_dir.glob("**/*"):
-            if p.is_file() and p.suffix in OTHER_FILE_EXTENSIONS:
-                LOG.debug("Stripping file %s", p)
-                p.unlink()
+        self._apply_transforms(StripOtherFiles())
 
     def compress_boto(self):
         LOG.warning("(Re)Compressing botocore and boto3 data files")
-        f: Path
-        for f in self.output_dir.glob("**/boto[3c]*/data/**/*.json*"):
-            if f.name.endswith(".json.gz"):
-                _open = gzip.open
-                new_name = f
-                delete = False
-            else:
-                _open = open
-                new_name = f.with_suffix(".json.gz")
-                delete = True
-            try:
-                with _open(f, "rt") as fh, gzip.GzipFile(
-                    new_name, "wb", compresslevel=9, mtime=0
-                ) as zfh:
-                    # load and dump to decrease unnecessary whitespace,set mtime to 0 to make builds repeatable
-                    json_data = json.load(fh)
-                    zfh.write(json.dumps(json_data, separators=(",", ":")).encode("utf8"))
-            except json.decoder.JSONDecodeError:
-                delete = False
-            finally:
-                if delete:
-                    f.unlink(missing_ok=True)
-
-    def strip_libraries(self):
-        # noinspection PyBroadException
-        try:
-            LOG.warning("Stripping libraries")
-            strip_command = get_strip_binary(self.architecture)
-            for p in self.output_dir.glob("**/*.so*"):
-                LOG.debug('Stripping library "%s"', p)
-                subprocess.run(  # nosec: B603 pylint: disable=subprocess-run-check
-                    [strip_command, str(p)]
-                )
-        except Exception:  # pylint: disable=broad-except
-            LOG.error("Failed to strip libraries, perhaps we don't have the 'strip' command?")
+        self._apply_transforms(CompressBoto())
 
-    def zip_output(self, zip_output):
+    def strip_libraries(self, method: str = "auto"):
+        LOG.warning("Stripping libraries")
+        self._apply_transforms(StripLibraries(self.architecture, method=method))
+
+    def _zip_path(self, zip_output: bool | str) -> Path:
         if isinstance(zip_output, bool):
-            zip_path = Path(str(self.output_dir) + ".zip")
-        else:
-            zip_path = Path(zip_output)
-        with ZipFile(zip_path, "w", compression=ZIP_DEFLATED, compresslevel=9) as zip_file:
-            for f in self.output_dir.glob("**/*"):
-                if f.is_file():
-                    zip_file.write(f, f.relative_to(self.output_dir))
+            return Path(str(self.output_dir) + ".zip")
+        return Path(zip_output)
+
+    def zip_output(self, zip_output):
+        zip_directory(self.output_dir, self._zip_path(zip_output))
 
     def package(  # noqa: C901
         self,
@@ -253,7 +327,29 @@ class LambdaPackager:
         strip_python: bool = False,
         strip_other_files: bool = False,  # pylint: disable=unused-argument
         compress_boto: bool = False,  # pylint: disable=unused-argument
-    ):  # pylint: disable=too-many-arguments,too-many-branches,too-many-locals
+        strip_method: str = "auto",
+        compile_workers: int = 0,
+        compile_cache: bool = True,
+        build_cache: bool = False,
+        exclude_pyarrow_components: tuple[str, ...] = (),
+    ):  # pylint: disable=too-many-arguments,too-many-branches,too-many-locals,too-many-statements
+        # everything that changes the output goes into the build cache key
+        options = dict(locals())
+        for k in ("self", "no_clobber", "compile_workers", "compile_cache", "build_cache"):
+            del options[k]
+        options["zip_output"] = bool(zip_output)
+        options["slim_providers"] = [p.spec for p in self._all_slim_providers()]
+        self.index = None
+        zip_path = self._zip_path(zip_output) if zip_output else None
+        cache = cache_key = None
+        if build_cache and not no_clobber:
+            cache = BuildCache()
+            cache_key = cache.fingerprint(self, options)
+            if cache.restore(cache_key, self.output_dir, zip_path):
+                LOG.warning("Build cache hit, restored %s from the cache", self.output_dir)
+                return self._package_outputs()
+            LOG.info("Build cache miss")
+
         if not no_clobber and os.path.exists(self.output_dir):
             LOG.warning("Output directory %s already exists, removing it", self.output_dir)
             shutil.rmtree(self.output_dir, ignore_errors=True)
@@ -263,11 +359,21 @@ class LambdaPackager:
         layer_paths = self.analyzer.get_layer_files()
         self.analyzer.install_root()
         self.analyzer.copy_from_target(self.output_dir)
-        initial_size = self.get_total_size()
+        # the only full walk of the output, sizes are tracked incrementally from here on
+        self.index = FileIndex.scan(self.output_dir)
+        initial_size = self.index.total_size
         LOG.info("Pre-strip size: %s", sizeof_fmt(initial_size))
 
+        if self.use_slim_packages():
+            new_size = self.get_total_size()
+            LOG.info(
+                "Slim packages size: %s (%0.1f%%)",
+                sizeof_fmt(new_size),
+                new_size / initial_size * 100,
+            )
+
         if use_wrangler_pyarrow:
-            self.get_aws_wrangler_pyarrow()
+            self.get_aws_wrangler_pyarrow(exclude_pyarrow_components)
             new_size = self.get_total_size()
             LOG.info(
                 "Switched PyArrow size: %s (%0.1f%%)",
@@ -279,9 +385,8 @@ class LambdaPackager:
             LOG.warning("Not stripping python, since compile_python is set to False")
             strip_python = False
 
-        self.set_utime()
         if compile_python:
-            compiled = self.compile_python()
+            compiled = self.compile_python(workers=compile_workers, use_cache=compile_cache)
             if strip_python and not compiled:
                 strip_python = False
                 LOG.warning("Unable to compile python, not stripping python")
@@ -289,25 +394,36 @@ class LambdaPackager:
             LOG.info(
                 "Compiled size: %s (%0.1f%%)", sizeof_fmt(new_size), new_size / initial_size * 100
             )
-        for strip_func in (
-            "strip_python",
-            "strip_tests",
-            "strip_libraries",
-            "strip_other_files",
-            "compress_boto",
-        ):
-            if locals()[strip_func]:
-                getattr(self, strip_func)()
-                new_size = self.get_total_size()
-                LOG.info(
-                    "%s done, new size: %s (%0.1f%%)",
-                    strip_func,
-                    sizeof_fmt(new_size),
-                    new_size / initial_size * 100,
-                )
+        enabled = locals()
+        transforms: list[Transform] = []
+        factories: list[tuple[str, Callable[[], Transform]]] = [
+            ("strip_python", StripPython),
+            ("strip_tests", StripTests),
+            ("strip_libraries", partial(StripLibraries, self.architecture, method=strip_method)),
+            ("strip_other_files", StripOtherFiles),
+            ("compress_boto", CompressBoto),
+        ]
+        for strip_func, factory in factories:
+            if enabled[strip_func]:
+                LOG.warning("Running %s", strip_func)
+                transforms.append(factory())
+        # always last, so every file (including ones created by earlier transforms) is covered
+        transforms.append(SetUtime())
+        new_size = self.index.total_size
+        self._apply_transforms(*transforms)
+        for t in transforms[:-1]:
+            new_size += t.size_delta
+            LOG.info(
+                "%s done, new size: %s (%0.1f%%)",
+                t.name,
+                sizeof_fmt(new_size),
+                new_size / initial_size * 100,
+            )
+        size_out = self.index.total_size
         if self.split_layer:
             self._layer_splitter(layer_paths)
-        size_out = self.get_total_size()
+            # files have moved to main/ and layer/, the index no longer matches the tree
+            self.index = None
         if size_out > MAX_LAMBDA_SIZE:
             LOG.error(
                 "Package size %s exceeds maximum lambda size %s",
@@ -321,31 +437,33 @@ class LambdaPackager:
         if zip_output:
             LOG.warning("Zipping output")
             self.zip_output(zip_output)
+        if cache is not None:
+            cache.store(cache_key, self.output_dir, zip_path)  # type: ignore[arg-type]
+        return self._package_outputs()
+
+    def _package_outputs(self):
         if self.split_layer:
             return self.output_dir / "main", self.output_dir / "layer"
         return self.output_dir, None
 
     def _layer_splitter(self, layer_paths: list[Path]):
-        with TemporaryDirectory() as layer_td, TemporaryDirectory() as main_td:
-            for lp in layer_paths:
-                lp = self.output_dir / lp
-                if not lp.exists():
-                    continue
-                shutil.move(str(lp.resolve()), layer_td)
-            for p in self.output_dir.iterdir():
-                shutil.move(str(p.resolve()), main_td)
-            main_dir = self.output_dir / "main"
-            layer_dir = self.output_dir / "layer"
-            shutil.move(layer_td, layer_dir)
-            shutil.move(main_td, main_dir)
+        # staged inside output_dir, so every move is a rename on the same filesystem
+        layer_td = Path(tempfile.mkdtemp(prefix=".layer-", dir=self.output_dir))
+        main_td = Path(tempfile.mkdtemp(prefix=".main-", dir=self.output_dir))
+        for lp in layer_paths:
+            lp = self.output_dir / lp
+            if not lp.exists():
+                continue
+            os.rename(lp, layer_td / lp.name)
+        for p in self.output_dir.iterdir():
+            if p not in (layer_td, main_td):
+                os.rename(p, main_td / p.name)
+        os.rename(layer_td, self.output_dir / "layer")
+        os.rename(main_td, self.output_dir / "main")
+        LOG.info("Split %s into main and layer using renames", self.output_dir)
 
     def set_utime(self, set_time: int | None = None):
-        if set_time is None:
-            set_time = int(datetime(2020, 1, 1, 1, 1).timestamp()) * int(1e9)
-        for dirpath, _, filenames in os.walk(self.output_dir):  # noqa: B007
-            for f in filenames:
-                fp = os.path.join(dirpath, f)
-                os.utime(fp, ns=(set_time, set_time))
+        self._apply_transforms(SetUtime(set_time))
 
 
 def sizeof_fmt(num, suffix="B"):
@@ -354,23 +472,3 @@ def sizeof_fmt(num, suffix="B"):
             return f"{num:3.1f}{unit}{suffix}"
         num /= 1024.0
     return f"{num:.1f}Yi{suffix}"
-
-
-def get_strip_binary(architecture="x86_64"):
-    if architecture == "x86_64":
-        c = shutil.which("x86_64-linux-gnu-strip") or shutil.which("strip")
-
-    elif architecture == "arm64":
-        c = shutil.which("aarch64-linux-gnu-strip")
-    else:
-        raise ValueError(f"Unknown architecture {architecture}")
-
-    if c is None:
-        arch = "aarch64" if architecture == "arm64" else "x86_64"
-        LOG.error(
-            'Could not find "strip" binary for architecture "%s", perhaps install it with "apt-get install binutils-%s-linux-gnu"?',
-            architecture,
-            arch,
-        )
-        raise FileNotFoundError(f"Could not find strip binary for {architecture}")
-    return c
@@ -0,0 +1,230 @@
+"""
+Layer Optimizer
+
+Picks shared Lambda layers for a fleet of built functions. Every installed package (name and
+version, from its ``.dist-info``) is keyed on the set of functions that use it; the packages with
+the same set of functions form a candidate layer, which saves its size for every function but one.
+Candidates are taken greedily by the bytes they save, as long as no function gets more than
+``max_layers`` layers, counting the layers it already has. A layer only holds packages all of its
+functions use, so a function with its layers is exactly as large as it was built, and stays within
+the 250MB unzipped limit if it was built within it.
+
+A layer is named after its target and pins, so a layer that ends up with the same packages in
+the next run keeps its name, and only layers whose packages changed have to be published again.
+
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+from collections import namedtuple
+from pathlib import Path
+
+from packaging.utils import canonicalize_name
+
+from .util import PathType
+
+LOG = logging.getLogger(__name__)
+
+MAX_LAYERS = 5
+# smaller layers are not worth one of the few layer slots of a function
+DEFAULT_MIN_SAVINGS = 1024 * 1024  # 1MB
+PLAN_FILE = "layers.json"
+
+Package = namedtuple("Package", ["name", "version", "entries", "size"])
+Function = namedtuple("Function", ["name", "path", "target", "packages", "size", "layers"])
+Layer = namedtuple("Layer", ["name", "target", "packages", "functions", "size"])
+LayerPlan = namedtuple("LayerPlan", ["layers", "assignments", "saved"])
+
+
+def _entry_size(path: Path) -> int:
+    if path.is_symlink() or not path.is_dir():
+        return path.lstat().st_size
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for f in filenames:
+            total += os.lstat(os.path.join(dirpath, f)).st_size
+    return total
+
+
+def _top_level_entries(package_dir: Path, dist_info: Path) -> set[str]:
+    entries = {dist_info.name}
+    if (dist_info / "RECORD").is_file():
+        with open(dist_info / "RECORD", encoding="utf8") as fh:
+            for line in fh:
+                path = line.rsplit(",", 2)[0].strip()
+                if path and not path.startswith("../") and not os.path.isabs(path):
+                    entries.add(path.replace("\\", "/").split("/")[0])
+    # a module may have been compiled (and its source stripped) after the install
+    for entry in list(entries):
+        if entry.endswith(".py"):
+            entries.add(entry + "c")
+    return {e for e in entries if os.path.lexists(package_dir / e)}
+
+
+def scan_packages(package_dir: PathType) -> list[Package]:
+    """Lists the packages installed in a function's package directory
+
+    Packages that share a top level directory (e.g. a namespace package) with another package
+    are left out, as they can't be moved to a layer on their own.
+    """
+    package_dir = Path(package_dir)
+    found = []
+    for dist_info in sorted(package_dir.glob("*.dist-info")):
+        name, _, version = dist_info.name[: -len(".dist-info")].partition("-")
+        found.append((canonicalize_name(name), version, _top_level_entries(package_dir, dist_info)))
+    owners: dict[str, int] = {}
+    for _, _, entries in found:
+        for e in entries:
+            owners[e] = owners.get(e, 0) + 1
+    packages = []
+    for name, version, entries in found:
+        if any(owners[e] > 1 for e in entries):
+            LOG.debug("%s shares its files with another package, not moving it", name)
+            continue
+        size = sum(_entry_size(package_dir / e) for e in entries)
+        packages.append(Package(name, version, sorted(entries), size))
+    return packages
+
+
+def scan_function(
+    name: str, package_dir: PathType, target: tuple = (), layers: int = 0
+) -> Function:
+    """Describes a built function
+
+    Args:
+        name: Function name
+        package_dir: Directory with the installed packages of the function (its output, or the
+            ``layer`` directory of a split build)
+        target: Python version and architecture, only functions of the same target share layers
+        layers: Number of layers the function already has, e.g. 1 for a split build
+    """
+    package_dir = Path(package_dir)
+    packages = {(p.name, p.version): p for p in scan_packages(package_dir)}
+    return Function(name, package_dir, tuple(target), packages, _entry_size(package_dir), layers)
+
+
+def _layer_name(target: tuple, pins: list[tuple[str, str]]) -> str:
+    digest = hashlib.sha256(json.dumps([list(target), pins]).encode()).hexdigest()
+    return f"layer-{digest[:12]}"
+
+
+def _candidate_layers(functions: list[Function]) -> list[tuple]:
+    """Groups the packages by the functions using them, one candidate layer per group
+
+    Returns:
+        ``(savings, target, function names, pins, size)`` tuples, most savings first
+    """
+    # package -> functions using it, per target
+    users: dict[tuple, list[str]] = {}
+    for f in functions:
+        for pin in f.packages:
+            users.setdefault((f.target, pin), []).append(f.name)
+    groups: dict[tuple, list[tuple[str, str]]] = {}
+    for (target, pin), names in users.items():
+        if len(names) > 1:
+            groups.setdefault((target, tuple(sorted(names))), []).append(pin)
+
+    by_name = {f.name: f for f in functions}
+    candidates = []
+    for (target, names), pins in groups.items():
+        size = sum(by_name[names[0]].packages[pin].size for pin in pins)
+        candidates.append((size * (len(names) - 1), target, names, sorted(pins), size))
+    # most savings first, ties broken by name so the plan is stable
+    candidates.sort(key=lambda c: (-c[0], c[1], c[2]))
+    return candidates
+
+
+def plan_layers(
+    functions: list[Function],
+    max_layers: int = MAX_LAYERS,
+    min_savings: int = DEFAULT_MIN_SAVINGS,
+) -> LayerPlan:
+    """Picks the shared layers of a fleet of functions
+
+    Args:
+        functions: The functions, see :func:`scan_function`
+        max_layers: Maximum number of layers of a function, including the ones it already has
+        min_savings: Candidate layers saving fewer bytes are not used
+
+    Returns:
+        A LayerPlan with the layers by name, the layer names of every function and the number of
+        bytes no longer deployed more than once
+    """
+    by_name = {f.name: f for f in functions}
+    assignments: dict[str, list[str]] = {f.name: [] for f in functions}
+    layers: dict[str, Layer] = {}
+    saved = 0
+    for _, target, names, pins, size in _candidate_layers(functions):
+        members = [n for n in names if len(assignments[n]) + by_name[n].layers < max_layers]
+        if len(members) < 2 or size * (len(members) - 1) < min_savings:
+            continue
+        layer = Layer(_layer_name(target, pins), target, pins, members, size)
+        layers[layer.name] = layer
+        for n in members:
+            assignments[n].append(layer.name)
+        saved += size * (len(members) - 1)
+    return LayerPlan(layers, assignments, saved)
+
+
+def apply_plan(plan: LayerPlan, functions: list[Function], layers_dir: PathType) -> Path:
+    """Moves the packages of the layers out of the functions into the layer directories
+
+    Every layer is written to ``layers_dir/NAME/python``, as Lambda expects, and the plan to
+    ``layers_dir/layers.json``.
+
+    Returns:
+        Path of the plan file
+    """
+    layers_dir = Path(layers_dir)
+    layers_dir.mkdir(parents=True, exist_ok=True)
+    for stale in layers_dir.glob("layer-*"):
+        if stale.name not in plan.layers and stale.is_dir():
+            shutil.rmtree(stale)
+    by_name = {f.name: f for f in functions}
+    for layer in plan.layers.values():
+        layer_python = layers_dir / layer.name / "python"
+        if layer_python.exists():
+            shutil.rmtree(layer_python)
+        layer_python.mkdir(parents=True)
+        source, *others = (by_name[n] for n in layer.functions)
+        for pin in layer.packages:
+            for entry in source.packages[pin].entries:
+                shutil.move(str(source.path / entry), str(layer_python / entry))
+            for f in others:
+                for entry in f.packages[pin].entries:
+                    path = f.path / entry
+                    if path.is_dir() and not path.is_symlink():
+                        shutil.rmtree(path)
+                    else:
+                        path.unlink()
+        LOG.info(
+            "Layer %s: %s (%s bytes) for %s",
+            layer.name,
+            ", ".join(f"{n}=={v}" for n, v in layer.packages),
+            layer.size,
+            ", ".join(layer.functions),
+        )
+    plan_file = layers_dir / PLAN_FILE
+    with plan_file.open("w", encoding="utf8") as fh:
+        json.dump(
+            {
+                "layers": {
+                    name: {
+                        "target": list(layer.target),
+                        "packages": [f"{n}=={v}" for n, v in layer.packages],
+                        "functions": layer.functions,
+                        "size": layer.size,
+                    }
+                    for name, layer in sorted(plan.layers.items())
+                },
+                "functions": plan.assignments,
+                "saved": plan.saved,
+            },
+            fh,
+            indent=2,
+        )
+    return plan_file
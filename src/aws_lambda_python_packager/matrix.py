@@ -0,0 +1,219 @@
+"""
+Matrix Builds
+
+Builds a project for several targets (python version and architecture) at once, one output
+directory per target. For every python version one target, the leader, is built first; it
+resolves the requirements and fills its wheelhouse. The other architectures of that python version
+then reuse the pure python wheels of the leader's wheelhouse, so they only download the wheels of
+their own platform, and for poetry projects its resolution as well. Wheels are only shared when
+the wheelhouse is enabled (``use_wheelhouse``). Independent targets are built in parallel processes.
+
+"""
+from __future__ import annotations
+
+import logging
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable
+
+from .build_cache import DEPENDENCY_FILES
+from .dep_analyzer import PLATFORM_TAGS
+from .lambda_packager import LambdaPackager
+from .util import PathType
+from .wheelhouse import Wheelhouse
+
+LOG = logging.getLogger(__name__)
+
+ARCHITECTURES = ("x86_64", "arm64")
+# dependency file contents that make the resolution depend on the architecture
+_ARCH_MARKERS = ("platform_machine", "platform.machine")
+
+Target = namedtuple("Target", ["python_version", "architecture"])
+TargetResult = namedtuple("TargetResult", ["target", "outputs", "error"])
+
+
+def parse_matrix(spec: str) -> list[Target]:
+    """Parses a matrix description
+
+    Args:
+        spec: ``PYTHON_VERSIONS[:ARCHITECTURES]`` with comma separated lists, e.g.
+            ``3.9,3.10:x86_64,arm64``, all architectures by default
+
+    Returns:
+        The targets, every python version with every architecture
+
+    Raises:
+        ValueError: for an unknown architecture or an empty list
+    """
+    python_versions, _, architectures = spec.partition(":")
+    pythons = [p.strip() for p in python_versions.split(",") if p.strip()]
+    archs = [a.strip() for a in architectures.split(",") if a.strip()] or list(ARCHITECTURES)
+    if not pythons:
+        raise ValueError(f"No python versions in {spec!r}")
+    for arch in archs:
+        if arch not in ARCHITECTURES:
+            raise ValueError(f"Unknown architecture {arch}, expected one of {ARCHITECTURES}")
+    return [Target(p, a) for p in pythons for a in archs]
+
+
+def target_output_dir(output_dir: PathType, target: Target) -> Path:
+    return Path(output_dir) / f"python{target.python_version}-{target.architecture}"
+
+
+def resolution_is_shared(project_path: PathType, packager_kwargs: dict[str, Any]) -> bool:
+    """Whether the requirements resolved for one architecture hold for the others as well
+
+    Only a poetry lock file pins the same versions for every architecture, pip picks the versions
+    that have wheels for the platform it resolves for.
+    """
+    project_path = Path(project_path)
+    if packager_kwargs.get("update_dependencies"):
+        return False
+    if (project_path / "requirements.txt").exists() or not (project_path / "poetry.lock").is_file():
+        LOG.info("Not a poetry project with a lock file, resolving every target")
+        return False
+    for name in DEPENDENCY_FILES:
+        path = project_path / name
+        if path.is_file() and any(m in path.read_text("utf8") for m in _ARCH_MARKERS):
+            LOG.info("%s depends on the architecture, resolving every target", name)
+            return False
+    return True
+
+
+def build_target(
+    target: Target,
+    project_path: PathType,
+    output_dir: PathType,
+    packager_kwargs: dict[str, Any],
+    package_kwargs: dict[str, Any],
+    resolution: tuple[list, list] | None = None,
+    wheels_from: Target | None = None,
+) -> tuple[Any, tuple[list, list]]:
+    """Builds a single target of a matrix
+
+    Args:
+        target: The target
+        project_path: Project to build
+        output_dir: Output directory of the target
+        packager_kwargs: Additional arguments of :class:`LambdaPackager`
+        package_kwargs: Arguments of :meth:`LambdaPackager.package`
+        resolution: Requirements and extra lines resolved for another target, to use instead of
+            resolving them again
+        wheels_from: Target of the same python version to take the pure python wheels from
+
+    Returns:
+        The outputs of :meth:`LambdaPackager.package` and the resolution of the target
+    """
+    packager = LambdaPackager(
+        project_path,
+        output_dir,
+        python_version=target.python_version,
+        architecture=target.architecture,
+        **packager_kwargs,
+    )
+    analyzer = packager.analyzer
+    if resolution is not None:
+        analyzer.use_requirements(*resolution)
+    if wheels_from is not None and analyzer.wheelhouse is not None:
+        source = Wheelhouse(
+            wheels_from.python_version,
+            PLATFORM_TAGS.get(wheels_from.architecture, wheels_from.architecture),
+        )
+        linked = analyzer.wheelhouse.import_universal(source)
+        LOG.info("Linked %s pure python wheels into the %s wheelhouse", linked, target)
+    outputs = packager.package(**package_kwargs)
+    return outputs, (list(analyzer.requirements.values()), analyzer.extra_lines)
+
+
+def _group_targets(targets: list[Target]) -> tuple[list[Target], dict[Target, list[Target]]]:
+    """Picks the first target of every python version as the leader of the others
+
+    Returns:
+        The leaders, and the targets that wait for each leader
+    """
+    leaders: dict[str, Target] = {}
+    followers: dict[Target, list[Target]] = {}
+    for target in targets:
+        leader = leaders.setdefault(target.python_version, target)
+        if leader != target:
+            followers.setdefault(leader, []).append(target)
+    return list(leaders.values()), followers
+
+
+def _build_in_order(
+    submit: Callable[..., Future],
+    leaders: list[Target],
+    followers: dict[Target, list[Target]],
+    shared: bool,
+) -> dict[Target, TargetResult]:
+    """Builds the leaders, and the followers of each leader once it is done"""
+    results: dict[Target, TargetResult] = {}
+    running = {submit(t): t for t in leaders}
+    while running:
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            target = running.pop(future)
+            resolution = None
+            try:
+                outputs, resolution = future.result()
+                results[target] = TargetResult(target, outputs, None)
+                LOG.warning("Built %s", target)
+            except Exception as e:  # pylint: disable=broad-except
+                LOG.error("Building %s failed: %s", target, e)
+                results[target] = TargetResult(target, None, str(e))
+            for follower in followers.pop(target, []):
+                running[submit(follower, resolution if shared else None, target)] = follower
+    return results
+
+
+def build_matrix(
+    targets: list[Target],
+    project_path: PathType,
+    output_dir: PathType,
+    packager_kwargs: dict[str, Any] | None = None,
+    package_kwargs: dict[str, Any] | None = None,
+    concurrency: int = 2,
+) -> list[TargetResult]:
+    """Builds a project for several targets
+
+    Args:
+        targets: Targets to build
+        project_path: Project to build
+        output_dir: Directory to write the outputs to, see :func:`target_output_dir`
+        packager_kwargs: Additional arguments of :class:`LambdaPackager`, the same for all targets
+        package_kwargs: Arguments of :meth:`LambdaPackager.package`, the same for all targets
+        concurrency: Maximum number of targets built at the same time
+
+    Returns:
+        A TargetResult for every target, in the order of ``targets``, with the error message of
+        the targets that failed
+
+    Raises:
+        ValueError: when updating the dependency file, which the targets can't do concurrently
+    """
+    packager_kwargs = dict(packager_kwargs or {})
+    package_kwargs = dict(package_kwargs or {})
+    if packager_kwargs.get("update_dependencies"):
+        raise ValueError("Matrix builds can't update the dependency file")
+    targets = list(dict.fromkeys(targets))
+    shared = resolution_is_shared(project_path, packager_kwargs)
+    leaders, followers = _group_targets(targets)
+
+    with ProcessPoolExecutor(max(1, concurrency)) as pool:
+
+        def _submit(target, resolution=None, wheels_from=None) -> Future:
+            LOG.warning("Building %s", target)
+            return pool.submit(
+                build_target,
+                target,
+                project_path,
+                target_output_dir(output_dir, target),
+                packager_kwargs,
+                package_kwargs,
+                resolution,
+                wheels_from,
+            )
+
+        results = _build_in_order(_submit, leaders, followers, shared)
+    return [results[t] for t in targets]
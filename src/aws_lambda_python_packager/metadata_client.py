@@ -0,0 +1,253 @@
+"""
+Metadata Client
+
+A shared HTTP client for the small metadata documents the packager reads (Lambda runtimes, Glue
+libraries, the packages in the Lambda environment, pyarrow releases). Requests go through one
+pooled session and responses are cached on disk. A cached response is used as is for its time to
+live, then revalidated with ``ETag``/``Last-Modified``; when the server can't be reached or
+refuses the request (e.g. GitHub rate limits), a stale response is used for a while longer.
+
+Setting ``LAMBDA_PACKAGER_METADATA_URL`` sends every request to ``{base}/{host}/{path}`` instead,
+so a local server can stand in for the real hosts in tests and air-gapped CI. Responses are cached
+per resolved URL, so different base URLs don't share cache entries.
+
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .paths import PathType, get_cache_dir
+
+LOG = logging.getLogger(__name__)
+
+METADATA_URL_ENV = "LAMBDA_PACKAGER_METADATA_URL"
+DEFAULT_TTL = 24 * 60 * 60  # 1 day
+DEFAULT_STALE_IF_ERROR = 30 * 24 * 60 * 60  # 30 days
+# responses worth caching, a missing document is an answer too
+CACHEABLE_STATUS = (200, 404)
+
+
+class MetadataResponse:
+    """A (possibly cached) response
+
+    Attributes:
+        url: The requested URL, before any base URL rewriting
+        status_code: HTTP status of the response
+        content: Response body
+        headers: The caching related response headers
+        from_cache: Whether the response was served from the cache without a request
+        stale: Whether the response is a stale copy used because the request failed
+    """
+
+    def __init__(
+        self,
+        url: str,
+        status_code: int,
+        content: bytes,
+        headers: dict[str, str],
+        from_cache: bool = False,
+        stale: bool = False,
+    ):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.from_cache = from_cache
+        self.stale = stale
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf8")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error for url: {self.url}")
+
+
+class MetadataClient:
+    """Caching HTTP client for metadata documents
+
+    Args:
+        cache_dir: Cache directory, defaults to ``http`` in the lambda-packager cache
+        base_url: Base URL to send all requests to, defaults to ``LAMBDA_PACKAGER_METADATA_URL``
+        session: Session to use, a new pooled one by default
+    """
+
+    def __init__(
+        self,
+        cache_dir: PathType | None = None,
+        base_url: str | None = None,
+        session: requests.Session | None = None,
+    ):
+        self._cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self._base_url = base_url
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        self.session = session
+
+    @property
+    def cache_dir(self) -> Path:
+        return self._cache_dir if self._cache_dir is not None else get_cache_dir("http")
+
+    def resolve_url(self, url: str) -> str:
+        """Applies the configured base URL to ``url``"""
+        base_url = self._base_url or os.environ.get(METADATA_URL_ENV)
+        if not base_url:
+            return url
+        parts = urlsplit(url)
+        resolved = f"{base_url.rstrip('/')}/{parts.netloc}{parts.path}"
+        return f"{resolved}?{parts.query}" if parts.query else resolved
+
+    def _paths(self, url: str) -> tuple[Path, Path]:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return self.cache_dir / f"{key}.json", self.cache_dir / f"{key}.body"
+
+    def _load(self, url: str) -> tuple[dict, bytes] | None:
+        meta_path, body_path = self._paths(url)
+        try:
+            with meta_path.open(encoding="utf8") as fh:
+                meta = json.load(fh)
+            return meta, body_path.read_bytes()
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, url: str, meta: dict, body: bytes | None = None) -> None:
+        meta_path, body_path = self._paths(url)
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            meta_path.parent.mkdir(parents=True, exist_ok=True)
+            if body is not None:
+                body_path.with_name(body_path.name + suffix).write_bytes(body)
+                os.replace(body_path.with_name(body_path.name + suffix), body_path)
+            meta_path.with_name(meta_path.name + suffix).write_text(json.dumps(meta), "utf8")
+            os.replace(meta_path.with_name(meta_path.name + suffix), meta_path)
+        except OSError as e:
+            LOG.debug("Unable to cache %s: %s", url, e)
+
+    def get(
+        self,
+        url: str,
+        ttl: float = DEFAULT_TTL,
+        stale_if_error: float = DEFAULT_STALE_IF_ERROR,
+        headers: dict[str, str] | None = None,
+        timeout: float = 10,
+    ) -> MetadataResponse:
+        """Gets a document, from the cache if it is fresh enough
+
+        Args:
+            url: URL of the document
+            ttl: Seconds a cached response is used without revalidating it
+            stale_if_error: Seconds past ``ttl`` a cached response is still used when the request
+                fails
+            headers: Additional request headers
+            timeout: Request timeout in seconds
+
+        Returns:
+            The response, 200 and 404 responses are cached
+
+        Raises:
+            requests.RequestException: if the request fails and there is no usable cached response
+        """
+        resolved = self.resolve_url(url)
+        cached = self._load(resolved)
+        if cached and time.time() - cached[0]["fetched"] < ttl:
+            return self._from_cache(url, cached)
+        try:
+            r = self.session.get(
+                resolved, headers=self._conditional_headers(cached, headers), timeout=timeout
+            )
+            if r.status_code == 304 and cached:
+                return self._not_modified(url, resolved, cached)
+            if r.status_code not in CACHEABLE_STATUS:
+                r.raise_for_status()
+        except requests.RequestException as e:
+            stale = self._stale_if_error(url, cached, ttl + stale_if_error, e)
+            if stale is None:
+                raise
+            return stale
+        response_headers = {
+            k.lower(): v
+            for k, v in r.headers.items()
+            if k.lower() in ("etag", "last-modified", "content-type")
+        }
+        self._store(
+            resolved,
+            {
+                "url": resolved,
+                "status": r.status_code,
+                "headers": response_headers,
+                "fetched": time.time(),
+            },
+            r.content,
+        )
+        return MetadataResponse(url, r.status_code, r.content, response_headers)
+
+    @staticmethod
+    def _from_cache(url: str, cached: tuple[dict, bytes], stale=False) -> MetadataResponse:
+        meta, body = cached
+        return MetadataResponse(
+            url, meta["status"], body, meta["headers"], from_cache=True, stale=stale
+        )
+
+    @staticmethod
+    def _conditional_headers(
+        cached: tuple[dict, bytes] | None, headers: dict[str, str] | None
+    ) -> dict[str, str]:
+        """The request headers, revalidating the cached response if there is one"""
+        request_headers = dict(headers or {})
+        if cached and cached[0]["status"] == 200:
+            cached_headers = cached[0]["headers"]
+            if cached_headers.get("etag"):
+                request_headers["If-None-Match"] = cached_headers["etag"]
+            if cached_headers.get("last-modified"):
+                request_headers["If-Modified-Since"] = cached_headers["last-modified"]
+        return request_headers
+
+    def _not_modified(
+        self, url: str, resolved: str, cached: tuple[dict, bytes]
+    ) -> MetadataResponse:
+        LOG.debug("%s not modified", url)
+        self._store(resolved, dict(cached[0], fetched=time.time()))
+        return self._from_cache(url, cached)
+
+    def _stale_if_error(
+        self,
+        url: str,
+        cached: tuple[dict, bytes] | None,
+        max_age: float,
+        error: requests.RequestException,
+    ) -> MetadataResponse | None:
+        """The cached response if it may still be used after the request failed"""
+        if not cached or time.time() - cached[0]["fetched"] >= max_age:
+            return None
+        LOG.warning("Unable to fetch %s (%s), using a cached copy", url, error)
+        return self._from_cache(url, cached, stale=True)
+
+
+_CLIENT: MetadataClient | None = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_client() -> MetadataClient:
+    """Gets the client shared by the whole process"""
+    global _CLIENT  # pylint: disable=global-statement
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = MetadataClient()
+        return _CLIENT
@@ -0,0 +1,147 @@
+"""
+Package Store
+
+A content addressed store of unpacked wheels, shared by all builds. Every wheel is unpacked once
+(keyed on the sha256 of the wheel file, which pins its name, version and tag) and installs are
+assembled from hard links into the store. A file lock per entry keeps concurrent builds, e.g.
+parallel CI jobs sharing a cache directory, from unpacking the same wheel twice or pruning an
+entry that is being linked.
+
+Files linked from the store must not be modified in place, see :func:`.file_index.unshare`.
+
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from .util import PathType, get_cache_dir, link_or_copy
+from .wheel_installer import InstalledWheel, install_wheel
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore[assignment]
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_MAX_AGE = 30 * 86400  # 30 days
+
+
+def _file_hash(path: PathType) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PackageStore:
+    """Unpacked wheels, hard linked into install targets
+
+    Args:
+        root: Store directory, defaults to ``store`` in the lambda-packager cache
+    """
+
+    def __init__(self, root: PathType | None = None):
+        self.root = Path(root) if root is not None else get_cache_dir("store")
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.linked = 0
+        self.copied = 0
+        self._stats_lock = threading.Lock()
+
+    def _entry(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    @contextmanager
+    def _lock(self, key: str, exclusive: bool = True):
+        if fcntl is None:  # pragma: no cover
+            yield
+            return
+        lock_path = self.root / key[:2] / f"{key}.lock"
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(lock_path, "a+b") as fh:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+    def add(self, wheel: PathType) -> tuple[str, InstalledWheel]:
+        """Unpacks a wheel into the store, unless it is there already
+
+        Returns:
+            The store key and the InstalledWheel describing the entry
+        """
+        key = _file_hash(wheel)
+        entry = self._entry(key)
+        with self._lock(key):
+            if not entry.is_dir():
+                tmp_entry = entry.with_name(f"{key}.{os.getpid()}.tmp")
+                shutil.rmtree(tmp_entry, ignore_errors=True)
+                try:
+                    install_wheel(wheel, tmp_entry)
+                    os.replace(tmp_entry, entry)
+                except BaseException:
+                    shutil.rmtree(tmp_entry, ignore_errors=True)
+                    raise
+                LOG.debug("Added %s to the package store", Path(wheel).name)
+        dist_info = next(p.name for p in entry.iterdir() if p.name.endswith(".dist-info"))
+        files = [
+            os.path.relpath(os.path.join(dirpath, f), entry).replace(os.sep, "/")
+            for dirpath, _, filenames in os.walk(entry)
+            for f in filenames
+        ]
+        return key, InstalledWheel(Path(wheel), dist_info, files)
+
+    def install(self, wheel: PathType, target: PathType) -> InstalledWheel:
+        """Installs a wheel into ``target`` by hard linking its store entry
+
+        Falls back to copying when the target is on another filesystem.
+        """
+        target = Path(target)
+        linked = copied = 0
+        while True:
+            key, installed = self.add(wheel)
+            entry = self._entry(key)
+            with self._lock(key, exclusive=False):
+                if not entry.is_dir():
+                    continue  # pruned by another process in the meantime
+                for rel_path in installed.files:
+                    dest = target.joinpath(*rel_path.split("/"))
+                    dest.parent.mkdir(parents=True, exist_ok=True)
+                    if link_or_copy(entry.joinpath(*rel_path.split("/")), dest):
+                        linked += 1
+                    else:
+                        copied += 1
+                now = time.time()
+                os.utime(entry, (now, now))
+                break
+        with self._stats_lock:
+            self.linked += linked
+            self.copied += copied
+        return installed
+
+    def prune(self, max_age: float = DEFAULT_MAX_AGE) -> int:
+        """Removes entries that were not installed for ``max_age`` seconds
+
+        Returns:
+            The number of removed entries
+        """
+        cutoff = time.time() - max_age
+        removed = 0
+        for entry in self.root.glob("*/*"):
+            if not entry.is_dir() or entry.name.endswith(".tmp"):
+                continue
+            with self._lock(entry.name):
+                if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                    LOG.debug("Removing %s from the package store", entry.name)
+                    shutil.rmtree(entry, ignore_errors=True)
+                    removed += 1
+        return removed
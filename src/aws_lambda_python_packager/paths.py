@@ -0,0 +1,36 @@
+"""
+Paths
+
+The path type and the cache directory helper shared by every module, kept free of imports from
+the rest of the package so any module (e.g. the metadata client) can use them.
+
+"""
+from __future__ import annotations
+
+import os
+from os import PathLike
+from pathlib import Path
+from typing import Union
+
+from appdirs import user_cache_dir
+
+CACHE_DIR_ENV = "LAMBDA_PACKAGER_CACHE_DIR"
+
+PathType = Union[str, PathLike]
+
+
+def get_cache_dir(*parts: str) -> Path:
+    """Gets (and creates) a directory inside the lambda-packager cache
+
+    The cache root can be overridden with the ``LAMBDA_PACKAGER_CACHE_DIR`` environment variable.
+
+    Args:
+        *parts: Subdirectories below the cache root
+
+    Returns:
+        Path to the cache directory
+    """
+    root = os.environ.get(CACHE_DIR_ENV) or user_cache_dir("lambda-packager")
+    path = Path(root, *parts)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
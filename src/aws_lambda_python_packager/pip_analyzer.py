@@ -1,11 +1,12 @@
 from __future__ import annotations
 
+import json
 import tempfile
 from importlib.metadata import distributions
 from pathlib import Path
 from typing import Iterable
 
-from .dep_analyzer import DepAnalyzer, ExtraLine, PackageInfo
+from .dep_analyzer import DepAnalyzer, ExtraLine, InstallOptions, PackageInfo
 from .util import PathType
 
 
@@ -29,7 +30,8 @@ class PipAnalyzer(DepAnalyzer):
         ignore_packages=False,
         update_dependencies=False,
         additional_packages_to_ignore: dict | None = None,
-    ):
+        install_options: InstallOptions | None = None,
+    ):  # pylint: disable=too-many-arguments
         super().__init__(
             project_root,
             python_version,
@@ -38,6 +40,7 @@ class PipAnalyzer(DepAnalyzer):
             ignore_packages,
             update_dependencies,
             additional_packages_to_ignore,
+            install_options,
         )
         # try:
         #     import pkg_resources
@@ -46,7 +49,40 @@ class PipAnalyzer(DepAnalyzer):
         #     raise
         self.copy_to_temp_dir(("requirements.txt",))
 
+    def _resolve(self) -> list[dict] | None:
+        """Resolves requirements.txt with pip's installation report, without installing anything
+
+        Returns:
+            The ``install`` items of the report, or None if pip couldn't produce one (pip < 22.2)
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            report = Path(tmpdir) / "report.json"
+            resolved = self._install_pip(
+                "--only-binary=:all:",
+                "--dry-run",
+                "--target",
+                Path(tmpdir) / "target",
+                "--report",
+                report,
+                "-r",
+                Path(self._temp_proj_dir.name) / "requirements.txt",
+                quiet=True,
+                requirements_file=True,
+                return_state=True,
+            )
+            if not resolved or not report.exists():
+                return None
+            with report.open(encoding="utf8") as f:
+                return json.load(f)["install"]
+
     def _get_requirements(self) -> Iterable[PackageInfo | ExtraLine]:
+        installs = self._resolve()
+        if installs is not None:
+            for item in installs:
+                pkg, version = item["metadata"]["name"], item["metadata"]["version"]
+                yield PackageInfo(pkg, version, f"{pkg}=={version}")
+            return
+        self.log.info("Unable to get a pip installation report, resolving by installing")
         with tempfile.TemporaryDirectory() as tmpdir:
             self._install_pip(
                 "--only-binary=:all:",
@@ -0,0 +1,101 @@
+"""
+Pip Shards
+
+Helpers to install ``--no-deps`` requirements with several pip processes at once: the
+requirements are split into shards of about the same size, every shard is installed into its own
+directory, and the directories are merged into the target afterwards. Files that more than one
+shard installs with different contents are reported as conflicts.
+
+"""
+from __future__ import annotations
+
+import filecmp
+import logging
+import os
+from collections import namedtuple
+from pathlib import Path
+from typing import Sequence, TypeVar
+
+from .util import PathType
+
+LOG = logging.getLogger(__name__)
+
+T = TypeVar("T")
+Conflict = namedtuple("Conflict", ["path", "kept", "dropped"])
+
+
+def split_shards(
+    items: Sequence[T], shards: int, weights: Sequence[float] | None = None
+) -> list[list[T]]:
+    """Splits ``items`` into at most ``shards`` groups of about the same total weight
+
+    Uses the longest processing time first heuristic: the heaviest remaining item goes to the
+    lightest shard. Items keep their relative order within a shard.
+
+    Args:
+        items: Items to split
+        shards: Number of shards
+        weights: Weight of each item, e.g. the download size, all items weigh the same by default.
+            Items with an unknown (zero) weight count as the average weight.
+
+    Returns:
+        The non-empty shards
+    """
+    known = [w for w in weights or [] if w > 0]
+    average = sum(known) / len(known) if known else 1.0
+    weights = [w if w > 0 else average for w in weights or [0.0] * len(items)]
+    loads = [0.0] * max(1, shards)
+    assigned: list[list[int]] = [[] for _ in loads]
+    for i in sorted(range(len(items)), key=lambda i: weights[i], reverse=True):
+        lightest = min(range(len(loads)), key=loads.__getitem__)
+        loads[lightest] += weights[i]
+        assigned[lightest].append(i)
+    return [[items[i] for i in sorted(shard)] for shard in assigned if shard]
+
+
+def _merge(src: Path, dst: Path, rel: str, owner: str, owners: dict, conflicts: list) -> None:
+    if not dst.exists() and not dst.is_symlink():
+        os.replace(src, dst)
+        owners[rel] = owner
+        return
+    if src.is_dir() and not src.is_symlink() and dst.is_dir():
+        for child in sorted(os.listdir(src)):
+            _merge(src / child, dst / child, f"{rel}/{child}", owner, owners, conflicts)
+        return
+    if src.is_file() and dst.is_file() and filecmp.cmp(src, dst, shallow=False):
+        return
+    kept = next((owners[p] for p in _parents(rel) if p in owners), "?")
+    conflicts.append(Conflict(rel, kept, owner))
+
+
+def _parents(rel: str) -> list[str]:
+    parts = rel.split("/")
+    return ["/".join(parts[: i + 1]) for i in range(len(parts) - 1, -1, -1)]
+
+
+def merge_shards(shard_dirs: Sequence[PathType], target: PathType) -> list[Conflict]:
+    """Moves the contents of the shard directories into ``target``
+
+    The shard directories must be on the same filesystem as the target. Files present in more
+    than one shard with the same contents are merged; for differing ones the first shard wins.
+
+    Returns:
+        The conflicting files, with the shard directories that kept and dropped them
+    """
+    target = Path(target)
+    target.mkdir(parents=True, exist_ok=True)
+    owners: dict[str, str] = {}
+    conflicts: list[Conflict] = []
+    for shard_dir in shard_dirs:
+        shard_dir = Path(shard_dir)
+        for child in sorted(os.listdir(shard_dir)):
+            _merge(shard_dir / child, target / child, child, shard_dir.name, owners, conflicts)
+    for conflict in conflicts:
+        LOG.warning(
+            "%s is installed by both %s and %s with different contents, keeping %s",
+            conflict.path,
+            conflict.kept,
+            conflict.dropped,
+            conflict.kept,
+        )
+    return conflicts
@@ -9,7 +9,14 @@ from typing import Iterable
 
 import toml
 
-from .dep_analyzer import CommandNotFoundError, DepAnalyzer, ExtraLine, PackageInfo
+from .dep_analyzer import (
+    CommandNotFoundError,
+    DepAnalyzer,
+    ExtraLine,
+    InstallOptions,
+    PackageInfo,
+)
+from .poetry_lock import locked_requirements
 from .util import PathType, chdir_cm, chgenv_cm
 
 
@@ -29,7 +36,8 @@ class PoetryAnalyzer(DepAnalyzer):
         ignore_packages=False,
         update_dependencies=False,
         additional_packages_to_ignore: dict | None = None,
-    ):
+        install_options: InstallOptions | None = None,
+    ):  # pylint: disable=too-many-arguments
         super().__init__(
             project_root,
             python_version,
@@ -38,6 +46,7 @@ class PoetryAnalyzer(DepAnalyzer):
             ignore_packages,
             update_dependencies,
             additional_packages_to_ignore,
+            install_options,
         )
         self._poetry = shutil.which("poetry")
         if self._poetry is None:
@@ -68,6 +77,13 @@ class PoetryAnalyzer(DepAnalyzer):
 
     def _get_requirements(self) -> Iterable[PackageInfo | ExtraLine]:
         output_file = None
+        locked = locked_requirements(
+            self._temp_proj_dir.name, self.python_version, self.architecture
+        )
+        if locked is not None:
+            self.log.info("Read %s requirements from poetry.lock", len(locked))
+            yield from self.process_requirements(locked)
+            return
         if not self.locked():
             self.log.info("Locking dependencies")
             self.lock()
@@ -0,0 +1,273 @@
+"""
+Poetry Lock
+
+Reads the main group requirements straight from ``poetry.lock``, without running
+``poetry lock --check`` and ``poetry export``. The lock is only used when its ``content-hash``
+matches ``pyproject.toml``; environment markers and python constraints are evaluated for the
+Lambda target rather than for the machine running the packager. Anything this reader does not
+handle (custom sources, VCS/path/URL dependencies, ambiguous locks) makes it return None, so
+callers fall back to the Poetry CLI.
+
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import re
+from pathlib import Path
+from typing import Any
+
+import toml
+from packaging.markers import InvalidMarker, Marker
+from packaging.specifiers import InvalidSpecifier, SpecifierSet
+from packaging.utils import canonicalize_name
+from packaging.version import InvalidVersion, Version
+
+from .util import PathType
+
+LOG = logging.getLogger(__name__)
+
+SUPPORTED_LOCK_VERSIONS = ("1.", "2.")
+# the pyproject sections poetry 1.x hashes, depending on the poetry version that wrote the lock
+_CONTENT_HASH_KEYS = (
+    ("dependencies", "dev-dependencies", "group", "source", "extras"),
+    ("dependencies", "group", "source", "extras"),
+    ("dependencies", "dev-dependencies", "source", "extras"),
+)
+_MACHINES = {"x86_64": "x86_64", "arm64": "aarch64"}
+_PEP440_OPERATORS = ("===", "==", "!=", "<=", ">=", "~=", "<", ">")
+
+
+class UnsupportedLockError(Exception):
+    pass
+
+
+def content_hash(poetry_config: dict, keys=_CONTENT_HASH_KEYS[0]) -> str:
+    """Computes the ``content-hash`` poetry records in the lock for a ``[tool.poetry]`` table"""
+    relevant = {k: poetry_config.get(k) for k in keys}
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True).encode()).hexdigest()
+
+
+def lock_is_fresh(pyproject: dict, lock: dict) -> bool:
+    """Checks that the lock was generated from the current ``pyproject.toml``"""
+    poetry_config = pyproject.get("tool", {}).get("poetry", {})
+    expected = lock.get("metadata", {}).get("content-hash")
+    return any(content_hash(poetry_config, keys) == expected for keys in _CONTENT_HASH_KEYS)
+
+
+def marker_environment(python_version: str, architecture: str = "x86_64") -> dict[str, str]:
+    """The PEP 508 marker environment of a Lambda python runtime"""
+    version = ".".join(python_version.lower().lstrip("python").split(".")[:2])
+    return {
+        "implementation_name": "cpython",
+        # Lambda runtimes track the latest patch release
+        "implementation_version": f"{version}.99",
+        "os_name": "posix",
+        "platform_machine": _MACHINES.get(architecture, architecture),
+        "platform_python_implementation": "CPython",
+        "platform_release": "",
+        "platform_system": "Linux",
+        "platform_version": "",
+        "python_full_version": f"{version}.99",
+        "python_version": version,
+        "sys_platform": "linux",
+    }
+
+
+def _caret(version: str) -> str:
+    parts = [int(p) for p in re.findall(r"\d+", version)[:3]]
+    for i, part in enumerate(parts):
+        if part != 0 or i == len(parts) - 1:
+            upper = parts[:i] + [part + 1]
+            break
+    return f">={version},<{'.'.join(map(str, upper))}"
+
+
+def _tilde(version: str) -> str:
+    parts = [int(p) for p in re.findall(r"\d+", version)[:3]]
+    upper = [parts[0] + 1] if len(parts) == 1 else [parts[0], parts[1] + 1]
+    return f">={version},<{'.'.join(map(str, upper))}"
+
+
+def poetry_constraint(constraint: str) -> list[SpecifierSet]:
+    """Converts a poetry version constraint (``^1.2``, ``~1.2``, ``>=1,<2 || ^3``) to specifiers
+
+    Returns:
+        The alternatives, a version satisfies the constraint if it is in any of them
+
+    Raises:
+        UnsupportedLockError: if the constraint can't be parsed
+    """
+    alternatives = []
+    for alternative in constraint.split("||"):
+        specs = []
+        for part in re.split(r"\s*,\s*|\s+(?=[<>=!~^])", alternative.strip()):
+            part = part.replace(" ", "")
+            if part in ("", "*"):
+                continue
+            if part.startswith("^"):
+                specs.append(_caret(part[1:]))
+            elif part.startswith("~") and not part.startswith("~="):
+                specs.append(_tilde(part[1:]))
+            elif part.startswith(_PEP440_OPERATORS):
+                specs.append(part)
+            else:
+                specs.append(f"=={part}")
+        try:
+            alternatives.append(SpecifierSet(",".join(specs)))
+        except InvalidSpecifier as e:
+            raise UnsupportedLockError(f"can't parse constraint {constraint!r}") from e
+    return alternatives
+
+
+def _satisfies(version: str, constraint: str | None) -> bool:
+    if constraint is None:
+        return True
+    try:
+        parsed = Version(version)
+    except InvalidVersion as e:
+        raise UnsupportedLockError(f"can't parse version {version!r}") from e
+    return any(s.contains(parsed, prereleases=True) for s in poetry_constraint(constraint))
+
+
+def _dependency_constraints(spec: Any) -> list[dict]:
+    if isinstance(spec, str):
+        return [{"version": spec}]
+    if isinstance(spec, dict):
+        return [spec]
+    return list(spec)
+
+
+def _extra_names(extra_requirements: list[str]) -> set[str]:
+    return {
+        canonicalize_name(re.split(r"[\s(\[;<>=!~]", r.strip(), maxsplit=1)[0])
+        for r in extra_requirements
+    }
+
+
+class _LockResolver:
+    def __init__(self, lock: dict, environment: dict[str, str]):
+        self.environment = environment
+        self.packages: dict[str, list[dict]] = {}
+        for pkg in lock.get("package", []):
+            if pkg.get("source", {}).get("type"):
+                raise UnsupportedLockError(
+                    f"{pkg['name']} is installed from a {pkg['source']['type']} source"
+                )
+            self.packages.setdefault(canonicalize_name(pkg["name"]), []).append(pkg)
+        self.selected: dict[str, dict] = {}
+        self._visited: set[tuple[str, str | None]] = set()
+
+    def applies(self, constraint: dict, extra: str | None = None) -> bool:
+        if constraint.get("markers"):
+            environment = dict(self.environment, extra=extra or "")
+            try:
+                if not Marker(constraint["markers"]).evaluate(environment):
+                    return False
+            except InvalidMarker as e:
+                raise UnsupportedLockError(f"can't parse marker {constraint['markers']!r}") from e
+        if "platform" in constraint and constraint["platform"] != self.environment["sys_platform"]:
+            return False
+        return _satisfies(self.environment["python_full_version"], constraint.get("python"))
+
+    def _candidate(self, name: str, constraint: dict) -> dict:
+        python = self.environment["python_full_version"]
+        candidates = [
+            pkg
+            for pkg in self.packages.get(name, [])
+            if _satisfies(pkg["version"], constraint.get("version"))
+            and _satisfies(python, pkg.get("python-versions", "*"))
+        ]
+        if len(candidates) != 1:
+            raise UnsupportedLockError(f"{len(candidates)} locked candidates for {name}")
+        return candidates[0]
+
+    def add(self, name: str, constraint: dict) -> None:
+        pending = [(canonicalize_name(name), constraint)]
+        while pending:
+            name, constraint = pending.pop()
+            pkg = self._candidate(name, constraint)
+            if self.selected.setdefault(name, pkg) is not pkg:
+                raise UnsupportedLockError(f"conflicting locked versions of {name}")
+            extras = pkg.get("extras", {})
+            for extra in [None, *constraint.get("extras", [])]:
+                if (name, extra) in self._visited:
+                    continue
+                self._visited.add((name, extra))
+                enabled = _extra_names(extras.get(extra, [])) if extra is not None else set()
+                for dep_name, spec in pkg.get("dependencies", {}).items():
+                    dep_name = canonicalize_name(dep_name)
+                    for dep in _dependency_constraints(spec):
+                        optional = dep.get("optional", False)
+                        if optional != (extra is not None) or (
+                            optional and dep_name not in enabled
+                        ):
+                            continue
+                        if self.applies(dep, extra):
+                            pending.append((dep_name, dep))
+
+
+def read_lock(pyproject: dict, lock: dict, environment: dict[str, str]) -> list[tuple[str, str]]:
+    """Resolves the main group of a poetry project from its lock
+
+    Args:
+        pyproject: The parsed ``pyproject.toml``
+        lock: The parsed ``poetry.lock``
+        environment: Marker environment of the target, see :func:`marker_environment`
+
+    Returns:
+        (name, version) of each package to install, sorted by name
+
+    Raises:
+        UnsupportedLockError: if the lock can't be resolved without poetry
+    """
+    lock_version = str(lock.get("metadata", {}).get("lock-version", ""))
+    if not lock_version.startswith(SUPPORTED_LOCK_VERSIONS):
+        raise UnsupportedLockError(f"unsupported lock version {lock_version!r}")
+    poetry_config = pyproject.get("tool", {}).get("poetry", {})
+    if poetry_config.get("source"):
+        raise UnsupportedLockError("custom package sources are configured")
+    resolver = _LockResolver(lock, environment)
+    for name, spec in poetry_config.get("dependencies", {}).items():
+        if name == "python":
+            continue
+        for constraint in _dependency_constraints(spec):
+            if constraint.get("optional") or not resolver.applies(constraint):
+                continue
+            if any(k in constraint for k in ("git", "path", "url")):
+                raise UnsupportedLockError(f"{name} is not installed from an index")
+            resolver.add(name, constraint)
+    return sorted((pkg["name"], pkg["version"]) for pkg in resolver.selected.values())
+
+
+def locked_requirements(
+    project_dir: PathType, python_version: str, architecture: str = "x86_64"
+) -> list[str] | None:
+    """Reads pinned requirements for the main group from a project's ``poetry.lock``
+
+    Args:
+        project_dir: Directory with ``pyproject.toml`` and ``poetry.lock``
+        python_version: Target python version
+        architecture: Target architecture
+
+    Returns:
+        ``name==version`` lines, or None if poetry has to be used (no lock, a stale lock, or a lock
+        this reader does not support)
+    """
+    project_dir = Path(project_dir)
+    lock_path = project_dir / "poetry.lock"
+    if not lock_path.is_file():
+        LOG.debug("No poetry.lock in %s", project_dir)
+        return None
+    pyproject = toml.load(project_dir / "pyproject.toml")
+    lock = toml.load(lock_path)
+    if not lock_is_fresh(pyproject, lock):
+        LOG.debug("poetry.lock does not match pyproject.toml")
+        return None
+    try:
+        resolved = read_lock(pyproject, lock, marker_environment(python_version, architecture))
+    except UnsupportedLockError as e:
+        LOG.debug("Unable to read poetry.lock directly: %s", e)
+        return None
+    return [f"{name}=={version}" for name, version in resolved]
@@ -0,0 +1,394 @@
+"""
+Slim Package Providers
+
+Providers supply smaller drop-in builds of packages for the Lambda environment (e.g. numpy or
+pyarrow built without the parts a Lambda function does not need). After the dependencies are
+installed, every requirement is offered to the providers in turn, and the files the first
+provider that has a build of it supplies replace the installed ones.
+
+A provider returns a directory laid out like ``site-packages`` for a (package, version, python
+version, architecture), or None. Providers are passed to :class:`LambdaPackager` or registered
+for the whole process with :func:`register_provider`; :func:`provider_from_spec` creates the
+built-in ones from strings like ``dir:/path/to/builds``.
+
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from contextlib import contextmanager
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Generator
+from urllib.parse import urlsplit
+from urllib.request import url2pathname
+
+from packaging.utils import canonicalize_name
+
+from . import arrow_fetcher
+from .arrow_fetcher import cached_tree, normalize_arch, place_tree
+from .metadata_client import get_client
+from .pip_shards import merge_shards
+from .util import PathType, get_cache_dir
+
+LOG = logging.getLogger(__name__)
+
+GITHUB_RELEASE_URL = "https://api.github.com/repos/{repo}/releases/tags/{tag}"
+RELEASES_CACHE_TTL = 24 * 60 * 60  # 1 day
+# the name of a build, for directories and release assets
+DEFAULT_BUILD_NAME = "{name}-{version}-py{python_version}-{arch}"
+
+Replacement = namedtuple(
+    "Replacement", ["name", "version", "provider", "size_before", "size_after", "removed", "added"]
+)
+
+
+class SlimPackageProvider(ABC):
+    """Supplies smaller drop-in builds of packages
+
+    ``spec`` describes the provider, it is part of the build cache key.
+    """
+
+    spec = "provider"
+
+    @abstractmethod
+    def get_tree(
+        self, name: str, version: str, python_version: str, architecture: str
+    ) -> Path | None:
+        """Gets the build of a package
+
+        Args:
+            name: Package name
+            version: Installed version of the package
+            python_version: Target python version, e.g. ``3.9``
+            architecture: Target architecture, ``x86_64`` or ``aarch64``
+
+        Returns:
+            A directory laid out like ``site-packages`` with the files of the build, which must
+            not be modified, or None if the provider has no build of the package
+        """
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.spec!r})"
+
+
+def _format(template: str, name: str, version: str, python_version: str, architecture: str):
+    return template.format(
+        name=name, version=version, python_version=python_version, arch=architecture
+    )
+
+
+class LocalDirectoryProvider(SlimPackageProvider):
+    """Builds in subdirectories of a local directory
+
+    Args:
+        root: Directory with the builds
+        layout: Path of a build below ``root``, formatted with ``name``, ``version``,
+            ``python_version`` and ``arch``
+    """
+
+    def __init__(self, root: PathType, layout: str = DEFAULT_BUILD_NAME):
+        self.root = Path(root)
+        self.layout = layout
+        self.spec = f"dir:{self.root}"
+
+    def get_tree(self, name, version, python_version, architecture):
+        for candidate in dict.fromkeys((name, canonicalize_name(name))):
+            tree = self.root / _format(
+                self.layout, candidate, version, python_version, architecture
+            )
+            if tree.is_dir():
+                return tree
+        return None
+
+
+@contextmanager
+def open_tarball(url: str) -> Generator[tarfile.TarFile, None, None]:
+    """Opens a local or remote tarball as a stream"""
+    parts = urlsplit(url)
+    if parts.scheme in ("http", "https"):
+        with arrow_fetcher.open_zip_file(url) as tar:
+            yield tar
+        return
+    path = url2pathname(parts.path) if parts.scheme == "file" else url
+    with tarfile.open(path, "r|*") as tar:
+        yield tar
+
+
+class _TarballProvider(SlimPackageProvider):
+    prefix = "python/"
+
+    def _cache_entry(self, name, version, python_version, architecture) -> Path:
+        provider_id = hashlib.sha256(self.spec.encode()).hexdigest()[:16]
+        build = _format(DEFAULT_BUILD_NAME, name, version, python_version, architecture)
+        return get_cache_dir("slim", provider_id, build)
+
+    @abstractmethod
+    def resolve_url(self, name, version, python_version, architecture) -> str | None:
+        """The URL of the tarball with the build of a package, or None if there is none"""
+
+    def get_tree(self, name, version, python_version, architecture):
+        entry = self._cache_entry(canonicalize_name(name), version, python_version, architecture)
+        try:
+            return cached_tree(
+                entry,
+                lambda: self.resolve_url(name, version, python_version, architecture),
+                prefix=self.prefix,
+                opener=open_tarball,
+            )
+        except FileNotFoundError:
+            LOG.debug("%s has no build of %s %s", self, name, version)
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+
+
+class TarballUrlProvider(_TarballProvider):
+    """Builds in tarballs at a URL
+
+    Extracted builds are kept in the lambda-packager cache.
+
+    Args:
+        url: URL (or local path) of a build, formatted with ``name``, ``version``,
+            ``python_version`` and ``arch``
+        prefix: Directory in the tarball that is laid out like ``site-packages``, ``python/`` as
+            in a Lambda layer by default, ``""`` for the root of the tarball
+    """
+
+    def __init__(self, url: str, prefix: str = "python/"):
+        self.url = url
+        self.prefix = prefix
+        self.spec = f"url:{url}"
+
+    def resolve_url(self, name, version, python_version, architecture):
+        return _format(self.url, name, version, python_version, architecture)
+
+
+class GitHubReleaseProvider(_TarballProvider):
+    """Builds attached to the releases of a GitHub repository
+
+    Extracted builds are kept in the lambda-packager cache.
+
+    Args:
+        repo: Repository, ``owner/name``
+        tag: Release tag of a build
+        asset: Glob matching the release asset of a build
+        packages: Packages the repository has builds of, all by default
+        prefix: Directory in the tarball that is laid out like ``site-packages``
+
+    ``tag`` and ``asset`` are formatted with ``name``, ``version``, ``python_version`` and
+    ``arch``.
+    """
+
+    def __init__(
+        self,
+        repo: str,
+        tag: str = "{name}-{version}",
+        asset: str = DEFAULT_BUILD_NAME + ".tar.gz",
+        packages: list[str] | None = None,
+        prefix: str = "python/",
+    ):
+        self.repo = repo
+        self.tag = tag
+        self.asset = asset
+        self.packages = {canonicalize_name(p) for p in packages} if packages else None
+        self.prefix = prefix
+        self.spec = f"github:{repo}"
+
+    def get_tree(self, name, version, python_version, architecture):
+        if self.packages is not None and canonicalize_name(name) not in self.packages:
+            return None
+        return super().get_tree(name, version, python_version, architecture)
+
+    def resolve_url(self, name, version, python_version, architecture):
+        tag = _format(self.tag, name, version, python_version, architecture)
+        r = get_client().get(
+            GITHUB_RELEASE_URL.format(repo=self.repo, tag=tag), ttl=RELEASES_CACHE_TTL
+        )
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        asset = _format(self.asset, name, version, python_version, architecture)
+        for a in r.json()["assets"]:
+            if fnmatch(a["name"], asset):
+                return a["browser_download_url"]
+        return None
+
+
+_PROVIDERS: list[SlimPackageProvider] = []
+
+
+def register_provider(provider: SlimPackageProvider) -> None:
+    """Registers a provider for every packager in the process"""
+    _PROVIDERS.append(provider)
+
+
+def registered_providers() -> list[SlimPackageProvider]:
+    return list(_PROVIDERS)
+
+
+def provider_from_spec(spec: str) -> SlimPackageProvider:
+    """Creates a built-in provider from its description
+
+    Args:
+        spec: ``dir:PATH`` for a :class:`LocalDirectoryProvider`, ``url:URL`` for a
+            :class:`TarballUrlProvider` or ``github:OWNER/REPO`` for a
+            :class:`GitHubReleaseProvider`
+
+    Raises:
+        ValueError: for an unknown kind of provider
+    """
+    kind, _, arg = spec.partition(":")
+    if kind == "dir" and arg:
+        return LocalDirectoryProvider(arg)
+    if kind == "url" and arg:
+        return TarballUrlProvider(arg)
+    if kind == "github" and arg:
+        return GitHubReleaseProvider(arg)
+    raise ValueError(f"Invalid provider {spec!r}, expected dir:PATH, url:URL or github:OWNER/REPO")
+
+
+def _dist_info(output_dir: Path, name: str) -> Path | None:
+    canonical = canonicalize_name(name)
+    for dist_info in output_dir.glob("*.dist-info"):
+        if canonicalize_name(dist_info.name.split("-")[0]) == canonical:
+            return dist_info
+    return None
+
+
+def installed_files(output_dir: PathType, name: str) -> list[str] | None:
+    """Lists the files of an installed package from the ``RECORD`` of its ``.dist-info``
+
+    Returns:
+        The paths relative to ``output_dir``, or None if the package is not installed
+    """
+    output_dir = Path(output_dir)
+    dist_info = _dist_info(output_dir, name)
+    if dist_info is None or not (dist_info / "RECORD").is_file():
+        return None
+    files = []
+    with open(dist_info / "RECORD", encoding="utf8") as fh:
+        for line in fh:
+            path = line.rsplit(",", 2)[0].strip()
+            # scripts and data files are installed outside of the package directory
+            if path and not path.startswith("../") and not os.path.isabs(path):
+                files.append(os.path.normpath(path))
+    return files
+
+
+def _remove_files(output_dir: Path, rel_paths: list[str]) -> dict[str, int]:
+    removed = {}
+    parents: set[Path] = set()
+    for rel_path in rel_paths:
+        path = output_dir / rel_path
+        if path.is_file() or path.is_symlink():
+            removed[rel_path] = path.lstat().st_size
+            path.unlink()
+        parents.update(Path(rel_path).parents)
+    # deepest first, so emptied parents are removed as well
+    for parent in sorted(parents, key=lambda p: len(p.parts), reverse=True):
+        if parent.parts and (output_dir / parent).is_dir():
+            try:
+                (output_dir / parent).rmdir()
+            except OSError:
+                pass
+    return removed
+
+
+def _tree_size(tree: Path) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(tree):
+        for f in filenames:
+            total += os.lstat(os.path.join(dirpath, f)).st_size
+    return total
+
+
+def replace_package(
+    output_dir: PathType, name: str, tree: PathType
+) -> tuple[dict[str, int], list[str]]:
+    """Replaces the installed files of a package with another build of it
+
+    The files listed in the ``RECORD`` of the installed package are removed, its ``.dist-info``
+    only if the build brings its own, and the files of the build are hard linked in.
+
+    Args:
+        output_dir: Package directory
+        name: Package name
+        tree: Directory laid out like ``site-packages`` with the files of the build
+
+    Returns:
+        The size of each removed file and the top level files and directories of the build,
+        relative to ``output_dir``
+
+    Raises:
+        ValueError: if the package is not installed with a ``RECORD``
+    """
+    output_dir = Path(output_dir)
+    tree = Path(tree)
+    files = installed_files(output_dir, name)
+    if files is None:
+        raise ValueError(f"{name} is not installed in {output_dir}")
+    if not any(tree.glob("*.dist-info")):
+        dist_info = _dist_info(output_dir, name).name  # type: ignore[union-attr]
+        files = [f for f in files if Path(f).parts[0] != dist_info]
+    staging = Path(tempfile.mkdtemp(prefix=f".{canonicalize_name(name)}-", dir=output_dir))
+    try:
+        place_tree(tree, staging)
+        added = sorted(os.listdir(staging))
+        removed = _remove_files(output_dir, files)
+        merge_shards([staging], output_dir)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return removed, added
+
+
+def apply_providers(
+    output_dir: PathType,
+    requirements: dict[str, str],
+    providers: list[SlimPackageProvider],
+    python_version: str,
+    architecture: str,
+) -> list[Replacement]:
+    """Replaces installed packages with the builds supplied by the providers
+
+    Args:
+        output_dir: Package directory
+        requirements: Version of each installed package, by name
+        providers: Providers to ask for builds, the first one with a build of a package wins
+        python_version: Target python version
+        architecture: Target architecture
+
+    Returns:
+        A Replacement for every replaced package
+    """
+    output_dir = Path(output_dir)
+    python_version = python_version.lstrip("python")
+    architecture = normalize_arch(architecture)
+    replacements = []
+    for name, version in sorted(requirements.items()):
+        if installed_files(output_dir, name) is None:
+            continue
+        for provider in providers:
+            tree = provider.get_tree(name, version, python_version, architecture)
+            if tree is None:
+                continue
+            removed, added = replace_package(output_dir, name, tree)
+            LOG.debug("Replaced %s %s with the build from %s", name, version, provider.spec)
+            replacements.append(
+                Replacement(
+                    name,
+                    version,
+                    provider,
+                    sum(removed.values()),
+                    _tree_size(tree),
+                    sorted(removed),
+                    added,
+                )
+            )
+            break
+    return replacements
@@ -0,0 +1,130 @@
+"""
+Requirements Cache
+
+Keeps the resolved requirements of a project (the exported packages and the extra pip lines) in
+the user cache directory, keyed on the dependency files, the target and the list of ignored
+packages, so an unchanged project is not resolved again. Entries expire after ``max_age``, as
+unpinned requirements may resolve to newer versions over time.
+
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+from . import __version__
+from .build_cache import DEPENDENCY_FILES
+from .util import PathType, get_cache_dir
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_MAX_AGE = 86400  # 1 day
+
+
+class RequirementsCache:
+    """Resolved requirements, stored as JSON in the user cache directory
+
+    Args:
+        cache_dir: Cache directory, defaults to ``requirements`` in the lambda-packager cache
+        max_age: Entries older than this many seconds are not used
+    """
+
+    def __init__(self, cache_dir: PathType | None = None, max_age: float = DEFAULT_MAX_AGE):
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else get_cache_dir("requirements")
+        self.max_age = max_age
+
+    @staticmethod
+    def key(
+        analyzer_name: str,
+        project_root: PathType,
+        python_version: str,
+        architecture: str,
+        ignored: dict[str, str],
+    ) -> str:
+        """Computes the cache key of a project's requirements
+
+        Args:
+            analyzer_name: Name of the analyzer resolving the requirements
+            project_root: Directory with the dependency files
+            python_version: Target python version
+            architecture: Target architecture
+            ignored: Packages ignored because they are in the Lambda environment
+
+        Returns:
+            A hex digest identifying the resolution inputs
+        """
+        digest = hashlib.sha256()
+        meta = {
+            "packager_version": __version__,
+            "analyzer": analyzer_name,
+            "python_version": python_version,
+            "architecture": architecture,
+            "ignored": ignored,
+        }
+        digest.update(json.dumps(meta, sort_keys=True).encode())
+        for name in DEPENDENCY_FILES:
+            path = Path(project_root) / name
+            if path.is_file():
+                digest.update(name.encode() + b"\0" + path.read_bytes() + b"\0")
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def load(self, key: str) -> tuple[list[list[str]], list[list[str]]] | None:
+        """Loads cached requirements
+
+        Returns:
+            The (name, version, spec) of each requirement and the extra pip lines, or None if
+            there is no entry or it expired
+        """
+        path = self._path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self.max_age:
+                return None
+            with path.open(encoding="utf8") as fh:
+                data = json.load(fh)
+        except (OSError, ValueError) as e:
+            LOG.debug("No cached requirements for %s: %s", key, e)
+            return None
+        return data["requirements"], data["extra_lines"]
+
+    def store(self, key: str, requirements: list, extra_lines: list) -> None:
+        """Stores resolved requirements, see :meth:`load`"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        data = {
+            "requirements": [list(r) for r in requirements],
+            "extra_lines": [list(e) for e in extra_lines],
+        }
+        try:
+            # extra lines may carry index credentials
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with open(fd, "w", encoding="utf8") as fh:
+                json.dump(data, fh)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            LOG.warning("Unable to cache requirements: %s", e)
+            if tmp_path.exists():
+                tmp_path.unlink()
+            return
+        self.prune()
+
+    def prune(self) -> int:
+        """Removes expired entries
+
+        Returns:
+            The number of removed entries
+        """
+        cutoff = time.time() - self.max_age
+        removed = 0
+        for path in self.cache_dir.glob("*.json"):
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        return removed
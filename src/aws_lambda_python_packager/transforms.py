@@ -0,0 +1,291 @@
+"""
+Transforms
+
+The post-install size optimizations, as :class:`~.file_index.Transform` objects that can all be
+applied in a single pass over a :class:`~.file_index.FileIndex`.
+
+"""
+from __future__ import annotations
+
+import gzip
+import json
+import logging
+import os
+import shutil
+import subprocess  # nosec B404
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from fnmatch import fnmatch
+from functools import partial
+
+from .elf import NotAnElfFile, has_strippable_sections, strip_elf
+from .file_index import FileEntry, FileIndex, Transform, unshare
+
+LOG = logging.getLogger(__name__)
+OTHER_FILE_EXTENSIONS = (".pyx", ".pyi", ".pxi", ".pxd", ".c", ".h", ".cc")
+DEFAULT_UTIME = int(datetime(2020, 1, 1, 1, 1).timestamp()) * int(1e9)
+
+
+class StripPython(Transform):
+    name = "strip_python"
+
+    def matches(self, entry: FileEntry) -> bool:
+        return entry.name.endswith(".py")
+
+    def apply(self, entry: FileEntry, index: FileIndex) -> None:
+        LOG.debug("Stripping python file %s", entry.path)
+        index.remove(entry)
+
+
+class StripTests(Transform):
+    name = "strip_tests"
+
+    def matches(self, entry: FileEntry) -> bool:
+        return "tests" in entry.parts
+
+    def apply(self, entry: FileEntry, index: FileIndex) -> None:
+        LOG.debug("Stripping test file %s", entry.path)
+        index.remove(entry)
+
+
+class StripOtherFiles(Transform):
+    name = "strip_other_files"
+
+    def matches(self, entry: FileEntry) -> bool:
+        return entry.suffix in OTHER_FILE_EXTENSIONS
+
+    def apply(self, entry: FileEntry, index: FileIndex) -> None:
+        LOG.debug("Stripping file %s", entry.path)
+        index.remove(entry)
+
+
+class CompressBoto(Transform):
+    """(Re)compresses the botocore and boto3 json data files (``**/boto[3c]*/data/**/*.json*``)"""
+
+    name = "compress_boto"
+
+    def matches(self, entry: FileEntry) -> bool:
+        if not fnmatch(entry.name, "*.json*"):
+            return False
+        parts = entry.parts
+        return any(
+            parts[i + 1] == "data" and fnmatch(parts[i], "boto[3c]*") for i in range(len(parts) - 2)
+        )
+
+    def apply(self, entry: FileEntry, index: FileIndex) -> FileEntry | None:
+        if entry.name.endswith(".json.gz"):
+            _open = gzip.open
+            new_rel_path = entry.rel_path
+            delete = False
+        else:
+            _open = open  # type: ignore[assignment]
+            new_rel_path = os.path.splitext(entry.rel_path)[0] + ".json.gz"
+            delete = True
+        try:
+            with _open(entry.path, "rt") as fh:
+                # load and dump to decrease unnecessary whitespace
+                json_data = json.load(fh)
+            if not delete:
+                # rewritten in place, which must not write through a hard link
+                unshare(entry.path)
+            # set mtime to 0 to make builds repeatable
+            with gzip.GzipFile(index.root / new_rel_path, "wb", compresslevel=9, mtime=0) as zfh:
+                zfh.write(json.dumps(json_data, separators=(",", ":")).encode("utf8"))
+        except json.decoder.JSONDecodeError:
+            return entry
+        if delete:
+            index.remove(entry)
+        return index.add(new_rel_path)
+
+
+class StripResult:
+    STRIPPED = "stripped"
+    FAILED = "failed"
+    SYMLINK = "skipped (symlink)"
+    NOT_ELF = "skipped (not an ELF file)"
+    UNSUPPORTED = "skipped (unsupported ELF file)"
+    NOTHING_TO_STRIP = "skipped (no symbols or debugging info)"
+
+
+STRIP_METHODS = ("auto", "binutils", "python")
+
+
+def _python_strip_batch(paths: list[tuple[str, str]]) -> dict[str, str]:
+    results = {}
+    for rel_path, path in paths:
+        try:
+            results[rel_path] = (
+                StripResult.STRIPPED if strip_elf(path) else StripResult.NOTHING_TO_STRIP
+            )
+        except NotAnElfFile:
+            results[rel_path] = StripResult.UNSUPPORTED
+        except Exception as e:  # pylint: disable=broad-except
+            LOG.debug("Stripping %s failed: %s", path, e)
+            results[rel_path] = StripResult.FAILED
+    return results
+
+
+class StripLibraries(Transform):
+    """Strips debugging symbols from shared libraries (``*.so*``)
+
+    Matching files are queued during the dispatch loop. Symlinks, non-ELF files and libraries
+    without a symbol table or debugging sections are skipped, and the rest is split into one
+    batch per worker. With the ``binutils`` method every batch is a single ``strip`` invocation
+    run from a thread pool, with the ``python`` method batches are handed to
+    :func:`~.elf.strip_elf` in a process pool. ``auto`` uses binutils if a ``strip`` binary for
+    the architecture is available. The outcome for each file ends up in :attr:`results`.
+    """
+
+    name = "strip_libraries"
+
+    def __init__(
+        self, architecture: str = "x86_64", workers: int | None = None, method: str = "auto"
+    ):
+        if method not in STRIP_METHODS:
+            raise ValueError(f"Unknown strip method {method}")
+        self.architecture = architecture
+        self.workers = workers or os.cpu_count() or 1
+        self.method = method
+        self.results: dict[str, str] = {}
+        self._queue: list[FileEntry] = []
+
+    def matches(self, entry: FileEntry) -> bool:
+        return ".so" in entry.name
+
+    def apply(self, entry: FileEntry, index: FileIndex) -> FileEntry | None:
+        self._queue.append(entry)
+        return entry
+
+    def _classify(self, entry: FileEntry) -> str | None:
+        if entry.is_symlink:
+            return StripResult.SYMLINK
+        try:
+            if not has_strippable_sections(entry.path):
+                return StripResult.NOTHING_TO_STRIP
+        except (NotAnElfFile, OSError):
+            return StripResult.NOT_ELF
+        return None
+
+    def _batches(self, entries: list[FileEntry]) -> list[list[FileEntry]]:
+        # largest first onto the least loaded batch, one batch per worker
+        batches: list[list[FileEntry]] = [[] for _ in range(min(self.workers, len(entries)))]
+        loads = [0] * len(batches)
+        for entry in sorted(entries, key=lambda e: e.size, reverse=True):
+            i = loads.index(min(loads))
+            batches[i].append(entry)
+            loads[i] += entry.size
+        return batches
+
+    @staticmethod
+    def _run_strip(strip_command: str, entries: list[FileEntry]) -> dict[str, str]:
+        # binutils strip rewrites hard linked files in place
+        for e in entries:
+            unshare(e.path)
+        proc = subprocess.run(  # nosec: B603 pylint: disable=subprocess-run-check
+            [strip_command, "-p", *(e.path for e in entries)], capture_output=True
+        )
+        if proc.returncode == 0:
+            return {e.rel_path: StripResult.STRIPPED for e in entries}
+        if len(entries) == 1:
+            LOG.debug("strip failed on %s: %s", entries[0].path, proc.stderr.decode().strip())
+            return {entries[0].rel_path: StripResult.FAILED}
+        # find out which files were the problem
+        results: dict[str, str] = {}
+        for entry in entries:
+            results.update(StripLibraries._run_strip(strip_command, [entry]))
+        return results
+
+    def _strip_binutils(self, batches: list[list[FileEntry]]):
+        strip_command = get_strip_binary(self.architecture)
+        with ThreadPoolExecutor(len(batches)) as pool:
+            for result in pool.map(partial(self._run_strip, strip_command), batches):
+                self.results.update(result)
+
+    def _strip_python(self, batches: list[list[FileEntry]]):
+        path_batches = [[(e.rel_path, e.path) for e in batch] for batch in batches]
+        if len(path_batches) == 1:
+            self.results.update(_python_strip_batch(path_batches[0]))
+            return
+        with ProcessPoolExecutor(len(path_batches)) as pool:
+            for result in pool.map(_python_strip_batch, path_batches):
+                self.results.update(result)
+
+    def finish(self, index: FileIndex) -> None:
+        queue, self._queue = self._queue, []
+        to_strip = []
+        for entry in queue:
+            skipped = self._classify(entry)
+            if skipped is None:
+                to_strip.append(entry)
+            else:
+                self.results[entry.rel_path] = skipped
+        method = self.method
+        if method == "auto":
+            method = "binutils" if find_strip_binary(self.architecture) else "python"
+        # noinspection PyBroadException
+        try:
+            if to_strip:
+                LOG.debug("Stripping %s libraries using %s", len(to_strip), method)
+                if method == "binutils":
+                    self._strip_binutils(self._batches(to_strip))
+                else:
+                    self._strip_python(self._batches(to_strip))
+        except Exception:  # pylint: disable=broad-except
+            if method == "binutils":
+                LOG.error("Failed to strip libraries, perhaps we don't have the 'strip' command?")
+            else:
+                LOG.error("Failed to strip libraries", exc_info=True)
+        finally:
+            # batches that finished before a failure changed their files as well
+            for entry in to_strip:
+                index.refresh(entry)
+        self._report()
+
+    def _report(self) -> None:
+        for rel_path, result in sorted(self.results.items()):
+            LOG.log(
+                logging.WARNING if result == StripResult.FAILED else logging.DEBUG,
+                'Strip library "%s": %s',
+                rel_path,
+                result,
+            )
+        counts = Counter(self.results.values())
+        LOG.info("Stripped libraries: %s", ", ".join(f"{v} {k}" for k, v in counts.items()))
+
+
+class SetUtime(Transform):
+    """Sets a fixed modification time on every file, so builds are repeatable"""
+
+    name = "set_utime"
+
+    def __init__(self, set_time: int | None = None):
+        self.set_time = DEFAULT_UTIME if set_time is None else set_time
+
+    def apply(self, entry: FileEntry, index: FileIndex) -> FileEntry | None:
+        # files hard linked from a store usually have the right time already
+        if entry.mtime_ns != self.set_time:
+            os.utime(entry.path, ns=(self.set_time, self.set_time))
+            entry.mtime_ns = self.set_time
+        return entry
+
+
+def find_strip_binary(architecture="x86_64") -> str | None:
+    if architecture == "x86_64":
+        return shutil.which("x86_64-linux-gnu-strip") or shutil.which("strip")
+    if architecture == "arm64":
+        return shutil.which("aarch64-linux-gnu-strip")
+    raise ValueError(f"Unknown architecture {architecture}")
+
+
+def get_strip_binary(architecture="x86_64"):
+    c = find_strip_binary(architecture)
+    if c is None:
+        arch = "aarch64" if architecture == "arm64" else "x86_64"
+        LOG.error(
+            'Could not find "strip" binary for architecture "%s", perhaps install it with "apt-get install binutils-%s-linux-gnu"?',
+            architecture,
+            arch,
+        )
+        raise FileNotFoundError(f"Could not find strip binary for {architecture}")
+    return c
@@ -1,15 +1,23 @@
 from __future__ import annotations
 
+import errno
+import json
 import logging
 import os
 import re
+import shutil
 import sys
+import time
 from contextlib import contextmanager
-from os import PathLike
-from typing import Union
+from functools import lru_cache
+from pathlib import Path
+from zipfile import ZIP_DEFLATED, ZipFile
 
 import requests
 
+from .metadata_client import get_client
+from .paths import CACHE_DIR_ENV, PathType, get_cache_dir
+
 LOG = logging.getLogger(__name__)
 
 _lambda_runtime_regex = re.compile(
@@ -21,20 +29,39 @@ GLUE_LIBRARIES_DOCS_URL = "https://raw.githubusercontent.com/awsdocs/aws-glue-de
 
 PACKAGE_URL = "https://raw.githubusercontent.com/mumblepins/aws-get-lambda-python-pkg-versions/main/{region}-{python_version}-{architecture}.json"
 
-PathType = Union[str, PathLike]
+RUNTIME_CACHE_TTL = 24 * 60 * 60  # 1 day
+GLUE_CACHE_TTL = 7 * 24 * 60 * 60  # 1 week
+_RUNTIMES_SNAPSHOT = Path(__file__).parent / "lambda_runtimes.json"
 
 
 class ArchitectureUnsupported(Exception):
     """Exception raised when the architecture is not supported"""
 
 
-def get_lambda_runtimes():
-    """Gets a list of supported Lambda runtimes from the AWS docs
+def _read_runtimes(path: Path, max_age: float | None = None) -> list[tuple[str, str]] | None:
+    try:
+        if max_age is not None and time.time() - path.stat().st_mtime > max_age:
+            return None
+        with path.open(encoding="utf8") as fh:
+            runtimes = [
+                (runtime, arch)
+                for runtime, arch in json.load(fh)
+                if isinstance(runtime, str) and isinstance(arch, str)
+            ]
+    except (OSError, ValueError, TypeError) as e:
+        LOG.debug("Unable to read runtimes from %s: %s", path, e)
+        return None
+    return runtimes or None
+
+
+def fetch_lambda_runtimes():
+    """Fetches the list of supported Lambda runtimes from the AWS docs
 
     Returns:
+        A list of (runtime, architecture) tuples
 
     """
-    r = requests.get(LAMBDA_RUNTIME_DOCS_URL, timeout=10)
+    r = get_client().get(LAMBDA_RUNTIME_DOCS_URL, ttl=RUNTIME_CACHE_TTL)
     r.raise_for_status()
     runtimes = []
     for line in r.text.splitlines():
@@ -48,9 +75,46 @@ def get_lambda_runtimes():
     return runtimes
 
 
+def get_lambda_runtimes(refresh: bool = False) -> list[tuple[str, str]]:
+    """Gets a list of supported Lambda runtimes
+
+    The on-disk cache is used while it is younger than ``RUNTIME_CACHE_TTL``, otherwise the AWS
+    docs are fetched. If that fails, a stale cache or the snapshot bundled with the package is used.
+
+    Args:
+        refresh: Ignore the on-disk cache and always try to fetch the AWS docs
+
+    Returns:
+        A list of (runtime, architecture) tuples
+
+    """
+    cache_file = get_cache_dir() / "lambda-runtimes.json"
+    if not refresh and (runtimes := _read_runtimes(cache_file, RUNTIME_CACHE_TTL)):
+        return runtimes
+    try:
+        runtimes = fetch_lambda_runtimes()
+        if not runtimes:
+            raise ValueError("no runtimes found in the AWS docs")
+    except (requests.RequestException, ValueError) as e:
+        LOG.warning("Unable to fetch Lambda runtimes (%s), using cached copy", e)
+        return _read_runtimes(cache_file) or _read_runtimes(_RUNTIMES_SNAPSHOT) or []
+    try:
+        with cache_file.open("w", encoding="utf8") as fh:
+            json.dump(runtimes, fh)
+    except OSError as e:  # pragma: no cover
+        LOG.debug("Unable to write runtime cache %s: %s", cache_file, e)
+    return runtimes
+
+
+@lru_cache(maxsize=None)
+def get_platforms() -> tuple[tuple[str, str], ...]:
+    """Gets the supported Lambda (runtime, architecture) pairs, loaded on first use"""
+    return tuple(get_lambda_runtimes())
+
+
 def get_glue_libraries():
     """Gets libraries included in AWS Glue"""
-    r = requests.get(GLUE_LIBRARIES_DOCS_URL, timeout=10)
+    r = get_client().get(GLUE_LIBRARIES_DOCS_URL, ttl=GLUE_CACHE_TTL)
     r.raise_for_status()
     section = 0
     glue_libraries = {}
@@ -83,7 +147,7 @@ def check_architecture(architecture):
     architecture = architecture.lower().strip()
     if architecture == "aarch64":
         architecture = "arm64"
-    for _, arch in PLATFORMS:
+    for _, arch in get_platforms():
         if arch == architecture:
             return architecture
     raise ArchitectureUnsupported(f"{architecture} not supported")  # pragma: no cover
@@ -110,7 +174,7 @@ def get_python_runtime(architecture="x86_64", target_version=None):
 
     filtered_platforms = filter(
         lambda x: x[1] == architecture,
-        [(tuple(int(v) for v in pv.strip("python").split(".")), ar) for pv, ar in PLATFORMS],
+        [(tuple(int(v) for v in pv.strip("python").split(".")), ar) for pv, ar in get_platforms()],
     )
     allowed_py_version = [a for a, _ in filtered_platforms]
     py_version_constrained = max(min(py_version, max(allowed_py_version)), min(allowed_py_version))
@@ -143,13 +207,75 @@ def chgenv_cm(**kwargs):
         os.environ.update(old_env)
 
 
-PLATFORMS = get_lambda_runtimes()
+def link_or_copy(src: PathType, dst: PathType) -> bool:
+    """Hard links ``src`` to ``dst``, copying it if linking is not possible
+
+    An existing ``dst`` is replaced. Usable as ``copy_function`` for :func:`shutil.copytree`.
+
+    Returns:
+        True if the file was linked, False if it was copied
+    """
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    try:
+        os.link(src, dst, follow_symlinks=False)
+        return True
+    except OSError:
+        shutil.copy2(src, dst, follow_symlinks=False)
+        return False
+
+
+def move_tree(src: PathType, dst: PathType) -> str:
+    """Moves the directory ``src`` to ``dst``, which must not exist yet
+
+    The directory is renamed when both are on the same filesystem, otherwise its files are hard
+    linked or, across devices, copied and ``src`` is left in place.
+
+    Returns:
+        How the tree got there: ``"rename"``, ``"hardlink"`` or ``"copy"``
+    """
+    try:
+        os.rename(src, dst)
+        return "rename"
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.ENOTEMPTY, errno.EEXIST):
+            raise
+    copied = []
+
+    def _copy(s, d):
+        if not link_or_copy(s, d):
+            copied.append(d)
+
+    shutil.copytree(src, dst, symlinks=True, copy_function=_copy)
+    return "copy" if copied else "hardlink"
+
+
+def zip_directory(src: PathType, zip_path: PathType) -> None:
+    """Zips the files below ``src``, with paths relative to it"""
+    with ZipFile(zip_path, "w", compression=ZIP_DEFLATED, compresslevel=9) as zip_file:
+        for f in Path(src).glob("**/*"):
+            if f.is_file():
+                zip_file.write(f, f.relative_to(src))
+
+
+def __getattr__(name):
+    # PLATFORMS used to be computed at import time, keep it around but only load it when used
+    if name == "PLATFORMS":
+        return get_platforms()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 __all__ = [
+    "CACHE_DIR_ENV",
     "PathType",
-    "PLATFORMS",
     "chdir_cm",
     "chgenv_cm",
+    "get_cache_dir",
     "get_glue_libraries",
+    "get_lambda_runtimes",
+    "get_platforms",
     "get_python_runtime",
+    "link_or_copy",
+    "move_tree",
+    "zip_directory",
 ]
@@ -0,0 +1,270 @@
+"""
+Wheel Downloader
+
+Downloads the wheels of pinned requirements for a target python version and platform straight
+from a PEP 503 (HTML) or PEP 691 (JSON) simple index. Index pages and wheels are fetched
+concurrently over one connection pool, with retries, and every wheel is checked against the
+hash published by the index. Requirements without a matching wheel are left for pip.
+
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+from collections import namedtuple
+from html.parser import HTMLParser
+from pathlib import Path
+from urllib.parse import urldefrag, urljoin
+
+import aiohttp
+from packaging import tags
+from packaging.utils import InvalidWheelFilename, parse_wheel_filename
+
+from .util import PathType
+from .wheelhouse import parse_pin
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_INDEX_URL = "https://pypi.org/simple"
+DEFAULT_CONCURRENCY = 16
+DEFAULT_RETRIES = 3
+_ACCEPT = "application/vnd.pypi.simple.v1+json, text/html;q=0.1"
+_LEGACY_MANYLINUX = {17: "manylinux2014", 12: "manylinux2010", 5: "manylinux1"}
+
+IndexFile = namedtuple("IndexFile", ["filename", "url", "sha256"])
+DownloadResult = namedtuple("DownloadResult", ["downloaded", "unresolved"])
+
+
+class DownloadError(Exception):
+    pass
+
+
+def target_platforms(platform_tag: str) -> list[str]:
+    """Expands a platform tag to every platform tag it can install, most specific first
+
+    ``manylinux2014_x86_64`` also accepts the older manylinux wheels, the same as pip does.
+    """
+    m = re.match(r"^manylinux(?:2014|_2_(\d+))_(\w+)$", platform_tag)
+    if not m:
+        return [platform_tag]
+    glibc_minor, arch = int(m.group(1) or 17), m.group(2)
+    platforms = []
+    for minor in range(glibc_minor, 4, -1):
+        if arch not in ("x86_64", "i686") and minor < 17:
+            break
+        platforms.append(f"manylinux_2_{minor}_{arch}")
+        if minor in _LEGACY_MANYLINUX:
+            platforms.append(f"{_LEGACY_MANYLINUX[minor]}_{arch}")
+    return platforms
+
+
+def target_tags(python_version: str, platform_tag: str) -> list[tags.Tag]:
+    """The wheel tags a CPython Lambda runtime supports, in order of preference"""
+    major, minor = (int(v) for v in python_version.lower().lstrip("python").split(".")[:2])
+    platforms = target_platforms(platform_tag)
+    interpreter = f"cp{major}{minor}"
+    return [
+        *tags.cpython_tags((major, minor), abis=[interpreter], platforms=platforms),
+        *tags.compatible_tags((major, minor), interpreter=interpreter, platforms=platforms),
+    ]
+
+
+class _LinkParser(HTMLParser):
+    def __init__(self, base_url: str):
+        super().__init__()
+        self.base_url = base_url
+        self.files: list[IndexFile] = []
+        self._href: str | None = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            self._href = dict(attrs).get("href")
+
+    def handle_data(self, data):
+        if self._href is not None and data.strip():
+            url, fragment = urldefrag(urljoin(self.base_url, self._href))
+            sha256 = fragment.partition("=")[2] if fragment.startswith("sha256=") else None
+            self.files.append(IndexFile(data.strip(), url, sha256))
+            self._href = None
+
+
+def parse_index_page(content: bytes, content_type: str, page_url: str) -> list[IndexFile]:
+    """Parses a project page of a PEP 691 JSON or PEP 503 HTML simple index"""
+    if content_type.startswith("application/vnd.pypi.simple.v1+json"):
+        return [
+            IndexFile(f["filename"], urljoin(page_url, f["url"]), f.get("hashes", {}).get("sha256"))
+            for f in json.loads(content)["files"]
+        ]
+    parser = _LinkParser(page_url)
+    parser.feed(content.decode("utf8"))
+    return parser.files
+
+
+def select_wheel(files: list[IndexFile], version, supported: list[tags.Tag]) -> IndexFile | None:
+    """Picks the most preferred wheel of ``version`` among the files of a project"""
+    ranking = {tag: i for i, tag in enumerate(supported)}
+    best: IndexFile | None = None
+    best_rank = len(ranking)
+    for f in files:
+        if not f.filename.endswith(".whl"):
+            continue
+        try:
+            _, wheel_version, _, wheel_tags = parse_wheel_filename(f.filename)
+        except InvalidWheelFilename:
+            continue
+        if wheel_version != version:
+            continue
+        rank = min((ranking[t] for t in wheel_tags if t in ranking), default=len(ranking))
+        if rank < best_rank:
+            best, best_rank = f, rank
+    return best
+
+
+class _Downloader:
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        dest: Path,
+        index_url: str,
+        supported: list[tags.Tag],
+        concurrency: int,
+        retries: int,
+    ):
+        self.session = session
+        self.dest = dest
+        self.index_url = index_url.rstrip("/")
+        self.supported = supported
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.retries = retries
+
+    async def _retry(self, what: str, func):
+        attempt = 0
+        while True:
+            try:
+                async with self.semaphore:
+                    return await func()
+            except aiohttp.ClientResponseError as e:
+                # client errors won't go away by asking again
+                if attempt >= self.retries or e.status < 500:
+                    raise DownloadError(f"unable to fetch {what}: {e}") from e
+                LOG.debug("Retrying %s after %s", what, e)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt >= self.retries:
+                    raise DownloadError(f"unable to fetch {what}: {e}") from e
+                LOG.debug("Retrying %s after %s", what, e)
+            await asyncio.sleep(0.5 * 2**attempt)
+            attempt += 1
+
+    async def _index_page(self, name: str) -> list[IndexFile]:
+        url = f"{self.index_url}/{name}/"
+
+        async def _fetch():
+            async with self.session.get(url, headers={"Accept": _ACCEPT}) as r:
+                if r.status == 404:
+                    return []
+                r.raise_for_status()
+                return parse_index_page(await r.read(), r.content_type, str(r.url))
+
+        return await self._retry(url, _fetch)
+
+    async def _download(self, f: IndexFile) -> Path:
+        path = self.dest / f.filename
+        if path.is_file() and f.sha256 and _file_sha256(path) == f.sha256:
+            return path
+        tmp_path = path.with_name(f".{f.filename}.{os.getpid()}.tmp")
+
+        async def _fetch():
+            digest = hashlib.sha256()
+            async with self.session.get(f.url) as r:
+                r.raise_for_status()
+                with open(tmp_path, "wb") as fh:
+                    async for block in r.content.iter_chunked(1 << 16):
+                        digest.update(block)
+                        fh.write(block)
+            return digest.hexdigest()
+
+        try:
+            sha256 = await self._retry(f.url, _fetch)
+            if f.sha256 and sha256 != f.sha256:
+                raise DownloadError(f"hash mismatch for {f.filename}: {sha256} != {f.sha256}")
+            os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        return path
+
+    async def fetch(self, spec: str) -> Path | None:
+        pin = parse_pin(spec)
+        if pin is None:
+            return None
+        wheel = select_wheel(await self._index_page(pin.name), pin.version, self.supported)
+        if wheel is None:
+            LOG.debug("No wheel of %s for the target", spec)
+            return None
+        return await self._download(wheel)
+
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+async def _download_all(requirements, dest, index_url, supported, concurrency, retries):
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60)
+    async with aiohttp.ClientSession(
+        connector=connector, timeout=timeout, trust_env=True
+    ) as session:
+        downloader = _Downloader(session, dest, index_url, supported, concurrency, retries)
+        return await asyncio.gather(*(downloader.fetch(spec) for spec in requirements))
+
+
+def download_wheels(
+    requirements: list[str],
+    dest: PathType,
+    python_version: str,
+    platform_tag: str,
+    index_url: str = DEFAULT_INDEX_URL,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    retries: int = DEFAULT_RETRIES,
+) -> DownloadResult:
+    """Downloads the wheels of pinned requirements concurrently
+
+    Args:
+        requirements: Requirements pinned with ``==``, requirements whose markers do not apply to
+            the running interpreter are skipped (the same as pip)
+        dest: Directory to download into
+        python_version: Target python version
+        platform_tag: Target platform tag, e.g. ``manylinux2014_x86_64``
+        index_url: Simple index to look the wheels up in
+        concurrency: Maximum number of concurrent requests
+        retries: Number of times a failed request is retried
+
+    Returns:
+        A DownloadResult with the downloaded wheel paths and the requirements that have no
+        wheel for the target (or are not pinned), to be downloaded by other means
+
+    Raises:
+        DownloadError: if the index or a wheel can't be fetched, or a hash does not match
+    """
+    dest = Path(dest)
+    dest.mkdir(parents=True, exist_ok=True)
+    applicable = [spec for spec in requirements if (p := parse_pin(spec)) is None or p.applies]
+    supported = target_tags(python_version, platform_tag)
+    paths = asyncio.run(_download_all(applicable, dest, index_url, supported, concurrency, retries))
+    downloaded = [p for p in paths if p is not None]
+    unresolved = [spec for spec, p in zip(applicable, paths) if p is None]
+    LOG.info(
+        "Downloaded %s wheels from %s (%s left for pip)",
+        len(downloaded),
+        index_url,
+        len(unresolved),
+    )
+    return DownloadResult(downloaded, unresolved)
@@ -0,0 +1,200 @@
+"""
+Wheel Installer
+
+Installs wheels by unpacking them straight into a target directory, the same layout
+``pip install --target`` produces, with the wheels unpacked concurrently.
+
+"""
+from __future__ import annotations
+
+import base64
+import csv
+import hashlib
+import io
+import logging
+import os
+import posixpath
+import re
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser
+from pathlib import Path
+from typing import TYPE_CHECKING, Sequence
+from zipfile import ZipFile, ZipInfo
+
+from .util import PathType
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .package_store import PackageStore
+
+LOG = logging.getLogger(__name__)
+
+INSTALLER_NAME = "lambda-packager"
+SCRIPT_SHEBANG = "#!/usr/bin/env python3"
+InstalledWheel = namedtuple("InstalledWheel", ["wheel", "dist_info", "files"])
+
+_SCRIPT_TEMPLATE = """{shebang}
+# -*- coding: utf-8 -*-
+import re
+import sys
+from {module} import {import_name}
+if __name__ == "__main__":
+    sys.argv[0] = re.sub(r"(-script\\.pyw|\\.exe)?$", "", sys.argv[0])
+    sys.exit({func}())
+"""
+
+
+class WheelInstallError(Exception):
+    pass
+
+
+def _record_hash(data: bytes) -> str:
+    digest = base64.urlsafe_b64encode(hashlib.sha256(data).digest()).rstrip(b"=").decode()
+    return f"sha256={digest}"
+
+
+def _dest_path(name: str, data_dir: str) -> str | None:
+    """Maps a path inside the wheel to a path relative to the target, None to skip it"""
+    if not name.startswith(data_dir + "/"):
+        return name
+    scheme, _, rest = name.partition("/")[2].partition("/")
+    if not rest:
+        return None
+    if scheme in ("purelib", "platlib", "data"):
+        return rest
+    if scheme == "scripts":
+        return f"bin/{rest}"
+    if scheme == "headers":
+        return f"include/{data_dir[: -len('.data')].split('-')[0]}/{rest}"
+    LOG.warning("Unknown wheel data scheme %s in %s, skipping", scheme, name)
+    return None
+
+
+def _dist_info_dir(zf: ZipFile, wheel: Path) -> str:
+    dist_infos = {n.split("/")[0] for n in zf.namelist() if n.split("/")[0].endswith(".dist-info")}
+    if len(dist_infos) != 1:
+        raise WheelInstallError(f"{wheel.name} does not contain exactly one .dist-info directory")
+    return dist_infos.pop()
+
+
+class _Installer:
+    def __init__(self, target: Path):
+        self.target = target
+        self.records: list[tuple[str, str, str]] = []
+
+    def write(self, rel_path: str, data: bytes, mode: int | None = None) -> None:
+        parts = rel_path.split("/")
+        if posixpath.isabs(rel_path) or ".." in parts or re.match(r"^[A-Za-z]:", rel_path):
+            raise WheelInstallError(f"unsafe path {rel_path!r} in wheel")
+        dest = self.target.joinpath(*parts)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        # wheels sharing a namespace may write the same file concurrently
+        tmp = dest.with_name(f".{dest.name}.{os.getpid()}.{id(self)}.tmp")
+        tmp.write_bytes(data)
+        if mode:
+            os.chmod(tmp, mode)
+        os.replace(tmp, dest)
+        self.records.append((rel_path, _record_hash(data), str(len(data))))
+
+    def write_scripts(self, entry_points: str) -> None:
+        parser = ConfigParser(delimiters=("=",), interpolation=None)
+        parser.optionxform = str  # type: ignore[assignment,method-assign]
+        parser.read_string(entry_points)
+        for section in ("console_scripts", "gui_scripts"):
+            if not parser.has_section(section):
+                continue
+            for name, value in parser.items(section):
+                module, _, func = value.split("[")[0].strip().partition(":")
+                if not func:
+                    continue
+                script = _SCRIPT_TEMPLATE.format(
+                    shebang=SCRIPT_SHEBANG,
+                    module=module.strip(),
+                    import_name=func.strip().split(".")[0],
+                    func=func.strip(),
+                )
+                self.write(f"bin/{name}", script.encode(), 0o755)
+
+
+def install_wheel(wheel: PathType, target: PathType) -> InstalledWheel:
+    """Unpacks a wheel into ``target``
+
+    The contents of ``.data/purelib`` and ``.data/platlib`` go to the target root, scripts to
+    ``bin``, and the ``.dist-info`` directory gets a fresh ``RECORD`` and ``INSTALLER``.
+
+    Args:
+        wheel: Path to the wheel file
+        target: Directory to install into
+
+    Returns:
+        An InstalledWheel with the dist-info directory name and the installed files
+
+    Raises:
+        WheelInstallError: if the wheel is malformed
+    """
+    wheel = Path(wheel)
+    installer = _Installer(Path(target))
+    with ZipFile(wheel) as zf:
+        dist_info = _dist_info_dir(zf, wheel)
+        data_dir = dist_info[: -len(".dist-info")] + ".data"
+        skip = {f"{dist_info}/RECORD", f"{dist_info}/RECORD.jws", f"{dist_info}/RECORD.p7s"}
+        info: ZipInfo
+        for info in zf.infolist():
+            if info.is_dir() or info.filename in skip:
+                continue
+            dest = _dest_path(info.filename, data_dir)
+            if dest is None:
+                continue
+            mode = (info.external_attr >> 16) & 0o777
+            data = zf.read(info)
+            if dest.startswith("bin/") and data.startswith(b"#!python"):
+                data = data.replace(b"#!python", SCRIPT_SHEBANG.encode(), 1)
+                mode |= 0o755
+            installer.write(dest, data, mode if mode & 0o111 else None)
+        if f"{dist_info}/entry_points.txt" in zf.namelist():
+            installer.write_scripts(zf.read(f"{dist_info}/entry_points.txt").decode("utf8"))
+    installer.write(f"{dist_info}/INSTALLER", f"{INSTALLER_NAME}\n".encode())
+    installer.write(f"{dist_info}/REQUESTED", b"")
+
+    record = io.StringIO()
+    writer = csv.writer(record, lineterminator="\n")
+    writer.writerows(installer.records)
+    writer.writerow((f"{dist_info}/RECORD", "", ""))
+    record_path = Path(target, dist_info, "RECORD")
+    record_path.write_text(record.getvalue(), encoding="utf8")
+    files = [r[0] for r in installer.records] + [f"{dist_info}/RECORD"]
+    return InstalledWheel(wheel, dist_info, files)
+
+
+def install_wheels(
+    wheels: Sequence[PathType],
+    target: PathType,
+    workers: int = 0,
+    store: PackageStore | None = None,
+) -> list[InstalledWheel]:
+    """Installs wheels into ``target`` concurrently
+
+    Args:
+        wheels: Paths to the wheel files
+        target: Directory to install into
+        workers: Number of threads, 0 to pick one based on the number of cores
+        store: Package store to hard link the unpacked wheels from, instead of unpacking them
+            into the target
+
+    Returns:
+        An InstalledWheel for each wheel, in the same order
+    """
+    if not wheels:
+        return []
+    workers = workers or min(32, (os.cpu_count() or 1) + 4)
+    Path(target).mkdir(parents=True, exist_ok=True)
+    install = store.install if store is not None else install_wheel
+    with ThreadPoolExecutor(min(workers, len(wheels))) as pool:
+        installed = list(pool.map(lambda w: install(w, target), wheels))
+    LOG.info(
+        "Installed %s wheels (%s files) into %s",
+        len(installed),
+        sum(len(i.files) for i in installed),
+        target,
+    )
+    return installed
@@ -0,0 +1,209 @@
+"""
+Wheelhouse
+
+A persistent store of the distributions downloaded for a target (python version and platform
+tag), so installing the same pinned requirements again does not need the network.
+
+"""
+from __future__ import annotations
+
+import logging
+import os
+import time
+from collections import namedtuple
+from pathlib import Path
+
+from packaging.requirements import InvalidRequirement, Requirement
+from packaging.utils import (
+    InvalidSdistFilename,
+    InvalidWheelFilename,
+    canonicalize_name,
+    parse_sdist_filename,
+    parse_wheel_filename,
+)
+from packaging.version import InvalidVersion, Version
+
+from .util import PathType, get_cache_dir, link_or_copy
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_MAX_AGE = 30 * 86400  # 30 days
+
+Pin = namedtuple("Pin", ["name", "version", "applies"])
+
+
+def parse_pin(spec: str) -> Pin | None:
+    """Parses an exactly pinned requirement
+
+    Environment markers are evaluated for the running interpreter, the same way pip does.
+
+    Returns:
+        A Pin with the canonical name, version and whether the markers apply, or None if the
+        requirement is not pinned to a single version
+    """
+    try:
+        req = Requirement(spec)
+    except InvalidRequirement:
+        return None
+    specs = list(req.specifier)
+    if (
+        req.url
+        or len(specs) != 1
+        or specs[0].operator not in ("==", "===")
+        or "*" in specs[0].version
+    ):
+        return None
+    try:
+        version = Version(specs[0].version)
+    except InvalidVersion:
+        return None
+    return Pin(canonicalize_name(req.name), version, req.marker is None or req.marker.evaluate())
+
+
+def _parse_filename(filename: str) -> tuple[str, Version] | None:
+    try:
+        if filename.endswith(".whl"):
+            name, version, _, _ = parse_wheel_filename(filename)
+        else:
+            name, version = parse_sdist_filename(filename)
+    except (InvalidWheelFilename, InvalidSdistFilename, InvalidVersion):
+        return None
+    return name, version
+
+
+class Wheelhouse:
+    """Distributions for one target, kept in the user cache directory
+
+    Args:
+        python_version: Target python version
+        platform_tag: Target platform tag, e.g. ``manylinux2014_x86_64``
+        path: Directory to use instead of the one in the cache directory
+        max_age: Distributions unused for this many seconds are removed by :meth:`prune`
+    """
+
+    def __init__(
+        self,
+        python_version: str,
+        platform_tag: str,
+        path: PathType | None = None,
+        max_age: float = DEFAULT_MAX_AGE,
+    ):
+        if path is None:
+            version = python_version.lower().lstrip("python").replace(".", "")
+            path = get_cache_dir("wheelhouse", f"cp{version}-{platform_tag}")
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_age = max_age
+
+    def _contents(self) -> dict[tuple[str, Version], list[Path]]:
+        contents: dict[tuple[str, Version], list[Path]] = {}
+        for p in self.path.iterdir():
+            parsed = _parse_filename(p.name)
+            if parsed is not None and p.is_file():
+                contents.setdefault(parsed, []).append(p)
+        return contents
+
+    def missing(self, requirements: list[str]) -> list[str] | None:
+        """Finds the requirements that have no distribution in the wheelhouse
+
+        Returns:
+            The missing requirements, or None if some requirement is not pinned to an exact
+            version (so it can't be known whether the wheelhouse has it)
+        """
+        contents = self._contents()
+        missing = []
+        for spec in requirements:
+            pin = parse_pin(spec)
+            if pin is None:
+                LOG.debug("%s is not pinned, not using the wheelhouse", spec)
+                return None
+            if pin.applies and pin[:2] not in contents:
+                missing.append(spec)
+        return missing
+
+    def locate(self, requirements: list[str]) -> tuple[list[Path], list[str]]:
+        """Finds the wheels for ``requirements``
+
+        Returns:
+            The wheel files, and the requirements that apply but only have a source distribution
+            (or nothing at all) in the wheelhouse
+        """
+        contents = self._contents()
+        wheels = []
+        others = []
+        for spec in requirements:
+            pin = parse_pin(spec)
+            if pin is not None and not pin.applies:
+                continue
+            found = [
+                p for p in contents.get(pin[:2], []) if p.suffix == ".whl"  # type: ignore[index]
+            ]
+            if found:
+                wheels.append(sorted(found)[0])
+            else:
+                others.append(spec)
+        return wheels, others
+
+    def sizes(self, requirements: list[str]) -> list[int]:
+        """Gets the size of the distribution of each requirement, 0 if it is not in the wheelhouse"""
+        contents = self._contents()
+        sizes = []
+        for spec in requirements:
+            pin = parse_pin(spec)
+            found = contents.get(pin[:2], []) if pin is not None else []
+            sizes.append(min((p.stat().st_size for p in found), default=0))
+        return sizes
+
+    def import_universal(self, other: Wheelhouse) -> int:
+        """Links the pure python wheels of another wheelhouse into this one
+
+        ``none-any`` wheels install on every platform, so a wheelhouse of the same python version
+        for another platform has them already.
+
+        Returns:
+            The number of linked wheels
+        """
+        linked = 0
+        for p in other.path.glob("*.whl"):
+            if (self.path / p.name).exists():
+                continue
+            try:
+                _, _, _, wheel_tags = parse_wheel_filename(p.name)
+            except (InvalidWheelFilename, InvalidVersion):
+                continue
+            if all(t.abi == "none" and t.platform == "any" for t in wheel_tags):
+                link_or_copy(p, self.path / p.name)
+                linked += 1
+        return linked
+
+    def touch(self, requirements: list[str]) -> int:
+        """Marks the distributions of ``requirements`` as used
+
+        Returns:
+            The number of requirements found in the wheelhouse
+        """
+        contents = self._contents()
+        now = time.time()
+        found = 0
+        for spec in requirements:
+            pin = parse_pin(spec)
+            if pin is not None and pin.applies and pin[:2] in contents:
+                found += 1
+                for p in contents[pin[:2]]:
+                    os.utime(p, (now, now))
+        return found
+
+    def prune(self) -> int:
+        """Removes distributions that were not used for ``max_age`` seconds
+
+        Returns:
+            The number of removed files
+        """
+        cutoff = time.time() - self.max_age
+        removed = 0
+        for p in self.path.iterdir():
+            if p.is_file() and p.stat().st_mtime < cutoff:
+                LOG.debug("Removing %s from the wheelhouse", p.name)
+                p.unlink()
+                removed += 1
+        return removed
@@ -9,6 +9,14 @@ else:
     from importlib_resources import files  # type: ignore
 
 
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Keeps every test's lambda-packager cache in its own temporary directory"""
+    path = tmp_path / "cache"
+    monkeypatch.setenv("LAMBDA_PACKAGER_CACHE_DIR", str(path))
+    return path
+
+
 @pytest.fixture(params=["poetry", "pip"])
 def temp_path_filled(request, tmp_path):
     print(tmp_path)
@@ -1,5 +1,11 @@
+import io
+import os
+import tarfile
+from contextlib import contextmanager
+
 import pytest
 
+from aws_lambda_python_packager import arrow_fetcher
 from aws_lambda_python_packager.arrow_fetcher import fetch_arrow_package
 
 
@@ -11,3 +17,153 @@ def test_fetch_arrow_package(tmp_path):
 def test_fetch_arrow_package_exception(tmp_path):
     with pytest.raises(ValueError):
         fetch_arrow_package(tmp_path, "10.0.1a", "3.9", "arm64")
+
+
+def _make_tarball(path):
+    with tarfile.open(path, "w:gz") as tf:
+        for name, content in (
+            ("python/pyarrow/__init__.py", b"VERSION = 'new'\n"),
+            ("python/pyarrow/lib.so", b"lib"),
+            ("python/pyarrow/_flight.so", b"flight"),
+            ("python/pyarrow/flight.py", b""),
+            ("python/pyarrow/include/arrow/api.h", b""),
+            ("README.md", b"not in the package"),
+        ):
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            info.mode = 0o644
+            tf.addfile(info, io.BytesIO(content))
+        link = tarfile.TarInfo("python/pyarrow/libarrow.so")
+        link.type = tarfile.SYMTYPE
+        link.linkname = "lib.so"
+        tf.addfile(link)
+        escape = tarfile.TarInfo("python/pyarrow/escape.so")
+        escape.type = tarfile.SYMTYPE
+        escape.linkname = "../../../etc/passwd"
+        tf.addfile(escape)
+    return path
+
+
+def test_fetch_arrow_package_offline(tmp_path, monkeypatch):
+    tarball = _make_tarball(tmp_path / "pyarrow.tar.gz")
+
+    @contextmanager
+    def _open(url):
+        with tarfile.open(url, "r|gz") as tf:
+            yield tf
+
+    monkeypatch.setattr(arrow_fetcher, "get_arrow_version", lambda *args: str(tarball))
+    monkeypatch.setattr(arrow_fetcher, "open_zip_file", _open)
+    output = tmp_path / "output"
+    (output / "pyarrow").mkdir(parents=True)
+    (output / "pyarrow" / "old.py").write_text("")
+    (output / "pyarrow-9.0.0.dist-info").mkdir()
+    (output / "six.py").write_text("")
+
+    fetch_arrow_package(output, "10.0.1", exclude_components=["flight", "headers"], use_cache=False)
+
+    assert sorted(p.name for p in output.iterdir()) == ["pyarrow", "six.py"]
+    assert sorted(p.name for p in (output / "pyarrow").iterdir()) == [
+        "__init__.py",
+        "lib.so",
+        "libarrow.so",
+    ]
+    assert os.readlink(output / "pyarrow" / "libarrow.so") == "lib.so"
+
+    with pytest.raises(ValueError):
+        fetch_arrow_package(output, "10.0.1", exclude_components=["everything"], use_cache=False)
+
+
+def test_fetch_arrow_package_cached(tmp_path, monkeypatch):
+    tarball = _make_tarball(tmp_path / "pyarrow.tar.gz")
+
+    @contextmanager
+    def _open(url):
+        with tarfile.open(url, "r|gz") as tf:
+            yield tf
+
+    monkeypatch.setattr(arrow_fetcher, "get_arrow_version", lambda *args: str(tarball))
+    monkeypatch.setattr(arrow_fetcher, "open_zip_file", _open)
+    fetch_arrow_package(tmp_path / "first", "10.0.1", arch="arm64")
+    tree = arrow_fetcher.cached_arrow_tree("10.0.1", arch="aarch64")
+    assert (tree / "pyarrow" / "_flight.so").is_file()
+    assert (tree.parent / "meta.json").is_file()
+
+    def _offline(*args):
+        raise AssertionError("cached build was fetched again")
+
+    monkeypatch.setattr(arrow_fetcher, "get_arrow_version", _offline)
+    monkeypatch.setattr(arrow_fetcher, "open_zip_file", _offline)
+    output = tmp_path / "second"
+    fetch_arrow_package(output, "10.0.1", arch="arm64", exclude_components=["flight"])
+    assert sorted(p.name for p in (output / "pyarrow").iterdir()) == [
+        "__init__.py",
+        "include",
+        "lib.so",
+        "libarrow.so",
+    ]
+    assert os.readlink(output / "pyarrow" / "libarrow.so") == "lib.so"
+    assert (output / "pyarrow" / "lib.so").stat().st_nlink > 1
+
+
+def _add(tf, name, type_=tarfile.REGTYPE, linkname="", data=b""):
+    info = tarfile.TarInfo(name)
+    info.type = type_
+    info.linkname = linkname
+    info.size = len(data)
+    tf.addfile(info, io.BytesIO(data) if data else None)
+
+
+def _extract(tmp_path, members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tf:
+        for member in members:
+            _add(tf, *member)
+    buffer.seek(0)
+    dest = tmp_path / "pkg" / "dest"
+    dest.mkdir(parents=True)
+    with tarfile.open(fileobj=buffer, mode="r|") as tf:
+        arrow_fetcher.extract_python_members(tf, dest)
+    return dest
+
+
+def test_extract_symlink_to_parent(tmp_path):
+    dest = _extract(
+        tmp_path,
+        [
+            ("python/up", tarfile.SYMTYPE, ".."),
+            ("python/up/evil.txt", tarfile.REGTYPE, "", b"evil"),
+        ],
+    )
+    assert not (dest / "up").is_symlink()
+    assert not (dest.parent / "evil.txt").exists()
+
+
+def test_extract_through_symlinked_directory(tmp_path):
+    dest = _extract(
+        tmp_path,
+        [
+            ("python/here", tarfile.SYMTYPE, "."),
+            # resolves to the parent of dest through the link
+            ("python/up", tarfile.SYMTYPE, "here/.."),
+            ("python/here/evil.txt", tarfile.REGTYPE, "", b"evil"),
+        ],
+    )
+    assert os.readlink(dest / "here") == "."
+    assert not os.path.lexists(dest / "up")
+    assert not (dest / "evil.txt").exists()
+
+
+def test_extract_hard_link_outside(tmp_path):
+    (tmp_path / "pkg" / "x").parent.mkdir(parents=True)
+    (tmp_path / "pkg" / "x").write_text("secret")
+    dest = _extract(
+        tmp_path,
+        [
+            ("python/lib.so", tarfile.REGTYPE, "", b"lib"),
+            ("python/x", tarfile.LNKTYPE, "python/../../x"),
+            ("python/lib2.so", tarfile.LNKTYPE, "python/lib.so"),
+        ],
+    )
+    assert not (dest / "x").exists()
+    assert (dest / "lib2.so").stat().st_nlink == 2
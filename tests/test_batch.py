@@ -0,0 +1,102 @@
+import pytest
+
+from aws_lambda_python_packager.batch import (
+    BatchItem,
+    BatchResult,
+    TemplateError,
+    build_batch,
+    collect_items,
+    format_summary,
+    items_from_template,
+)
+
+TEMPLATE = """
+AWSTemplateFormatVersion: '2010-09-09'
+Transform: AWS::Serverless-2016-10-31
+Globals:
+  Function:
+    Runtime: python3.11
+    Timeout: !Ref Timeout
+Resources:
+  Api:
+    Type: AWS::Serverless::Function
+    Properties:
+      CodeUri: functions/api/
+      Handler: app.handler
+      Role: !GetAtt Role.Arn
+  Worker:
+    Type: AWS::Serverless::Function
+    Properties:
+      CodeUri: functions/worker
+      Runtime: python3.9
+      Architectures: [arm64]
+      Environment:
+        Variables:
+          TABLE: !Sub "${AWS::StackName}-table"
+  Remote:
+    Type: AWS::Serverless::Function
+    Properties:
+      CodeUri: s3://bucket/code.zip
+  Node:
+    Type: AWS::Serverless::Function
+    Properties:
+      CodeUri: functions/node
+      Runtime: nodejs18.x
+  Image:
+    Type: AWS::Serverless::Function
+    Properties:
+      PackageType: Image
+  Role:
+    Type: AWS::IAM::Role
+"""
+
+
+def test_items_from_template(tmp_path):
+    pytest.importorskip("yaml")
+    (tmp_path / "template.yaml").write_text(TEMPLATE)
+    assert items_from_template(tmp_path / "template.yaml") == [
+        BatchItem("Api", tmp_path / "functions" / "api", "3.11", "x86_64"),
+        BatchItem("Worker", tmp_path / "functions" / "worker", "3.9", "arm64"),
+    ]
+    (tmp_path / "broken.json").write_text("{")
+    with pytest.raises(TemplateError):
+        items_from_template(tmp_path / "broken.json")
+
+
+def test_collect_items(tmp_path):
+    pytest.importorskip("yaml")
+    (tmp_path / "sam").mkdir()
+    (tmp_path / "sam" / "template.yaml").write_text(TEMPLATE)
+    for name in ("a/api", "b/api"):
+        (tmp_path / name).mkdir(parents=True)
+        (tmp_path / name / "requirements.txt").write_text("")
+    items = collect_items([tmp_path / "sam", tmp_path / "a" / "api", tmp_path / "b" / "api"])
+    assert [i.name for i in items] == ["Api", "Worker", "api", "api-2"]
+    assert items[2] == BatchItem("api", tmp_path / "a" / "api", None, None)
+
+
+def test_build_batch_isolates_failures(tmp_path):
+    # neither a pip nor a poetry project
+    (tmp_path / "broken").mkdir()
+    items = collect_items([tmp_path / "broken"])
+    results = build_batch(items, tmp_path / "out", workers=1, python_version="3.10")
+    assert len(results) == 1
+    assert results[0].item.python_version == "3.10"
+    assert results[0].error.startswith("ProjectTypeException")
+
+    with pytest.raises(ValueError):
+        build_batch(items, tmp_path / "out", {"update_dependencies": True})
+
+
+def test_format_summary(tmp_path):
+    summary = format_summary(
+        [
+            BatchResult(BatchItem("api", tmp_path, "3.11", "x86_64"), None, 1.25, 2048, None),
+            BatchResult(BatchItem("worker", tmp_path, "3.9", "arm64"), None, 0.5, None, "boom"),
+        ]
+    )
+    lines = summary.splitlines()
+    assert lines[0].split() == ["Function", "Target", "Time", "Size", "Status"]
+    assert lines[2].split() == ["api", "python3.11", "x86_64", "1.2s", "2.0KiB", "ok"]
+    assert lines[3].endswith("failed: boom")
+    assert lines[-1] == "1 built, 1 failed, 1.8s of build time"
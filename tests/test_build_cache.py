@@ -0,0 +1,71 @@
+from types import SimpleNamespace
+
+from aws_lambda_python_packager.build_cache import BuildCache
+
+
+def make_packager(project_path, **kwargs):
+    values = {
+        "project_path": project_path,
+        "python_version": "3.9",
+        "architecture": "x86_64",
+        "region": "us-east-1",
+        "ignore_packages": False,
+        "update_dependencies": False,
+        "split_layer": False,
+        "analyzer": SimpleNamespace(pkgs_to_ignore_dict={}),
+    }
+    values.update(kwargs)
+    return SimpleNamespace(**values)
+
+
+def test_fingerprint(tmp_path):
+    (tmp_path / "requirements.txt").write_text("six==1.16.0\n")
+    (tmp_path / "app.py").write_text("print('hi')\n")
+    packager = make_packager(tmp_path)
+    key = BuildCache.fingerprint(packager, {"strip_tests": True})
+    assert key == BuildCache.fingerprint(packager, {"strip_tests": True})
+    assert key != BuildCache.fingerprint(packager, {"strip_tests": False})
+    assert key != BuildCache.fingerprint(make_packager(tmp_path, architecture="arm64"), {})
+    ignored = make_packager(tmp_path, analyzer=SimpleNamespace(pkgs_to_ignore_dict={"six": "1"}))
+    assert key != BuildCache.fingerprint(ignored, {"strip_tests": True})
+
+    (tmp_path / "app.py").write_text("print('bye')\n")
+    assert key != BuildCache.fingerprint(packager, {"strip_tests": True})
+    (tmp_path / "app.py").write_text("print('hi')\n")
+    (tmp_path / "notes.txt").write_text("not part of the package")
+    assert key == BuildCache.fingerprint(packager, {"strip_tests": True})
+
+
+def test_fingerprint_ignores_bytecode(tmp_path):
+    (tmp_path / "requirements.txt").write_text("six==1.16.0\n")
+    (tmp_path / "src" / "pkg").mkdir(parents=True)
+    (tmp_path / "src" / "pkg" / "app.py").write_text("print('hi')\n")
+    packager = make_packager(tmp_path)
+    key = BuildCache.fingerprint(packager, {})
+    (tmp_path / "src" / "pkg" / "__pycache__").mkdir()
+    (tmp_path / "src" / "pkg" / "__pycache__" / "app.cpython-311.pyc").write_bytes(b"\0")
+    (tmp_path / "src" / "pkg" / "legacy.pyc").write_bytes(b"\0")
+    assert key == BuildCache.fingerprint(packager, {})
+
+
+def test_store_restore(tmp_path):
+    cache = BuildCache(tmp_path / "cache", max_entries=1)
+    out = tmp_path / "out"
+    (out / "pkg").mkdir(parents=True)
+    (out / "pkg" / "a.py").write_text("a = 1\n")
+    zip_path = tmp_path / "out.zip"
+    zip_path.write_bytes(b"zip")
+
+    assert not cache.restore("key1", out, zip_path)
+    cache.store("key1", out, zip_path)
+    (out / "pkg" / "a.py").write_text("changed")
+    zip_path.unlink()
+    assert cache.restore("key1", out, zip_path)
+    assert (out / "pkg" / "a.py").read_text() == "a = 1\n"
+    assert zip_path.read_bytes() == b"zip"
+
+    cache.store("key2", out)
+    assert not cache.restore("key1", out)
+    # stored without a zip, so only usable for builds that don't ask for one
+    assert not cache.restore("key2", out, zip_path)
+    assert cache.restore("key2", out)
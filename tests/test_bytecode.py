@@ -0,0 +1,144 @@
+import importlib.util
+import marshal
+import os
+import platform
+import subprocess
+import sys
+from importlib.machinery import SourcelessFileLoader
+
+import pytest
+
+from aws_lambda_python_packager.bytecode import (
+    BytecodeCache,
+    compile_files,
+    find_python_interpreter,
+)
+from aws_lambda_python_packager.file_index import FileIndex, apply_transforms
+from aws_lambda_python_packager.transforms import SetUtime
+
+
+def write_sources(root, count=10):
+    rel_paths = []
+    for n in range(count):
+        rel_path = os.path.join("pkg", f"mod{n}.py")
+        p = root / rel_path
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_text(f"VALUE = {n}\n")
+        rel_paths.append(rel_path)
+    (root / "pkg" / "broken.py").write_text("def oops(:\n")
+    rel_paths.append(os.path.join("pkg", "broken.py"))
+    return rel_paths
+
+
+def load_pyc(path, name):
+    loader = SourcelessFileLoader(name, str(path))
+    spec = importlib.util.spec_from_loader(name, loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+
+def test_compile_files_parallel(tmp_path):
+    rel_paths = write_sources(tmp_path)
+    result = compile_files(tmp_path, rel_paths, workers=2)
+
+    assert sorted(result.compiled) == sorted(rel_paths[:-1])
+    assert [e[0] for e in result.errors] == [os.path.join("pkg", "broken.py")]
+    assert not (tmp_path / "pkg" / "broken.pyc").exists()
+    assert load_pyc(tmp_path / "pkg" / "mod3.pyc", "mod3").VALUE == 3
+    with open(tmp_path / "pkg" / "mod3.pyc", "rb") as fh:
+        fh.read(16)
+        assert marshal.load(fh).co_filename == os.path.join("pkg", "mod3.py")
+
+
+def test_compile_files_single_worker(tmp_path):
+    rel_paths = write_sources(tmp_path, count=2)
+    result = compile_files(tmp_path, rel_paths, workers=1)
+    assert len(result.compiled) == 2
+    assert len(result.errors) == 1
+
+
+def other_python():
+    for version in ("3.9", "3.10", "3.12", "3.8"):
+        if version == ".".join(platform.python_version_tuple()[:2]):
+            continue
+        interpreter = find_python_interpreter(version)
+        if interpreter is not None:
+            return version, interpreter
+    return None, None
+
+
+def test_compile_files_other_interpreter(tmp_path):
+    version, interpreter = other_python()
+    if interpreter is None:
+        pytest.skip("no other python version installed")
+    rel_paths = write_sources(tmp_path, count=4)
+    result = compile_files(tmp_path, rel_paths, workers=2, interpreter=interpreter)
+    assert len(result.compiled) == 4
+    assert len(result.errors) == 1
+
+    magic = subprocess.run(
+        [interpreter, "-c", "import importlib.util; print(importlib.util.MAGIC_NUMBER.hex())"],
+        capture_output=True,
+        check=True,
+    ).stdout.decode()
+    with open(tmp_path / "pkg" / "mod0.pyc", "rb") as fh:
+        assert fh.read(4).hex() == magic.strip()
+    assert find_python_interpreter(f"python{version}", interpreter) == interpreter
+
+
+def test_find_python_interpreter_mismatch():
+    this_version = ".".join(platform.python_version_tuple()[:2])
+    assert find_python_interpreter(this_version) == sys.executable
+    # a configured interpreter of the wrong version is ignored
+    assert find_python_interpreter(this_version, interpreter="/nonexistent/python") == (
+        sys.executable
+    )
+    assert find_python_interpreter("2.1") is None
+
+
+def test_compile_files_cache(tmp_path):
+    cache = BytecodeCache(tmp_path / "cache")
+    first = tmp_path / "first"
+    rel_paths = write_sources(first, count=3)
+    result = compile_files(first, rel_paths, workers=1, cache=cache)
+    assert result.cached == 0
+    assert len(result.compiled) == 3
+
+    second = tmp_path / "second"
+    write_sources(second, count=3)
+    (second / "pkg" / "mod2.py").write_text("VALUE = 'changed'\n")
+    result = compile_files(second, rel_paths, workers=1, cache=cache)
+    assert result.cached == 2
+    assert sorted(result.compiled) == sorted(rel_paths[:-1])
+    assert len(result.errors) == 1
+    assert load_pyc(second / "pkg" / "mod1.pyc", "mod1").VALUE == 1
+    assert load_pyc(second / "pkg" / "mod2.pyc", "mod2").VALUE == "changed"
+
+
+def test_bytecode_cache_prune(tmp_path):
+    cache = BytecodeCache(tmp_path / "cache", max_age=3600)
+    root = tmp_path / "src"
+    rel_paths = write_sources(root, count=3)
+    compile_files(root, rel_paths, workers=1, cache=cache)
+    cached = sorted(cache.cache_dir.glob("*/*.pyc"))
+    assert len(cached) == 3
+    for path in cached:
+        os.utime(path.with_suffix(".used"), (0, 0))
+    # used again, so kept
+    compile_files(root, rel_paths[:1], workers=1, cache=cache)
+    assert len(list(cache.cache_dir.glob("*/*.pyc"))) == 1
+    assert cache.prune() == 0
+
+
+def test_bytecode_cache_survives_set_utime(tmp_path):
+    cache = BytecodeCache(tmp_path / "cache", max_age=3600)
+    rel_paths = write_sources(tmp_path / "first", count=2)
+    compile_files(tmp_path / "first", rel_paths, workers=1, cache=cache)
+    # the second build links the cached files, then gives every file the fixed build time
+    write_sources(tmp_path / "second", count=2)
+    compile_files(tmp_path / "second", rel_paths, workers=1, cache=cache)
+    assert cache.hits == 2
+    apply_transforms(FileIndex.scan(tmp_path / "second"), [SetUtime()])
+    assert cache.prune() == 0
+    assert len(list(cache.cache_dir.glob("*/*.pyc"))) == 2
@@ -0,0 +1,143 @@
+import ctypes
+import os
+import platform
+import shutil
+import struct
+import subprocess
+
+import pytest
+
+from aws_lambda_python_packager.elf import (
+    SHF_ALLOC,
+    NotAnElfFile,
+    has_strippable_sections,
+    read_elf_header,
+    read_elf_sections,
+    strip_elf,
+)
+from aws_lambda_python_packager.file_index import FileIndex, apply_transforms
+from aws_lambda_python_packager.transforms import StripLibraries, StripResult
+
+needs_gcc = pytest.mark.skipif(
+    shutil.which("gcc") is None or platform.system() != "Linux", reason="needs gcc on Linux"
+)
+
+
+@pytest.fixture
+def shared_lib(tmp_path):
+    src = tmp_path / "lib.c"
+    src.write_text("int answer(void) { return 42; }\n")
+    lib = tmp_path / "build" / "libanswer.so"
+    lib.parent.mkdir()
+    subprocess.run(["gcc", "-g", "-shared", "-fPIC", "-o", str(lib), str(src)], check=True)
+    return lib
+
+
+@needs_gcc
+def test_has_strippable_sections(shared_lib, tmp_path):
+    assert has_strippable_sections(shared_lib)
+    not_elf = tmp_path / "not_elf.so"
+    not_elf.write_text("nope")
+    with pytest.raises(NotAnElfFile):
+        has_strippable_sections(not_elf)
+
+
+@needs_gcc
+@pytest.mark.skipif(shutil.which("strip") is None, reason="needs strip")
+def test_strip_libraries(shared_lib, tmp_path):
+    out = tmp_path / "out"
+    out.mkdir()
+    for n in range(3):
+        shutil.copy(shared_lib, out / f"lib{n}.so")
+    os.symlink("lib0.so", out / "lib0.so.1")
+    (out / "readme.so.txt").write_text("not a library")
+
+    index = FileIndex.scan(out)
+    size_before = index.total_size
+    strip = StripLibraries()
+    apply_transforms(index, [strip])
+
+    assert strip.results == {
+        "lib0.so": StripResult.STRIPPED,
+        "lib1.so": StripResult.STRIPPED,
+        "lib2.so": StripResult.STRIPPED,
+        "lib0.so.1": StripResult.SYMLINK,
+        "readme.so.txt": StripResult.NOT_ELF,
+    }
+    assert index.total_size < size_before
+    assert not has_strippable_sections(out / "lib1.so")
+
+    # second pass has nothing left to do
+    strip = StripLibraries()
+    apply_transforms(FileIndex.scan(out), [strip])
+    assert strip.results["lib1.so"] == StripResult.NOTHING_TO_STRIP
+
+
+@needs_gcc
+def test_strip_elf(shared_lib):
+    size_before = shared_lib.stat().st_size
+    mtime_before = shared_lib.stat().st_mtime_ns
+    assert strip_elf(shared_lib)
+    assert shared_lib.stat().st_size < size_before
+    assert shared_lib.stat().st_mtime_ns == mtime_before
+    assert not has_strippable_sections(shared_lib)
+    with open(shared_lib, "rb") as fh:
+        names = [s.name for s in read_elf_sections(fh)]
+    assert ".symtab" not in names and ".comment" not in names
+    assert ".dynsym" in names and ".text" in names
+    assert ctypes.CDLL(str(shared_lib)).answer() == 42
+    # nothing left to do the second time around
+    assert not strip_elf(shared_lib)
+
+
+@needs_gcc
+def test_strip_elf_nothing_saved(shared_lib):
+    # like a library relocated by patchelf, a loaded section moved behind everything else
+    with open(shared_lib, "r+b") as fh:
+        header = read_elf_header(fh)
+        sections = read_elf_sections(fh, header)
+        moved = sections[header.shstrndx]
+        fh.seek(moved.offset)
+        data = fh.read(moved.size)
+        offset = fh.seek(0, os.SEEK_END)
+        fh.write(data)
+        fh.seek(header.shoff + header.shstrndx * header.shentsize + 8)
+        fh.write(struct.pack("<QQQ", moved.flags | SHF_ALLOC, moved.addr, offset))
+    before = shared_lib.read_bytes()
+    assert not strip_elf(shared_lib)
+    assert shared_lib.read_bytes() == before
+    assert not list(shared_lib.parent.glob("*.strip-tmp"))
+
+
+@needs_gcc
+def test_strip_libraries_python(shared_lib, tmp_path):
+    out = tmp_path / "out"
+    out.mkdir()
+    for n in range(3):
+        shutil.copy(shared_lib, out / f"lib{n}.so")
+    index = FileIndex.scan(out)
+    size_before = index.total_size
+    strip = StripLibraries(method="python", workers=2)
+    apply_transforms(index, [strip])
+    assert set(strip.results.values()) == {StripResult.STRIPPED}
+    assert index.total_size < size_before
+    assert ctypes.CDLL(str(out / "lib2.so")).answer() == 42
+
+
+@needs_gcc
+def test_strip_libraries_failure_refreshes_index(shared_lib, tmp_path, monkeypatch):
+    out = tmp_path / "out"
+    out.mkdir()
+    for n in range(2):
+        shutil.copy(shared_lib, out / f"lib{n}.so")
+
+    def _strip_first_then_fail(self, batches):
+        strip_elf(batches[0][0].path)
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(StripLibraries, "_strip_python", _strip_first_then_fail)
+    index = FileIndex.scan(out)
+    strip = StripLibraries(method="python")
+    apply_transforms(index, [strip])
+    assert index.total_size == sum(p.stat().st_size for p in out.iterdir())
+    assert index.total_size < 2 * shared_lib.stat().st_size
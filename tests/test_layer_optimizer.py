@@ -0,0 +1,93 @@
+import json
+
+from aws_lambda_python_packager.layer_optimizer import (
+    PLAN_FILE,
+    apply_plan,
+    plan_layers,
+    scan_function,
+    scan_packages,
+)
+
+TARGET = ("3.9", "x86_64")
+
+
+def _install(package_dir, name, version, size):
+    dist_info = package_dir / f"{name}-{version}.dist-info"
+    dist_info.mkdir(parents=True)
+    (package_dir / name).mkdir()
+    (package_dir / name / "__init__.py").write_bytes(b"x" * size)
+    (dist_info / "RECORD").write_text(
+        f"{name}/__init__.py,sha256=abc,{size}\n{dist_info.name}/RECORD,,\n"
+    )
+
+
+def _functions(tmp_path, installs):
+    functions = []
+    for fn, packages in installs.items():
+        for name, version, size in packages:
+            _install(tmp_path / fn, name, version, size)
+        functions.append(scan_function(fn, tmp_path / fn, TARGET))
+    return functions
+
+
+def test_scan_packages(tmp_path):
+    _install(tmp_path, "six", "1.16.0", 100)
+    _install(tmp_path, "Foo_Bar", "2.0", 10)
+    (tmp_path / "module.pyc").write_bytes(b"")
+    (tmp_path / "six-1.16.0.dist-info" / "RECORD").write_text("six/__init__.py,,\nmodule.py,,\n")
+    packages = scan_packages(tmp_path)
+    assert [(p.name, p.version) for p in packages] == [("foo-bar", "2.0"), ("six", "1.16.0")]
+    assert packages[1].entries == ["module.pyc", "six", "six-1.16.0.dist-info"]
+    assert packages[1].size >= 100
+
+
+def test_plan_layers(tmp_path):
+    functions = _functions(
+        tmp_path,
+        {
+            "a": [("big", "1", 3000), ("small", "1", 100), ("only_a", "1", 5000)],
+            "b": [("big", "1", 3000), ("small", "1", 100)],
+            "c": [("big", "1", 3000), ("other", "1", 2000)],
+            "d": [("big", "2", 3000), ("other", "1", 2000)],
+        },
+    )
+    plan = plan_layers(functions, min_savings=1000)
+    by_functions = {tuple(layer.functions): layer for layer in plan.layers.values()}
+    assert sorted(by_functions) == [("a", "b", "c"), ("c", "d")]
+    assert [n for n, _ in by_functions[("a", "b", "c")].packages] == ["big"]
+    assert plan.assignments["a"] == [by_functions[("a", "b", "c")].name]
+    assert len(plan.assignments["c"]) == 2
+    assert plan.saved >= 2 * 3000 + 2000
+
+    # names only depend on the contents of the layer
+    assert plan_layers(functions, min_savings=1000).layers.keys() == plan.layers.keys()
+    limited = plan_layers(functions, max_layers=1, min_savings=1000)
+    assert [len(v) for v in limited.assignments.values()] == [1, 1, 1, 0]
+    assert not plan_layers(functions, min_savings=10**6).layers
+    # the layer of a split build counts against the limit
+    split = [f._replace(layers=1) if f.name == "c" else f for f in functions]
+    limited = plan_layers(split, max_layers=2, min_savings=1000)
+    assert [len(v) for v in limited.assignments.values()] == [1, 1, 1, 0]
+
+
+def test_apply_plan(tmp_path):
+    functions = _functions(
+        tmp_path / "out",
+        {"a": [("big", "1", 3000), ("only_a", "1", 10)], "b": [("big", "1", 3000)]},
+    )
+    plan = plan_layers(functions, min_savings=0)
+    (tmp_path / "layers" / "layer-stale").mkdir(parents=True)
+    plan_file = apply_plan(plan, functions, tmp_path / "layers")
+    (name,) = plan.layers
+    assert sorted(p.name for p in (tmp_path / "layers").iterdir()) == sorted([PLAN_FILE, name])
+    layer_python = tmp_path / "layers" / name / "python"
+    assert (layer_python / "big" / "__init__.py").stat().st_size == 3000
+    assert (layer_python / "big-1.dist-info" / "RECORD").is_file()
+    assert sorted(p.name for p in (tmp_path / "out" / "a").iterdir()) == [
+        "only_a",
+        "only_a-1.dist-info",
+    ]
+    assert not list((tmp_path / "out" / "b").iterdir())
+    saved = json.loads(plan_file.read_text())
+    assert saved["functions"] == {"a": [name], "b": [name]}
+    assert saved["layers"][name]["packages"] == ["big==1"]
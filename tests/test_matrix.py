@@ -0,0 +1,118 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from aws_lambda_python_packager import matrix
+from aws_lambda_python_packager.matrix import (
+    Target,
+    build_matrix,
+    parse_matrix,
+    resolution_is_shared,
+    target_output_dir,
+)
+
+
+def test_parse_matrix():
+    assert parse_matrix("3.9,3.10:x86_64,arm64") == [
+        Target("3.9", "x86_64"),
+        Target("3.9", "arm64"),
+        Target("3.10", "x86_64"),
+        Target("3.10", "arm64"),
+    ]
+    assert parse_matrix("3.11") == [Target("3.11", "x86_64"), Target("3.11", "arm64")]
+    assert parse_matrix(" 3.12 : arm64 ") == [Target("3.12", "arm64")]
+    with pytest.raises(ValueError):
+        parse_matrix("3.9:mips")
+    with pytest.raises(ValueError):
+        parse_matrix(":x86_64")
+
+
+def test_target_output_dir(tmp_path):
+    assert target_output_dir(tmp_path, Target("3.9", "arm64")) == tmp_path / "python3.9-arm64"
+
+
+def test_resolution_is_shared(tmp_path):
+    # pip resolves against the wheels of the platform
+    (tmp_path / "requirements.txt").write_text("six==1.16.0\n")
+    assert not resolution_is_shared(tmp_path, {})
+    (tmp_path / "requirements.txt").unlink()
+    (tmp_path / "pyproject.toml").write_text("[tool.poetry]\n")
+    assert not resolution_is_shared(tmp_path, {})
+    (tmp_path / "poetry.lock").write_text("")
+    assert resolution_is_shared(tmp_path, {})
+    assert not resolution_is_shared(tmp_path, {"update_dependencies": True})
+    (tmp_path / "pyproject.toml").write_text(
+        "[tool.poetry.dependencies]\nnumpy = { version = '*', markers = \"platform_machine == 'x86_64'\" }\n"
+    )
+    assert not resolution_is_shared(tmp_path, {})
+
+
+class _Wheelhouse:
+    def __init__(self, calls, target):
+        self.calls = calls
+        self.target = target
+
+    def import_universal(self, other):
+        self.calls.append(("import_universal", self.target, other))
+        return 1
+
+
+class _Analyzer:
+    def __init__(self, calls, target):
+        self.calls = calls
+        self.target = target
+        self.wheelhouse = _Wheelhouse(calls, target)
+        self.requirements = {"six": f"six==1.16.0 # {target.architecture}"}
+        self.extra_lines = []
+
+    def use_requirements(self, requirements, extra_lines):
+        self.calls.append(("use_requirements", self.target, requirements, extra_lines))
+
+
+def _fake_packager(calls, fail=()):
+    class _Packager:
+        def __init__(self, project_path, output_dir, python_version, architecture, **kwargs):
+            self.target = Target(python_version, architecture)
+            self.output_dir = output_dir
+            self.analyzer = _Analyzer(calls, self.target)
+
+        def package(self, **kwargs):
+            calls.append(("package", self.target, kwargs))
+            if self.target in fail:
+                raise RuntimeError("boom")
+            return self.output_dir, None
+
+    return _Packager
+
+
+@pytest.mark.parametrize("shared", [True, False])
+def test_build_matrix(tmp_path, monkeypatch, shared):
+    calls = []
+    monkeypatch.setattr(matrix, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(matrix, "resolution_is_shared", lambda *args: shared)
+    monkeypatch.setattr(matrix, "Wheelhouse", lambda *args: args)
+    monkeypatch.setattr(
+        matrix, "LambdaPackager", _fake_packager(calls, fail=[Target("3.10", "x86_64")])
+    )
+    targets = parse_matrix("3.9,3.10")
+    results = build_matrix(targets, tmp_path, tmp_path / "out", {}, {"zip_output": True}, 1)
+
+    assert [r.target for r in results] == targets
+    assert results[0].outputs == (target_output_dir(tmp_path / "out", targets[0]), None)
+    assert [r.error for r in results] == [None, None, "boom", None]
+    # leaders first, then the other architectures
+    built = [c[1] for c in calls if c[0] == "package"]
+    assert built[:2] == [targets[0], targets[2]]
+    assert set(built[2:]) == {targets[1], targets[3]}
+    assert all(c[2] == {"zip_output": True} for c in calls if c[0] == "package")
+
+    reused = [c for c in calls if c[0] == "use_requirements"]
+    # the failed leader has no resolution to pass on
+    assert reused == (
+        [("use_requirements", targets[1], ["six==1.16.0 # x86_64"], [])] if shared else []
+    )
+    imported = {c[1:] for c in calls if c[0] == "import_universal"}
+    assert imported == {
+        (targets[1], ("3.9", "manylinux2014_x86_64")),
+        (targets[3], ("3.10", "manylinux2014_x86_64")),
+    }
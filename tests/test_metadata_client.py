@@ -0,0 +1,100 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+import requests
+
+from aws_lambda_python_packager.metadata_client import MetadataClient
+
+
+class _Handler(BaseHTTPRequestHandler):
+    requests_seen: list = []
+    fail = False
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        _Handler.requests_seen.append((self.path, self.headers.get("If-None-Match")))
+        if _Handler.fail:
+            self.send_response(403)
+            self.end_headers()
+        elif self.path.endswith("/missing.json"):
+            self.send_response(404)
+            self.end_headers()
+        elif self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+        else:
+            body = b'{"six": "1.16.0"}'
+            self.send_response(200)
+            self.send_header("ETag", '"v1"')
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    _Handler.requests_seen = []
+    _Handler.fail = False
+    httpd = HTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_metadata_client(server, tmp_path, monkeypatch):
+    monkeypatch.setenv("LAMBDA_PACKAGER_METADATA_URL", server)
+    client = MetadataClient(tmp_path)
+    url = "https://raw.githubusercontent.com/owner/repo/main/pkgs.json?x=1"
+    assert (
+        client.resolve_url(url)
+        == f"{server}/raw.githubusercontent.com/owner/repo/main/pkgs.json?x=1"
+    )
+
+    r = client.get(url)
+    assert r.json() == {"six": "1.16.0"} and not r.from_cache
+    assert _Handler.requests_seen == [
+        ("/raw.githubusercontent.com/owner/repo/main/pkgs.json?x=1", None)
+    ]
+
+    # fresh, no request
+    assert client.get(url).from_cache
+    assert len(_Handler.requests_seen) == 1
+
+    # expired, revalidated
+    r = client.get(url, ttl=0)
+    assert r.json() == {"six": "1.16.0"}
+    assert _Handler.requests_seen[-1][1] == '"v1"'
+
+    # refused, stale copy used while allowed
+    _Handler.fail = True
+    r = client.get(url, ttl=0)
+    assert r.stale and r.json() == {"six": "1.16.0"}
+    with pytest.raises(requests.HTTPError):
+        client.get(url, ttl=0, stale_if_error=0)
+
+    _Handler.fail = False
+    missing = "https://api.github.com/repos/owner/repo/missing.json"
+    assert client.get(missing).status_code == 404
+    assert client.get(missing).from_cache
+    with pytest.raises(requests.HTTPError):
+        client.get(missing).raise_for_status()
+
+
+def test_metadata_client_offline(tmp_path):
+    client = MetadataClient(tmp_path, base_url="http://127.0.0.1:9")
+    with pytest.raises(requests.ConnectionError):
+        client.get("https://example.com/runtimes.md", timeout=2)
+
+
+def test_metadata_client_cache_per_base_url(server, tmp_path):
+    url = "https://raw.githubusercontent.com/owner/repo/main/pkgs.json"
+    assert not MetadataClient(tmp_path, base_url=server).get(url).from_cache
+    assert MetadataClient(tmp_path, base_url=server).get(url).from_cache
+    # a different endpoint for the same URL is not answered from the first one's cache
+    assert not MetadataClient(tmp_path, base_url=f"{server}/mirror").get(url).from_cache
+    assert len(_Handler.requests_seen) == 2
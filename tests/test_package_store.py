@@ -0,0 +1,40 @@
+import os
+
+from aws_lambda_python_packager.file_index import FileIndex, apply_transforms, unshare
+from aws_lambda_python_packager.package_store import PackageStore
+from aws_lambda_python_packager.transforms import DEFAULT_UTIME, SetUtime
+
+from .test_wheel_installer import make_wheel
+
+
+def test_package_store(tmp_path):
+    wheel = make_wheel(
+        tmp_path / "demo-1.0-py3-none-any.whl", "demo", {"demo/__init__.py": "VALUE = 1\n"}
+    )
+    store = PackageStore(tmp_path / "store")
+    first = store.install(wheel, tmp_path / "first")
+    second = store.install(wheel, tmp_path / "second")
+    assert sorted(first.files) == sorted(second.files)
+    assert store.linked == 2 * len(first.files)
+    assert len(list((tmp_path / "store").glob("*/*/demo"))) == 1
+
+    installed = tmp_path / "second" / "demo" / "__init__.py"
+    assert os.stat(installed).st_nlink == 3
+    assert unshare(str(installed))
+    installed.write_text("VALUE = 2\n")
+    assert (tmp_path / "first" / "demo" / "__init__.py").read_text() == "VALUE = 1\n"
+    assert not unshare(str(installed))
+
+    assert store.prune(max_age=3600) == 0
+    assert store.prune(max_age=-1) == 1
+    assert not list((tmp_path / "store").glob("*/*/demo"))
+
+
+def test_set_utime_skips_current(tmp_path):
+    (tmp_path / "a.py").write_text("")
+    (tmp_path / "b.py").write_text("")
+    os.utime(tmp_path / "a.py", ns=(1, DEFAULT_UTIME))
+    index = FileIndex.scan(tmp_path)
+    apply_transforms(index, [SetUtime()])
+    assert os.stat(tmp_path / "a.py").st_atime_ns == 1
+    assert os.stat(tmp_path / "b.py").st_mtime_ns == DEFAULT_UTIME
@@ -0,0 +1,11 @@
+from aws_lambda_python_packager.pip_analyzer import PipAnalyzer
+
+
+def test_resolve_without_installing(tmp_path):
+    (tmp_path / "requirements.txt").write_text("six==1.16.0\n")
+    analyzer = PipAnalyzer(tmp_path, python_version="3.9")
+    installs = analyzer._resolve()  # pylint: disable=protected-access
+    assert [(i["metadata"]["name"], i["metadata"]["version"]) for i in installs] == [
+        ("six", "1.16.0")
+    ]
+    assert [tuple(r) for r in analyzer.get_requirements()] == [("six", "1.16.0", "six==1.16.0")]
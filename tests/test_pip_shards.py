@@ -0,0 +1,32 @@
+from aws_lambda_python_packager.pip_shards import merge_shards, split_shards
+
+
+def test_split_shards():
+    items = ["a", "b", "c", "d", "e"]
+    assert split_shards(items, 2, [10, 1, 1, 1, 8]) == [["a", "d"], ["b", "c", "e"]]
+    assert split_shards(items, 2, [0, 0, 0, 0, 0]) == [["a", "c", "e"], ["b", "d"]]
+    # unknown weights count as the average
+    assert split_shards(["a", "b", "c", "d"], 2, [6, 0, 0, 2]) == [["a", "d"], ["b", "c"]]
+    assert split_shards(["a"], 4) == [["a"]]
+
+
+def test_merge_shards(tmp_path):
+    shard0 = tmp_path / "shard-0"
+    shard1 = tmp_path / "shard-1"
+    for shard, pkg in ((shard0, "one"), (shard1, "two")):
+        (shard / pkg).mkdir(parents=True)
+        (shard / pkg / "__init__.py").write_text(pkg)
+        (shard / "ns").mkdir()
+        (shard / "ns" / f"{pkg}.py").write_text(pkg)
+        (shard / "ns" / "__init__.py").write_text("")
+        (shard / "bin").mkdir()
+        (shard / "bin" / "tool").write_text(pkg)
+    target = tmp_path / "target"
+
+    conflicts = merge_shards([shard0, shard1], target)
+
+    assert conflicts == [("bin/tool", "shard-0", "shard-1")]
+    assert (target / "one" / "__init__.py").read_text() == "one"
+    assert (target / "two" / "__init__.py").read_text() == "two"
+    assert sorted(p.name for p in (target / "ns").iterdir()) == ["__init__.py", "one.py", "two.py"]
+    assert (target / "bin" / "tool").read_text() == "one"
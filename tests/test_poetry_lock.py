@@ -0,0 +1,115 @@
+import shutil
+from pathlib import Path
+
+import pytest
+import toml
+
+from aws_lambda_python_packager.poetry_lock import (
+    UnsupportedLockError,
+    content_hash,
+    locked_requirements,
+    marker_environment,
+    poetry_constraint,
+    read_lock,
+)
+
+ROOT = Path(__file__).parent.parent
+
+
+def _lock(packages, poetry_config):
+    return {
+        "package": packages,
+        "metadata": {"lock-version": "2.0", "content-hash": content_hash(poetry_config)},
+    }
+
+
+def test_poetry_constraint():
+    def check(constraint, version):
+        return any(s.contains(version, prereleases=True) for s in poetry_constraint(constraint))
+
+    assert check("^1.2", "1.9.0") and not check("^1.2", "2.0")
+    assert check("^0.2.3", "0.2.9") and not check("^0.2.3", "0.3.0")
+    assert check("~1.2", "1.2.5") and not check("~1.2", "1.3")
+    assert check(">=3.7,<4.0", "3.9") and not check(">=3.7 <3.9", "3.9")
+    assert check("<3.8 || >=3.10", "3.11") and not check("<3.8 || >=3.10", "3.9")
+    assert check("*", "1.0") and check("1.2.*", "1.2.7") and check("1.0", "1.0")
+
+
+def test_read_lock():
+    poetry_config = {
+        "dependencies": {
+            "python": "^3.8",
+            "requests": {"version": "^2.28", "extras": ["socks"]},
+            "colorama": {"version": "*", "markers": "platform_system == 'Windows'"},
+            "dataclasses": {"version": "*", "python": "<3.7"},
+            "optional-pkg": {"version": "*", "optional": True},
+        }
+    }
+    packages = [
+        {
+            "name": "requests",
+            "version": "2.31.0",
+            "python-versions": ">=3.7",
+            "dependencies": {
+                "idna": ">=2.5,<4",
+                "pysocks": {"version": ">=1.5.6", "optional": True},
+                "chardet": {"version": ">=3.0.2,<6", "optional": True},
+            },
+            "extras": {"socks": ["PySocks (>=1.5.6,!=1.5.7)"], "use-chardet": ["chardet (>=3)"]},
+        },
+        {"name": "idna", "version": "3.4", "python-versions": ">=3.5"},
+        {"name": "pysocks", "version": "1.7.1", "python-versions": "*"},
+        {"name": "chardet", "version": "5.1.0", "python-versions": ">=3.7"},
+        {"name": "colorama", "version": "0.4.6", "python-versions": "*"},
+        {
+            "name": "numpy",
+            "version": "1.24.4",
+            "python-versions": ">=3.8,<3.9",
+        },
+        {"name": "numpy", "version": "1.26.0", "python-versions": ">=3.9"},
+    ]
+    lock = _lock(packages, poetry_config)
+    env = marker_environment("3.9", "arm64")
+    assert env["platform_machine"] == "aarch64"
+    assert read_lock({"tool": {"poetry": poetry_config}}, lock, env) == [
+        ("idna", "3.4"),
+        ("pysocks", "1.7.1"),
+        ("requests", "2.31.0"),
+    ]
+
+    poetry_config["dependencies"]["numpy"] = "*"
+    assert ("numpy", "1.24.4") in read_lock(
+        {"tool": {"poetry": poetry_config}}, lock, marker_environment("3.8")
+    )
+    assert ("numpy", "1.26.0") in read_lock(
+        {"tool": {"poetry": poetry_config}}, lock, marker_environment("3.10")
+    )
+
+    packages.append({"name": "idna", "version": "3.5", "python-versions": ">=3.5"})
+    with pytest.raises(UnsupportedLockError):
+        read_lock({"tool": {"poetry": poetry_config}}, lock, env)
+
+
+def test_read_lock_unsupported():
+    poetry_config = {"dependencies": {"python": "^3.8", "pkg": {"git": "https://x/pkg.git"}}}
+    lock = _lock([{"name": "pkg", "version": "1.0", "source": {"type": "git"}}], poetry_config)
+    with pytest.raises(UnsupportedLockError):
+        read_lock({"tool": {"poetry": poetry_config}}, lock, marker_environment("3.9"))
+
+
+def test_locked_requirements(tmp_path):
+    shutil.copy(ROOT / "pyproject.toml", tmp_path)
+    shutil.copy(ROOT / "poetry.lock", tmp_path)
+    reqs = locked_requirements(tmp_path, "3.9")
+    assert "requests==2.31.0" in reqs
+    assert "aiohttp==3.8.4" in reqs
+    # only required on windows
+    assert not any(r.startswith(("colorama==", "python-certifi-win32==")) for r in reqs)
+
+    pyproject = toml.load(tmp_path / "pyproject.toml")
+    pyproject["tool"]["poetry"]["dependencies"]["six"] = "*"
+    with open(tmp_path / "pyproject.toml", "w", encoding="utf8") as fh:
+        toml.dump(pyproject, fh)
+    assert locked_requirements(tmp_path, "3.9") is None
+    (tmp_path / "poetry.lock").unlink()
+    assert locked_requirements(tmp_path, "3.9") is None
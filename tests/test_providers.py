@@ -0,0 +1,127 @@
+import tarfile
+
+import pytest
+
+from aws_lambda_python_packager.providers import (
+    LocalDirectoryProvider,
+    TarballUrlProvider,
+    apply_providers,
+    installed_files,
+    provider_from_spec,
+    replace_package,
+)
+
+
+def _install(site, name, version, files):
+    dist_info = f"{name}-{version}.dist-info"
+    records = []
+    for rel_path, content in {**files, f"{dist_info}/METADATA": "Name: " + name}.items():
+        path = site / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+        records.append(f"{rel_path},,")
+    records += [f"{dist_info}/RECORD,,", f"../../bin/{name}-cli,,"]
+    (site / dist_info / "RECORD").write_text("\n".join(records) + "\n")
+
+
+@pytest.fixture
+def site(tmp_path):
+    site = tmp_path / "site"
+    _install(
+        site,
+        "numpy",
+        "1.26.0",
+        {
+            "numpy/__init__.py": "",
+            "numpy/core/_multiarray.so": "x" * 1000,
+            "numpy/tests/test_it.py": "",
+            "numpy.libs/libopenblas.so": "x" * 5000,
+        },
+    )
+    _install(site, "six", "1.16.0", {"six.py": "six"})
+    return site
+
+
+def test_installed_files(site):
+    files = installed_files(site, "NumPy")
+    assert "numpy/core/_multiarray.so" in files
+    assert "numpy-1.26.0.dist-info/RECORD" in files
+    assert not any(f.startswith("..") for f in files)
+    assert installed_files(site, "pandas") is None
+
+
+def test_replace_package(site, tmp_path):
+    tree = tmp_path / "build"
+    (tree / "numpy" / "core").mkdir(parents=True)
+    (tree / "numpy" / "__init__.py").write_text("slim")
+    (tree / "numpy" / "core" / "_multiarray.so").write_text("y" * 100)
+
+    removed, added = replace_package(site, "numpy", tree)
+    assert added == ["numpy"]
+    assert removed["numpy.libs/libopenblas.so"] == 5000
+    assert not (site / "numpy.libs").exists()
+    assert not (site / "numpy" / "tests").exists()
+    assert (site / "numpy" / "__init__.py").read_text() == "slim"
+    # the build has no metadata of its own
+    assert (site / "numpy-1.26.0.dist-info" / "METADATA").is_file()
+    assert (site / "numpy" / "core" / "_multiarray.so").stat().st_nlink > 1
+    assert sorted(p.name for p in site.iterdir()) == [
+        "numpy",
+        "numpy-1.26.0.dist-info",
+        "six-1.16.0.dist-info",
+        "six.py",
+    ]
+
+    with pytest.raises(ValueError):
+        replace_package(site, "pandas", tree)
+
+
+def test_apply_providers(site, tmp_path):
+    builds = tmp_path / "builds"
+    tree = builds / "numpy-1.26.0-py3.9-aarch64"
+    (tree / "numpy").mkdir(parents=True)
+    (tree / "numpy" / "__init__.py").write_text("slim")
+    (tree / "numpy-1.26.0.dist-info").mkdir()
+    (tree / "numpy-1.26.0.dist-info" / "RECORD").write_text("numpy/__init__.py,,\n")
+    provider = LocalDirectoryProvider(builds)
+
+    replacements = apply_providers(
+        site,
+        {"numpy": "1.26.0", "six": "1.16.0", "pandas": "2.0.0"},
+        [provider],
+        "python3.9",
+        "arm64",
+    )
+    assert [(r.name, r.provider) for r in replacements] == [("numpy", provider)]
+    assert replacements[0].size_before > 6000
+    assert replacements[0].size_after < 100
+    assert installed_files(site, "numpy") == ["numpy/__init__.py"]
+    assert (site / "six.py").is_file()
+
+    assert apply_providers(site, {"numpy": "1.26.0"}, [provider], "3.9", "x86_64") == []
+
+
+def test_tarball_url_provider(site, tmp_path):
+    source = tmp_path / "source" / "python" / "six.py"
+    source.parent.mkdir(parents=True)
+    source.write_text("slim six")
+    with tarfile.open(tmp_path / "six-1.16.0-x86_64.tar.gz", "w:gz") as tf:
+        tf.add(tmp_path / "source" / "python", "python")
+
+    provider = provider_from_spec(f"url:{tmp_path}/{{name}}-{{version}}-{{arch}}.tar.gz")
+    assert isinstance(provider, TarballUrlProvider)
+    assert provider.get_tree("six", "1.15.0", "3.9", "x86_64") is None
+    tree = provider.get_tree("six", "1.16.0", "3.9", "x86_64")
+    assert (tree / "six.py").read_text() == "slim six"
+
+    (tmp_path / "six-1.16.0-x86_64.tar.gz").unlink()
+    replacements = apply_providers(site, {"six": "1.16.0"}, [provider], "3.9", "x86_64")
+    assert [r.name for r in replacements] == ["six"]
+    assert (site / "six.py").read_text() == "slim six"
+
+
+def test_provider_from_spec(tmp_path):
+    assert isinstance(provider_from_spec(f"dir:{tmp_path}"), LocalDirectoryProvider)
+    assert provider_from_spec("github:owner/repo").spec == "github:owner/repo"
+    with pytest.raises(ValueError):
+        provider_from_spec("s3://bucket/key")
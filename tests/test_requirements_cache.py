@@ -0,0 +1,33 @@
+import os
+import time
+
+from aws_lambda_python_packager.requirements_cache import RequirementsCache
+
+
+def test_requirements_cache(tmp_path):
+    project = tmp_path / "project"
+    project.mkdir()
+    (project / "requirements.txt").write_text("six==1.16.0\n")
+    cache = RequirementsCache(tmp_path / "cache", max_age=60)
+
+    key = cache.key("pip", project, "3.9", "x86_64", {})
+    assert cache.key("pip", project, "3.9", "x86_64", {}) == key
+    assert cache.key("pip", project, "3.10", "x86_64", {}) != key
+    assert cache.key("pip", project, "3.9", "arm64", {}) != key
+    assert cache.key("pip", project, "3.9", "x86_64", {"boto3": "1.26.90"}) != key
+    assert cache.load(key) is None
+
+    cache.store(key, [("six", "1.16.0", "six==1.16.0")], [["--extra-index-url", "https://x"]])
+    assert cache.load(key) == (
+        [["six", "1.16.0", "six==1.16.0"]],
+        [["--extra-index-url", "https://x"]],
+    )
+    assert os.stat(cache.cache_dir / f"{key}.json").st_mode & 0o777 == 0o600
+
+    (project / "requirements.txt").write_text("six==1.15.0\n")
+    assert cache.key("pip", project, "3.9", "x86_64", {}) != key
+
+    old = time.time() - 120
+    os.utime(cache.cache_dir / f"{key}.json", (old, old))
+    assert cache.load(key) is None
+    assert cache.prune() == 1
@@ -0,0 +1,83 @@
+import gzip
+import json
+import os
+
+from aws_lambda_python_packager.file_index import FileIndex, apply_transforms
+from aws_lambda_python_packager.transforms import (
+    DEFAULT_UTIME,
+    CompressBoto,
+    SetUtime,
+    StripOtherFiles,
+    StripPython,
+    StripTests,
+)
+
+
+def make_tree(root, files):
+    for name, content in files.items():
+        p = root / name
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_text(content)
+
+
+def test_file_index_scan(tmp_path):
+    make_tree(tmp_path, {"a.py": "a = 1\n", "pkg/b.txt": "bb", "pkg/sub/c.so": "ccc"})
+    index = FileIndex.scan(tmp_path)
+    assert len(index) == 3
+    assert index.total_size == 11
+    assert index.get(os.path.join("pkg", "sub", "c.so")).parts == ("pkg", "sub", "c.so")
+
+
+def test_single_pass_transforms(tmp_path):
+    boto_json = {"version": "1.0", "operations": {"a": 1}}
+    make_tree(
+        tmp_path,
+        {
+            "pkg/__init__.py": "",
+            "pkg/__init__.pyc": "x",
+            "pkg/tests/test_a.pyc": "x",
+            "pkg/ext.pyx": "x",
+            "pkg/ext.pyi": "x",
+            "botocore/data/s3/2006-03-01/service-2.json": json.dumps(boto_json, indent=4),
+            "botocore/other/not-data.json": "{}",
+        },
+    )
+    index = FileIndex.scan(tmp_path)
+    apply_transforms(
+        index, [StripPython(), StripTests(), StripOtherFiles(), CompressBoto(), SetUtime()]
+    )
+    remaining = sorted(
+        str(p.relative_to(tmp_path)).replace(os.sep, "/")
+        for p in tmp_path.glob("**/*")
+        if p.is_file()
+    )
+    assert remaining == [
+        "botocore/data/s3/2006-03-01/service-2.json.gz",
+        "botocore/other/not-data.json",
+        "pkg/__init__.pyc",
+    ]
+    assert sorted(e.rel_path.replace(os.sep, "/") for e in index) == remaining
+    assert index.total_size == sum((tmp_path / p).stat().st_size for p in remaining)
+
+    gz = tmp_path / "botocore/data/s3/2006-03-01/service-2.json.gz"
+    with gzip.open(gz, "rt") as fh:
+        assert json.load(fh) == boto_json
+    assert all((tmp_path / p).stat().st_mtime_ns == DEFAULT_UTIME for p in remaining)
+
+
+def test_incremental_size(tmp_path):
+    make_tree(tmp_path, {"a.py": "a" * 100, "b.pyi": "b" * 10, "c/tests/d.txt": "d" * 5})
+    index = FileIndex.scan(tmp_path)
+    assert index.total_size == 115
+    transforms = [StripPython(), StripOtherFiles(), StripTests()]
+    apply_transforms(index, transforms)
+    assert [t.size_delta for t in transforms] == [-100, -10, -5]
+    assert index.total_size == 0
+
+    (tmp_path / "e").mkdir()
+    (tmp_path / "e" / "f.txt").write_text("f" * 7)
+    index.add_tree("e")
+    assert index.total_size == 7
+    assert index.remove_where(lambda e: e.parts[0] == "e") == 7
+    assert index.total_size == 0
+    assert (tmp_path / "e" / "f.txt").exists()
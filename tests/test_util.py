@@ -1,4 +1,11 @@
-from aws_lambda_python_packager.util import PLATFORMS, get_python_runtime
+import errno
+import os
+
+import pytest
+import requests
+
+from aws_lambda_python_packager import util
+from aws_lambda_python_packager.util import get_python_runtime, move_tree
 
 
 def to_platform_format(gpr_ret):
@@ -6,10 +13,68 @@ def to_platform_format(gpr_ret):
 
 
 def test_get_python_runtime():
-    assert to_platform_format(get_python_runtime()) in PLATFORMS
-    assert to_platform_format(get_python_runtime("arm64")) in PLATFORMS
-    assert to_platform_format(get_python_runtime("aarch64", (3, 2))) in PLATFORMS
+    # read in the test, not at import, so the runtime table is cached in the test's cache dir
+    platforms = util.get_platforms()
+    assert to_platform_format(get_python_runtime()) in platforms
+    assert to_platform_format(get_python_runtime("arm64")) in platforms
+    assert to_platform_format(get_python_runtime("aarch64", (3, 2))) in platforms
     assert to_platform_format(get_python_runtime(target_version="python3.8")) == (
         "python3.8",
         "x86_64",
     )
+
+
+def test_get_lambda_runtimes_offline(monkeypatch):
+    def _offline():
+        raise requests.ConnectionError("offline")
+
+    monkeypatch.setattr(util, "fetch_lambda_runtimes", _offline)
+    runtimes = util.get_lambda_runtimes()
+    assert ("python3.9", "x86_64") in runtimes
+    assert ("python3.9", "arm64") in runtimes
+
+
+def test_get_lambda_runtimes_cached(monkeypatch, cache_dir):
+    calls = []
+
+    def _fetch():
+        calls.append(1)
+        return [("python3.42", "x86_64")]
+
+    monkeypatch.setattr(util, "fetch_lambda_runtimes", _fetch)
+    assert util.get_lambda_runtimes() == [("python3.42", "x86_64")]
+    assert util.get_lambda_runtimes() == [("python3.42", "x86_64")]
+    assert len(calls) == 1
+
+    # expired cache is refreshed
+    cache_file = cache_dir / "lambda-runtimes.json"
+    os.utime(cache_file, (0, 0))
+    util.get_lambda_runtimes()
+    assert len(calls) == 2
+
+
+def test_move_tree(tmp_path):
+    src = tmp_path / "src"
+    (src / "pkg").mkdir(parents=True)
+    (src / "pkg" / "a.py").write_text("a")
+    assert move_tree(src, tmp_path / "dst") == "rename"
+    assert not src.exists()
+    assert (tmp_path / "dst" / "pkg" / "a.py").read_text() == "a"
+
+    (tmp_path / "other").mkdir()
+    (tmp_path / "other" / "b.py").write_text("b")
+    with pytest.raises(FileExistsError):
+        # existing, non-empty destinations are never merged into
+        move_tree(tmp_path / "other", tmp_path / "dst")
+
+
+def test_move_tree_across_devices(tmp_path, monkeypatch):
+    def _rename(src, dst):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "a.py").write_text("a")
+    monkeypatch.setattr(util.os, "rename", _rename)
+    assert move_tree(src, tmp_path / "dst") == "hardlink"
+    assert os.stat(tmp_path / "dst" / "a.py").st_nlink == 2
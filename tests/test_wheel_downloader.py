@@ -0,0 +1,120 @@
+import functools
+import hashlib
+import threading
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+import pytest
+from packaging.tags import Tag
+from packaging.version import Version
+
+from aws_lambda_python_packager.wheel_downloader import (
+    DownloadError,
+    IndexFile,
+    download_wheels,
+    parse_index_page,
+    select_wheel,
+    target_platforms,
+    target_tags,
+)
+
+
+def test_target_tags():
+    assert target_platforms("manylinux2014_aarch64") == [
+        "manylinux_2_17_aarch64",
+        "manylinux2014_aarch64",
+    ]
+    x86 = target_platforms("manylinux2014_x86_64")
+    assert x86[:2] == ["manylinux_2_17_x86_64", "manylinux2014_x86_64"]
+    assert "manylinux2010_x86_64" in x86 and x86[-1] == "manylinux1_x86_64"
+
+    supported = target_tags("3.9", "manylinux2014_x86_64")
+    assert supported[0] == Tag("cp39", "cp39", "manylinux_2_17_x86_64")
+    assert Tag("cp36", "abi3", "manylinux2010_x86_64") in supported
+    assert Tag("py3", "none", "any") in supported
+    assert Tag("cp310", "cp310", "manylinux2014_x86_64") not in supported
+
+
+def test_select_wheel():
+    files = [
+        IndexFile(name, f"https://files/{name}", None)
+        for name in (
+            "PyYAML-6.0.1.tar.gz",
+            "PyYAML-6.0.1-cp39-cp39-win_amd64.whl",
+            "PyYAML-6.0.1-cp39-cp39-manylinux_2_17_x86_64.manylinux2014_x86_64.whl",
+            "PyYAML-6.0.1-cp39-cp39-manylinux_2_5_x86_64.manylinux1_x86_64.whl",
+            "PyYAML-6.0-cp39-cp39-manylinux_2_17_x86_64.manylinux2014_x86_64.whl",
+        )
+    ]
+    supported = target_tags("3.9", "manylinux2014_x86_64")
+    assert select_wheel(files, Version("6.0.1"), supported) is files[2]
+    assert (
+        select_wheel(files, Version("6.0.1"), target_tags("3.9", "manylinux2014_aarch64")) is None
+    )
+
+
+def test_parse_index_page():
+    html = (
+        b'<html><body><a href="../../packages/six-1.16.0-py2.py3-none-any.whl#sha256=abc">'
+        b"six-1.16.0-py2.py3-none-any.whl</a></body></html>"
+    )
+    assert parse_index_page(html, "text/html", "https://index/simple/six/") == [
+        IndexFile(
+            "six-1.16.0-py2.py3-none-any.whl",
+            "https://index/packages/six-1.16.0-py2.py3-none-any.whl",
+            "abc",
+        )
+    ]
+    json_page = b'{"files": [{"filename": "a-1.0.tar.gz", "url": "a-1.0.tar.gz", "hashes": {}}]}'
+    assert parse_index_page(
+        json_page, "application/vnd.pypi.simple.v1+json", "https://index/simple/a/"
+    ) == [IndexFile("a-1.0.tar.gz", "https://index/simple/a/a-1.0.tar.gz", None)]
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def index(tmp_path):
+    root = tmp_path / "index"
+    (root / "simple" / "demo").mkdir(parents=True)
+    (root / "packages").mkdir()
+    httpd = HTTPServer(("127.0.0.1", 0), functools.partial(_QuietHandler, directory=str(root)))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield root, f"http://127.0.0.1:{httpd.server_port}/simple"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _publish(root, filename, content, sha256=None):
+    (root / "packages" / filename).write_bytes(content)
+    sha256 = sha256 or hashlib.sha256(content).hexdigest()
+    (root / "simple" / "demo" / "index.html").write_text(
+        f'<a href="../../packages/{filename}#sha256={sha256}">{filename}</a>'
+    )
+
+
+def test_download_wheels(index, tmp_path):
+    root, index_url = index
+    _publish(root, "demo-1.0-py3-none-any.whl", b"wheel")
+    dest = tmp_path / "dest"
+
+    result = download_wheels(
+        ["demo==1.0", "missing==2.0", "unpinned>=1"],
+        dest,
+        "3.9",
+        "manylinux2014_x86_64",
+        index_url,
+        retries=0,
+    )
+    assert result.downloaded == [dest / "demo-1.0-py3-none-any.whl"]
+    assert result.unresolved == ["missing==2.0", "unpinned>=1"]
+    assert (dest / "demo-1.0-py3-none-any.whl").read_bytes() == b"wheel"
+
+    _publish(root, "demo-1.0-py3-none-any.whl", b"tampered", hashlib.sha256(b"wheel!").hexdigest())
+    (dest / "demo-1.0-py3-none-any.whl").unlink()
+    with pytest.raises(DownloadError):
+        download_wheels(["demo==1.0"], dest, "3.9", "manylinux2014_x86_64", index_url, retries=0)
+    assert not list(dest.iterdir())
@@ -0,0 +1,73 @@
+import csv
+import os
+import stat
+from zipfile import ZipFile, ZipInfo
+
+import pytest
+
+from aws_lambda_python_packager.wheel_installer import (
+    WheelInstallError,
+    install_wheel,
+    install_wheels,
+)
+
+
+def make_wheel(path, name, files):
+    dist_info = f"{name}-1.0.dist-info"
+    with ZipFile(path, "w") as zf:
+        for arcname, content in files.items():
+            info = ZipInfo(arcname.format(data=f"{name}-1.0.data", dist_info=dist_info))
+            if arcname.endswith(".sh"):
+                info.external_attr = 0o755 << 16
+            zf.writestr(info, content)
+        zf.writestr(f"{dist_info}/METADATA", f"Name: {name}\nVersion: 1.0\n")
+        zf.writestr(f"{dist_info}/RECORD", "stale,,\n")
+    return path
+
+
+def test_install_wheel(tmp_path):
+    wheel = make_wheel(
+        tmp_path / "demo-1.0-py3-none-any.whl",
+        "demo",
+        {
+            "demo/__init__.py": "VALUE = 1\n",
+            "{data}/platlib/demo_ext/mod.py": "",
+            "{data}/scripts/run.sh": "#!python\nprint('hi')\n",
+            "{dist_info}/entry_points.txt": "[console_scripts]\ndemo-cli = demo.cli:main\n",
+        },
+    )
+    target = tmp_path / "target"
+    installed = install_wheel(wheel, target)
+
+    assert (target / "demo" / "__init__.py").read_text() == "VALUE = 1\n"
+    assert (target / "demo_ext" / "mod.py").exists()
+    script = target / "bin" / "run.sh"
+    assert script.read_text().startswith("#!/usr/bin/env python3\n")
+    assert script.stat().st_mode & stat.S_IXUSR
+    assert "from demo.cli import main" in (target / "bin" / "demo-cli").read_text()
+    assert (target / "demo-1.0.dist-info" / "INSTALLER").read_text() == "lambda-packager\n"
+
+    with open(target / "demo-1.0.dist-info" / "RECORD", encoding="utf8") as fh:
+        record = {row[0]: row for row in csv.reader(fh)}
+    assert set(record) == set(installed.files)
+    assert record["demo/__init__.py"][2] == "10"
+    assert record["demo/__init__.py"][1].startswith("sha256=")
+    assert record["demo-1.0.dist-info/RECORD"] == ["demo-1.0.dist-info/RECORD", "", ""]
+    assert "stale" not in record
+
+
+def test_install_wheels_parallel(tmp_path):
+    wheels = [
+        make_wheel(tmp_path / f"pkg{n}-1.0-py3-none-any.whl", f"pkg{n}", {f"pkg{n}/a.py": ""})
+        for n in range(5)
+    ]
+    install_wheels(wheels, tmp_path / "target", workers=3)
+    assert sorted(os.listdir(tmp_path / "target")) == sorted(
+        [f"pkg{n}" for n in range(5)] + [f"pkg{n}-1.0.dist-info" for n in range(5)]
+    )
+
+
+def test_unsafe_wheel(tmp_path):
+    wheel = make_wheel(tmp_path / "evil-1.0-py3-none-any.whl", "evil", {"../escape.py": ""})
+    with pytest.raises(WheelInstallError):
+        install_wheel(wheel, tmp_path / "target")
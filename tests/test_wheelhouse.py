@@ -0,0 +1,64 @@
+import os
+import time
+
+from packaging.version import Version
+
+from aws_lambda_python_packager.wheelhouse import Wheelhouse, parse_pin
+
+
+def test_parse_pin():
+    assert parse_pin("six==1.16.0") == ("six", Version("1.16.0"), True)
+    assert parse_pin('PyYAML==6.0.1 ; python_version >= "3.6"') == (
+        "pyyaml",
+        Version("6.0.1"),
+        True,
+    )
+    assert not parse_pin('colorama==0.4.6 ; python_version < "3"').applies
+    assert parse_pin("requests>=2") is None
+    assert parse_pin("requests==2.*") is None
+    assert parse_pin("pkg @ https://example.com/pkg-1.0.tar.gz") is None
+    assert parse_pin("--extra-index-url https://example.com") is None
+
+
+def test_wheelhouse(tmp_path):
+    wheelhouse = Wheelhouse("3.9", "manylinux2014_x86_64", path=tmp_path, max_age=60)
+    (tmp_path / "six-1.16.0-py2.py3-none-any.whl").write_bytes(b"")
+    (tmp_path / "PyYAML-6.0.1.tar.gz").write_bytes(b"")
+    old = tmp_path / "attrs-20.0.0-py3-none-any.whl"
+    old.write_bytes(b"")
+    os.utime(old, (time.time() - 120, time.time() - 120))
+
+    reqs = [
+        "six==1.16.0",
+        "pyyaml==6.0.1",
+        "attrs==23.1.0",
+        'colorama==0.4.6 ; python_version < "3"',
+    ]
+    assert wheelhouse.missing(reqs) == ["attrs==23.1.0"]
+    assert wheelhouse.missing(reqs + ["requests"]) is None
+
+    assert wheelhouse.touch(reqs) == 2
+    assert wheelhouse.prune() == 1
+    assert not old.exists()
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_import_universal(tmp_path):
+    x86 = Wheelhouse("3.9", "manylinux2014_x86_64", path=tmp_path / "x86_64")
+    arm = Wheelhouse("3.9", "manylinux2014_aarch64", path=tmp_path / "aarch64")
+    for name in (
+        "six-1.16.0-py2.py3-none-any.whl",
+        "PyYAML-6.0.1-cp39-cp39-manylinux_2_17_x86_64.manylinux2014_x86_64.whl",
+        "PyYAML-6.0.1.tar.gz",
+    ):
+        (x86.path / name).write_bytes(b"")
+    (arm.path / "attrs-23.1.0-py3-none-any.whl").write_bytes(b"arm")
+    (x86.path / "attrs-23.1.0-py3-none-any.whl").write_bytes(b"x86")
+
+    assert arm.import_universal(x86) == 1
+    assert sorted(p.name for p in arm.path.iterdir()) == [
+        "attrs-23.1.0-py3-none-any.whl",
+        "six-1.16.0-py2.py3-none-any.whl",
+    ]
+    assert (arm.path / "attrs-23.1.0-py3-none-any.whl").read_bytes() == b"arm"
+    assert arm.import_universal(x86) == 0